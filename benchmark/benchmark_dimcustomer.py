@@ -0,0 +1,335 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "pyspark==3.5.7",
+#     "pyarrow",
+#     "snowflake-snowpark-python[pandas]>=1.40.0",
+# ]
+# ///
+
+# Cross-engine benchmark for the DimCustomer pipeline ports.
+#
+# The repo holds three implementations of the same job, and the Spark one
+# has a second, in-process engine. The benchmark runs the ones it can run
+# locally:
+#   spark    - pipeline-spark/source_code (PySpark + JDBC to SQL Server)
+#   arrow    - the in-process PyArrow engine of the Spark port for small
+#              exports (pipeline-spark/source_code/dimcustomer_arrow.py)
+#   snowpark - myprojects/_golden_copy/pipeline-snowpark/source_code (Snowpark API)
+#
+# The Snowpark Connect port (pipeline-connect/source_code) is not included:
+# its schema and transformation modules are the Spark port's, so on a local
+# engine it would measure local Spark again, and its real engine is a
+# Snowflake account.
+#
+# For every export size the benchmark writes a synthetic POS export (with
+# generate_customer_update.py) and runs each port's own schema and
+# transformation modules against it, reading the csv and writing the
+# transformed rows to a local stand-in target:
+#   spark    - local-mode Spark, written to the "noop" sink
+#   arrow    - PyArrow in the worker process; the rows are turned into the
+#              Python values the pymssql INSERTs would send
+#   snowpark - Snowpark local testing mode, written with save_as_table into
+#              the emulated (in-memory) table. A port whose packages are not
+#              installed is reported as skipped instead of measured.
+#
+# Each port runs in its own subprocess (the ports share module names) and
+# repeats the job; the report gives throughput, latency percentiles over
+# the repetitions and the peak memory of the subprocess tree (Python plus
+# the Spark JVM).
+#
+# The stand-ins measure the client side and the transformation logic, not
+# the warehouses: Snowpark local testing evaluates the plan with pandas
+# instead of pushing SQL to Snowflake, so its numbers are only comparable
+# between runs of the same port.
+#
+# Usage:
+#   python benchmark/benchmark_dimcustomer.py --sizes 10000,100000,1000000
+#   python benchmark/benchmark_dimcustomer.py --sizes 10000000 --ports spark,arrow --repeat 3
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+from generate_customer_update import generate_file
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PORTS = {
+    'spark': ('spark', os.path.join(REPO_ROOT, 'pipeline-spark', 'source_code')),
+    'arrow': ('arrow', os.path.join(REPO_ROOT, 'pipeline-spark', 'source_code')),
+    'snowpark': ('snowpark', os.path.join(REPO_ROOT, 'myprojects', '_golden_copy', 'pipeline-snowpark', 'source_code')),
+}
+
+PERCENTILES = [50, 90, 99]
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Workers (run in a subprocess per port)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def run_spark(input_path, repeat, warmup):
+    from pyspark.sql import SparkSession
+    from dimcustomer_schema import customer_update_schema
+    from dimcustomer_transform import transform_customer_update
+
+    spark = SparkSession.builder.master('local[*]') \
+                        .appName('DimCustomerBenchmark') \
+                        .config('spark.ui.enabled', 'false') \
+                        .getOrCreate()
+    spark.sparkContext.setLogLevel('ERROR')
+
+    timings = []
+    for i in range(warmup + repeat):
+        started = time.perf_counter()
+        df = spark.read.csv(input_path, header=True, schema=customer_update_schema())
+        transform_customer_update(df).write.format('noop').mode('overwrite').save()
+        if i >= warmup:
+            timings.append(time.perf_counter() - started)
+    spark.stop()
+    return timings
+
+
+def run_arrow(input_path, repeat, warmup):
+    from dimcustomer_arrow import read_customer_update
+    from dimcustomer_arrow import transform_customer_update
+
+    timings = []
+    for i in range(warmup + repeat):
+        started = time.perf_counter()
+        table = transform_customer_update(read_customer_update(input_path))
+        # Stand-in for the INSERTs: materialize the rows as Python values.
+        for batch in table.to_batches(max_chunksize=10000):
+            list(zip(*[column.to_pylist() for column in batch.columns]))
+        if i >= warmup:
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _patch_snowpark_local_testing():
+    """Emulate the functions the transformation uses that local testing lacks.
+
+    Same semantics as in Snowflake: SPLIT_PART and REPLACE match literally,
+    SPLIT_PART returns an empty string past the last part.
+    """
+    import pandas as pd
+    from snowflake.snowpark import functions
+    from snowflake.snowpark.mock import ColumnEmulator
+    from snowflake.snowpark.mock import ColumnType
+    from snowflake.snowpark.mock import patch
+    from snowflake.snowpark.types import StringType
+
+    def string_column(values):
+        column = ColumnEmulator(values)
+        column.sf_type = ColumnType(StringType(), True)
+        return column
+
+    @patch(functions.trim)
+    def trim(e, trim_string=None):
+        return string_column(e.str.strip())
+
+    @patch(functions.split_part)
+    def split_part(string, delimiter, part_number):
+        def part(value, separator, number):
+            parts = value.split(separator)
+            return parts[number - 1] if number <= len(parts) else ''
+        return string_column([None if pd.isna(value) else part(value, separator, int(number))
+                              for value, separator, number in zip(string, delimiter, part_number)])
+
+    @patch(functions.replace)
+    def replace(subject, pattern, replacement=''):
+        return string_column([None if pd.isna(value) else value.replace(old, new)
+                              for value, old, new in zip(subject, pattern, replacement)])
+
+
+def run_snowpark(input_path, repeat, warmup):
+    from snowflake.snowpark import Session
+    from dimcustomer_schema import customer_update_schema
+    from dimcustomer_transform import transform_customer_update
+
+    # Local testing reads the stage with pandas and warns about its own
+    # converters on every read; keep the benchmark output readable.
+    warnings.simplefilter('ignore')
+    _patch_snowpark_local_testing()
+    session = Session.builder.config('local_testing', True).create()
+
+    timings = []
+    for i in range(warmup + repeat):
+        started = time.perf_counter()
+        session.file.put(input_path, '@benchmark_stage', auto_compress=False, overwrite=True)
+        df = session.read.schema(customer_update_schema()) \
+            .options({"SKIP_HEADER": 1, "FIELD_OPTIONALLY_ENCLOSED_BY": '"'}) \
+            .csv('@benchmark_stage/%s' % os.path.basename(input_path))
+        transform_customer_update(df).write.mode('overwrite').save_as_table('DIMCUSTOMER')
+        if i >= warmup:
+            timings.append(time.perf_counter() - started)
+    session.close()
+    return timings
+
+
+def worker_main(port, input_path, repeat, warmup):
+    engine, source_dir = PORTS[port]
+    # Import the port's own schema/transformation modules.
+    sys.path.insert(0, source_dir)
+    run = {'spark': run_spark, 'arrow': run_arrow, 'snowpark': run_snowpark}[engine]
+    try:
+        timings = run(input_path, repeat, warmup)
+    except ModuleNotFoundError as e:
+        print(json.dumps({'skipped': "Python module '%s' is not installed" % e.name}))
+        return
+    print(json.dumps({'timings': timings}))
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Measurement
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _process_tree_rss(pid):
+    """Resident memory in bytes of `pid` and all its descendants (Linux /proc)."""
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    parents, rss = {}, {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                # Fields after the command name: state, ppid, ..., rss is the 22nd.
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        parents[int(entry)] = int(fields[1])
+        rss[int(entry)] = int(fields[21]) * page_size
+
+    tree = {pid}
+    for child in sorted(parents):
+        ancestor = parents[child]
+        while ancestor not in tree and ancestor in parents and ancestor != 0:
+            ancestor = parents[ancestor]
+        if ancestor in tree:
+            tree.add(child)
+    return sum(rss.get(p, 0) for p in tree)
+
+
+def run_worker(port, input_path, repeat, warmup, sample_interval=0.1):
+    """Run one port in a subprocess; return its result line and peak memory in bytes."""
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', port,
+                                '--input', input_path, '--repeat', str(repeat), '--warmup', str(warmup)],
+                               stdout=subprocess.PIPE, text=True)
+    peak = [0]
+
+    def sample():
+        while process.poll() is None:
+            try:
+                peak[0] = max(peak[0], _process_tree_rss(process.pid))
+            except OSError:
+                pass
+            time.sleep(sample_interval)
+
+    sampler = None
+    if os.path.isdir('/proc'):
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+    stdout, _ = process.communicate()
+    if sampler:
+        sampler.join()
+    if process.returncode != 0:
+        raise RuntimeError("%s worker failed with exit code %d" % (port, process.returncode))
+    if not peak[0]:
+        # No /proc: fall back to the largest single child process (KiB on Linux, bytes on macOS).
+        max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peak[0] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+    return json.loads(stdout.strip().splitlines()[-1]), peak[0]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values`."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(port, rows, timings, peak_rss):
+    result = {'port': port, 'rows': rows, 'repeat': len(timings),
+              'timings_s': [round(t, 4) for t in timings],
+              'throughput_rows_s': round(rows / percentile(timings, 50)),
+              'peak_rss_mb': round(peak_rss / 1024 / 1024, 1)}
+    for pct in PERCENTILES:
+        result['p%d_s' % pct] = round(percentile(timings, pct), 4)
+    return result
+
+
+def print_report(results):
+    header = ['port', 'rows', 'repeat', 'rows/s'] + ['p%d s' % p for p in PERCENTILES] + ['peak MB']
+    rows = [[r['port'], r['rows'], r['repeat'], r['throughput_rows_s']] +
+            [r['p%d_s' % p] for p in PERCENTILES] + [r['peak_rss_mb']] for r in results if 'skipped' not in r]
+    widths = [max(len(str(v)) for v in column) for column in zip(header, *rows)]
+    for line in [header] + rows:
+        print('  '.join(str(v).rjust(w) for v, w in zip(line, widths)))
+    for r in results:
+        if 'skipped' in r:
+            print("%s on %d rows: skipped, %s" % (r['port'], r['rows'], r['skipped']))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DimCustomer pipeline ports against local stand-ins.")
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help="Comma-separated export sizes in rows (default: %(default)s)")
+    parser.add_argument('--ports', default=','.join(PORTS),
+                        help="Comma-separated ports to run (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="Measured repetitions per port and size (default: %(default)s)")
+    parser.add_argument('--warmup', type=int, default=1,
+                        help="Unmeasured warm-up repetitions (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the synthetic exports (default: %(default)s)")
+    parser.add_argument('--work-dir', default=None,
+                        help="Where to write the synthetic exports (default: a temporary directory)")
+    parser.add_argument('--output', default=None, help="Also write the results as JSON to this file")
+    parser.add_argument('--worker', choices=list(PORTS), help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.worker:
+        worker_main(args.worker, args.input, args.repeat, args.warmup)
+        return
+
+    ports = [port.strip() for port in args.ports.split(',')]
+    unknown = [port for port in ports if port not in PORTS]
+    if unknown:
+        raise SystemExit("Unknown port(s): %s (expected %s)" % (', '.join(unknown), ', '.join(PORTS)))
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='dimcustomer-benchmark-')
+    os.makedirs(work_dir, exist_ok=True)
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(',')]:
+        input_path = os.path.join(work_dir, 'customer_update_%d.csv' % size)
+        if not os.path.exists(input_path):
+            print("Generating %d rows -> %s" % (size, input_path), file=sys.stderr)
+            generate_file(input_path, size, seed=args.seed)
+        for port in ports:
+            print("Running %s on %d rows..." % (port, size), file=sys.stderr)
+            result, peak_rss = run_worker(port, input_path, args.repeat, args.warmup)
+            if 'skipped' in result:
+                print("Skipping %s: %s" % (port, result['skipped']), file=sys.stderr)
+                results.append({'port': port, 'rows': size, 'skipped': result['skipped']})
+            else:
+                results.append(summarize(port, size, result['timings'], peak_rss))
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
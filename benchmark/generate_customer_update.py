@@ -0,0 +1,256 @@
+# Synthetic POS "new customer" exports in the customer_update.csv format.
+#
+# reset_source/customer_update.csv only holds a handful of rows; this tool
+# writes exports of any size for load-testing the pipelines:
+#
+#   - same 27 columns, header (with the UTF-8 BOM of the POS export) and
+#     encoded NAME field ("name:last:<last>.first:<first>")
+#   - values drawn from the AdventureWorks DimCustomer demographics
+#     (education, occupation, income, children, cars, commute distance, ...)
+#   - deterministic: the same --seed always produces the same files, and
+#     every file has its own seed, so files can be generated in parallel
+#   - written in chunks, so multi-GB exports never sit in memory
+#   - optionally split across many files and/or gzip-compressed (with a
+#     fixed gzip header, so compressed output is byte-for-byte repeatable)
+#
+# Usage:
+#   python benchmark/generate_customer_update.py --rows 1000000 --output-dir landing
+#   python benchmark/generate_customer_update.py --rows 50000000 --files 50 --gzip --jobs 8 --output-dir /data/exports
+
+import argparse
+import codecs
+import csv
+import gzip
+import io
+import itertools
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+EXPORT_COLUMNS = ['Name', 'Address', 'Gender', 'MiddleName', 'CustomerKey', 'GeographyKey',
+                  'CustomerAlternateKey', 'Title', 'Namestyle', 'Birthdate', 'MaritalStatus', 'Suffix',
+                  'EmailAddress', 'YearlyIncome', 'TotalChildren', 'NumberChildrenAtHome',
+                  'EnglishEducation', 'SpanishEducation', 'FrenchEducation', 'EnglishOccupation',
+                  'SpanishOccupation', 'FrenchOccupation', 'HouseOwnerFlag', 'NumberCarsOwned', 'Phone',
+                  'DateFirstPurchase', 'CommuteDistance']
+
+# First CustomerKey of AdventureWorks DimCustomer.
+FIRST_CUSTOMER_KEY = 11000
+
+# Distributions of AdventureWorks DimCustomer: (value, weight in %).
+EDUCATION = [(('Bachelors', 'Licenciatura', 'Bac + 4'), 29),
+             (('Partial College', 'Estudios universitarios (en curso)', 'Bac + 2'), 27),
+             (('High School', 'Educación secundaria', 'Bac'), 18),
+             (('Graduate Degree', 'Estudios de postgrado', 'Bac + 3'), 17),
+             (('Partial High School', 'Educación secundaria (en curso)', 'Niveau bac'), 9)]
+OCCUPATION = [(('Professional', 'Profesional', 'Cadre'), 30),
+              (('Skilled Manual', 'Obrero especializado', 'Technicien'), 25),
+              (('Management', 'Gestión', 'Direction'), 17),
+              (('Clerical', 'Administrativo', 'Employé'), 16),
+              (('Manual', 'Obrero', 'Ouvrier'), 12)]
+YEARLY_INCOME = [(10000, 7), (20000, 9), (30000, 17), (40000, 14), (50000, 4), (60000, 16), (70000, 12),
+                 (80000, 8), (90000, 5), (100000, 3), (110000, 1), (120000, 2), (130000, 2), (150000, 1),
+                 (170000, 1)]
+TOTAL_CHILDREN = [(0, 28), (1, 20), (2, 20), (3, 12), (4, 12), (5, 8)]
+NUMBER_CARS_OWNED = [(0, 23), (1, 26), (2, 35), (3, 9), (4, 7)]
+COMMUTE_DISTANCE = [('0-1 Miles', 34), ('1-2 Miles', 17), ('2-5 Miles', 17), ('5-10 Miles', 19),
+                    ('10+ Miles', 13)]
+MARITAL_STATUS = [('M', 54), ('S', 46)]
+GENDER = [('Male', 51), ('Female', 49)]
+HOUSE_OWNER_FLAG = [(1, 68), (0, 32)]
+TITLE = [('', 99), ('Mr.', 1)]
+SUFFIX = [('', 99), ('Jr.', 1)]
+
+FIRST_NAMES = {
+    'Male': ['Jon', 'Eugene', 'Ruben', 'Fernando', 'Kuo', 'Brandon', 'Adam', 'Alexander', 'Blake', 'Carlos',
+             'Charles', 'Daniel', 'Dylan', 'Edward', 'Ethan', 'Gabriel', 'Ian', 'Isaiah', 'Jacob', 'James',
+             'Jose', 'Luis', 'Marcus', 'Nathan', 'Richard', 'Robert', 'Seth', 'Wyatt'],
+    'Female': ['Christy', 'Elizabeth', 'Janet', 'Shannon', 'Jacquelyn', 'Lauren', 'Ana', 'Abigail',
+               'Alexandra', 'Alyssa', 'Amanda', 'Chloe', 'Destiny', 'Emily', 'Grace', 'Hannah', 'Isabella',
+               'Jessica', 'Katherine', 'Madison', 'Megan', 'Morgan', 'Natalie', 'Olivia', 'Sydney'],
+}
+LAST_NAMES = ['Yang', 'Huang', 'Torres', 'Zhu', 'Johnson', 'Ruiz', 'Alvarez', 'Mehta', 'Verhoff', 'Carlson',
+              'Suarez', 'Lu', 'Walker', 'Jenkins', 'Bennett', 'Diaz', 'Gonzalez', 'Martinez', 'Perez', 'Sanchez',
+              'Hernandez', 'Lopez', 'Rodriguez', 'Chen', 'Li', 'Wang', 'Xu', 'Lee', 'Smith', 'Brown', 'Miller',
+              'Davis', 'Garcia', 'Wilson', 'Anderson', 'Lun Lo', 'Cardoce', 'Carver', 'Shan', 'Kumar']
+STREETS = ['Marsh Rd', 'Rainbow Dr', 'Morning Glory Dr', 'Hill Drive', 'Mt. Dell', 'Trailview Circle',
+           'Clayton Way', 'Virgil Street', 'Woodcrest Dr.', 'Shangri-la Rd.', 'Pine Creek Way', 'Sierra Ridge',
+           'Mcnutt Ave', 'Cedar Point South', 'Alpine Drive', 'Oak Grove Rd', 'Crown Court', 'Ravenwood']
+MIDDLE_INITIALS = [('', 42)] + [('%s.' % letter, 58 / 26) for letter in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ']
+
+# Geography keys of AdventureWorks DimGeography.
+GEOGRAPHY_KEYS = (1, 655)
+BIRTH_YEARS = (1916, 1986)
+FIRST_PURCHASE_YEARS = (2010, 2014)
+
+DEFAULT_CHUNK_ROWS = 50000
+
+
+class _Weighted:
+    """Weighted choice with precomputed cumulative weights."""
+
+    def __init__(self, pairs):
+        self.values = [value for value, _ in pairs]
+        self.cum_weights = list(itertools.accumulate(weight for _, weight in pairs))
+
+    def draw(self, rng, k):
+        return rng.choices(self.values, cum_weights=self.cum_weights, k=k)
+
+
+_EDUCATION = _Weighted(EDUCATION)
+_OCCUPATION = _Weighted(OCCUPATION)
+_YEARLY_INCOME = _Weighted(YEARLY_INCOME)
+_TOTAL_CHILDREN = _Weighted(TOTAL_CHILDREN)
+_NUMBER_CARS_OWNED = _Weighted(NUMBER_CARS_OWNED)
+_COMMUTE_DISTANCE = _Weighted(COMMUTE_DISTANCE)
+_MARITAL_STATUS = _Weighted(MARITAL_STATUS)
+_GENDER = _Weighted(GENDER)
+_HOUSE_OWNER_FLAG = _Weighted(HOUSE_OWNER_FLAG)
+_TITLE = _Weighted(TITLE)
+_SUFFIX = _Weighted(SUFFIX)
+_MIDDLE_INITIAL = _Weighted(MIDDLE_INITIALS)
+
+
+def _dates(rng, years, k):
+    first, last = years
+    return ['%d-%02d-%02d' % (rng.randint(first, last), rng.randint(1, 12), rng.randint(1, 28))
+            for _ in range(k)]
+
+
+def customer_rows(rng, first_key, k):
+    """Return `k` export rows with consecutive CustomerKeys from `first_key`.
+
+    Values are drawn a column at a time, which is several times faster than
+    drawing them row by row.
+    """
+    keys = range(first_key, first_key + k)
+    genders = _GENDER.draw(rng, k)
+    first_names = [rng.choice(FIRST_NAMES[gender]) for gender in genders]
+    last_names = rng.choices(LAST_NAMES, k=k)
+    total_children = _TOTAL_CHILDREN.draw(rng, k)
+    return zip(
+        ['name:last:%s.first:%s' % names for names in zip(last_names, first_names)],
+        ['%d %s' % address for address in zip(rng.choices(range(1, 10000), k=k), rng.choices(STREETS, k=k))],
+        genders,
+        _MIDDLE_INITIAL.draw(rng, k),
+        keys,
+        rng.choices(range(GEOGRAPHY_KEYS[0], GEOGRAPHY_KEYS[1] + 1), k=k),
+        ['AW%08d' % key for key in keys],
+        _TITLE.draw(rng, k),
+        itertools.repeat(0, k),
+        _dates(rng, BIRTH_YEARS, k),
+        _MARITAL_STATUS.draw(rng, k),
+        _SUFFIX.draw(rng, k),
+        ['%s%d@adventure-works.com' % (name.lower(), key % 100) for name, key in zip(first_names, keys)],
+        _YEARLY_INCOME.draw(rng, k),
+        total_children,
+        [rng.randint(0, children) for children in total_children],
+        *zip(*_EDUCATION.draw(rng, k)),
+        *zip(*_OCCUPATION.draw(rng, k)),
+        _HOUSE_OWNER_FLAG.draw(rng, k),
+        _NUMBER_CARS_OWNED.draw(rng, k),
+        ['%d-555-%04d' % phone for phone in zip(rng.choices(range(100, 1000), k=k),
+                                               rng.choices(range(10000), k=k))],
+        _dates(rng, FIRST_PURCHASE_YEARS, k),
+        _COMMUTE_DISTANCE.draw(rng, k),
+    )
+
+
+def _open_output(path, compress):
+    raw = open(path, 'wb')
+    if compress:
+        # filename='' and mtime=0 keep the gzip header identical between runs.
+        return raw, gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0)
+    return raw, raw
+
+
+def generate_file(path, rows, first_key=FIRST_CUSTOMER_KEY, seed=42, compress=False,
+                  chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Write one export with `rows` customers starting at `first_key`, `chunk_rows` at a time."""
+    rng = random.Random(seed)
+    raw, out = _open_output(path, compress)
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        # The POS export is written with a UTF-8 byte order mark.
+        out.write(codecs.BOM_UTF8)
+        writer.writerow(EXPORT_COLUMNS)
+        for chunk_start in range(0, max(rows, 1), chunk_rows):
+            writer.writerows(customer_rows(rng, first_key + chunk_start, min(chunk_rows, rows - chunk_start)))
+            out.write(buffer.getvalue().encode('utf-8'))
+            buffer.seek(0)
+            buffer.truncate()
+    finally:
+        if out is not raw:
+            out.close()
+        raw.close()
+    return path
+
+
+def export_paths(output_dir, files=1, compress=False, prefix='customer_update'):
+    """File names of an export: customer_update.csv, or customer_update_0001.csv ... when split."""
+    extension = '.csv.gz' if compress else '.csv'
+    if files == 1:
+        return [os.path.join(output_dir, prefix + extension)]
+    width = max(4, len(str(files)))
+    return [os.path.join(output_dir, '%s_%0*d%s' % (prefix, width, i + 1, extension)) for i in range(files)]
+
+
+def generate_export(output_dir, rows, files=1, seed=42, compress=False, first_key=FIRST_CUSTOMER_KEY,
+                    chunk_rows=DEFAULT_CHUNK_ROWS, jobs=1, prefix='customer_update'):
+    """Write `rows` customers split evenly over `files` files in `output_dir`.
+
+    CustomerKeys are consecutive across the files. Returns the file paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = export_paths(output_dir, files, compress, prefix)
+    tasks = []
+    next_key = first_key
+    for i, path in enumerate(paths):
+        file_rows = rows // files + (1 if i < rows % files else 0)
+        # Every file gets its own seed, derived from the export seed.
+        tasks.append((path, file_rows, next_key, seed * 1000003 + i, compress, chunk_rows))
+        next_key += file_rows
+
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(_generate_task, tasks))
+    else:
+        for task in tasks:
+            _generate_task(task)
+    return paths
+
+
+def _generate_task(task):
+    return generate_file(*task)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic POS customer exports (customer_update.csv format).")
+    parser.add_argument('--rows', type=int, required=True, help="Total number of customers")
+    parser.add_argument('--files', type=int, default=1, help="Split the export over this many files (default: 1)")
+    parser.add_argument('--gzip', action='store_true', help="Write gzip-compressed .csv.gz files")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed (default: %(default)s)")
+    parser.add_argument('--first-key', type=int, default=FIRST_CUSTOMER_KEY,
+                        help="CustomerKey of the first customer (default: %(default)s)")
+    parser.add_argument('--output-dir', default='.', help="Directory to write the export to (default: .)")
+    parser.add_argument('--prefix', default='customer_update', help="File name prefix (default: %(default)s)")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help="Rows buffered per write (default: %(default)s)")
+    parser.add_argument('--jobs', type=int, default=1, help="Files generated in parallel (default: 1)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.rows < 0 or args.files < 1:
+        raise SystemExit("--rows must be >= 0 and --files >= 1")
+    paths = generate_export(args.output_dir, args.rows, files=args.files, seed=args.seed, compress=args.gzip,
+                            first_key=args.first_key, chunk_rows=args.chunk_rows, jobs=args.jobs,
+                            prefix=args.prefix)
+    for path in paths:
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
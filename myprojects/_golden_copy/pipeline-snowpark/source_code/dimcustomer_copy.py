@@ -0,0 +1,151 @@
+# Server-side bulk load of the POS export with COPY INTO.
+#
+# The DataFrame path uploads the export, reads it back into a DataFrame,
+# transforms it and writes the result with save_as_table. The copy load
+# mode (--load-mode copy) does the same work in one statement:
+#
+#   PUT customer_update/part-*.csv.gz @~/dimcustomer_copy/customer_update/   (stage_upload.py)
+#   COPY INTO dbo.DimCustomer (CUSTOMERKEY, ..., COMMUTEDISTANCE)
+#     FROM (SELECT $5::INT, ..., REPLACE(TRIM(SPLIT_PART($1, '.first:', 1)), ...), ...
+#           FROM @~/dimcustomer_copy)
+#     FILES = ('customer_update/part-00000.csv.gz', ...)
+#     FILE_FORMAT = (FORMAT_NAME = 'dbo.DIMCUSTOMER_CSV')
+#
+# The SELECT applies the transformation of dimcustomer_transform.py to the
+# staged columns ($1 is NAME, $2 ADDRESS, ... in export order), so the
+# warehouse parses, transforms and inserts the files in one bulk operation,
+# reading the compressed chunks in parallel. COPY also keeps a load history,
+# so re-running the statement (e.g. after a failed archive) does not load
+# the same staged chunk twice.
+#
+# COPY transformations cannot filter rows, so this mode always loads the
+# whole export (no --incremental) and only appends (no upsert).
+
+from snowflake.snowpark.types import BooleanType
+from snowflake.snowpark.types import DateType
+from snowflake.snowpark.types import DecimalType
+from snowflake.snowpark.types import DoubleType
+from snowflake.snowpark.types import IntegerType
+from snowflake.snowpark.types import LongType
+from snowflake.snowpark.types import StringType
+from snowflake.snowpark.types import TimestampType
+
+from dimcustomer_transform import LAST_NAME_PREFIX
+from dimcustomer_transform import NAME_SEPARATOR
+from dimcustomer_transform import SCHEMA_ORDER
+from stage_upload import DEFAULT_CHUNK_MB
+from stage_upload import DEFAULT_THREADS
+from stage_upload import upload_export
+
+COPY_STAGE = '@~/dimcustomer_copy'
+FILE_FORMAT = 'dbo.DIMCUSTOMER_CSV'
+
+# Same options the DataFrame reader uses for the export.
+FILE_FORMAT_OPTIONS = {
+    'TYPE': 'CSV',
+    'SKIP_HEADER': 1,
+    'ENCODING': "'UTF8'",
+    'SKIP_BLANK_LINES': 'TRUE',
+    'FIELD_OPTIONALLY_ENCLOSED_BY': "'\"'",
+    'COMPRESSION': 'AUTO',
+}
+
+
+def sql_type(data_type):
+    """Snowflake column type of a Snowpark data type."""
+    if isinstance(data_type, DecimalType):
+        return 'NUMBER(%d,%d)' % (data_type.precision, data_type.scale)
+    for types, name in [((IntegerType, LongType), 'INT'), ((StringType,), 'VARCHAR'), ((DateType,), 'DATE'),
+                        ((TimestampType,), 'TIMESTAMP_NTZ'), ((DoubleType,), 'FLOAT'), ((BooleanType,), 'BOOLEAN')]:
+        if isinstance(data_type, types):
+            return name
+    raise ValueError("No Snowflake type for %s" % data_type)
+
+
+def _quote(value):
+    return "'%s'" % value.replace("'", "''")
+
+
+def file_format_sql(name=FILE_FORMAT):
+    """CREATE FILE FORMAT for the export (replaced, so it follows FILE_FORMAT_OPTIONS)."""
+    return 'CREATE OR REPLACE FILE FORMAT %s %s' % (
+        name, ' '.join('%s = %s' % option for option in FILE_FORMAT_OPTIONS.items()))
+
+
+def target_types(schema):
+    """Snowflake types of the SCHEMA_ORDER columns loaded from an export with `schema`."""
+    types = {field.name.upper(): sql_type(field.datatype) for field in schema.fields}
+    types.update({'LASTNAME': 'VARCHAR', 'FIRSTNAME': 'VARCHAR', 'ADDRESSLINE1': types['ADDRESS'],
+                  'ADDRESSLINE2': 'VARCHAR'})
+    return [(name, types[name]) for name in SCHEMA_ORDER]
+
+
+def create_table_sql(table, schema):
+    """CREATE TABLE IF NOT EXISTS for the target, with the columns append mode creates."""
+    return 'CREATE TABLE IF NOT EXISTS %s (%s)' % (
+        table, ', '.join('%s %s' % column for column in target_types(schema)))
+
+
+def copy_select_sql(schema, stage=COPY_STAGE):
+    """SELECT over the staged export producing the columns of SCHEMA_ORDER.
+
+    Same expressions as transform_customer_update() (see parse_name()).
+    """
+    fields = {field.name.upper(): ('$%d' % position, field.datatype)
+              for position, field in enumerate(schema.fields, start=1)}
+
+    def typed(name):
+        position, data_type = fields[name]
+        return '%s::%s' % (position, sql_type(data_type))
+
+    name, gender, separator = fields['NAME'][0], fields['GENDER'][0], _quote(NAME_SEPARATOR)
+    derived = {
+        'LASTNAME': 'REPLACE(TRIM(SPLIT_PART(%s, %s, 1)), %s, \'\')' % (name, separator, _quote(LAST_NAME_PREFIX)),
+        'FIRSTNAME': 'CASE WHEN CONTAINS(%s, %s) THEN TRIM(SPLIT_PART(%s, %s, 2)) END' % (
+            name, separator, name, separator),
+        'GENDER': "CASE %s WHEN 'Male' THEN 'M' WHEN 'Female' THEN 'F' ELSE %s END" % (gender, gender),
+        'ADDRESSLINE1': typed('ADDRESS'),
+        'ADDRESSLINE2': 'NULL::VARCHAR',
+    }
+    return 'SELECT %s FROM %s' % (', '.join(derived[column] if column in derived else typed(column)
+                                            for column in SCHEMA_ORDER), stage)
+
+
+def copy_into_sql(table, schema, files, stage=COPY_STAGE, file_format=FILE_FORMAT):
+    """COPY INTO `table` of the staged `files` (names relative to `stage`), transformed on load."""
+    return 'COPY INTO %s (%s) FROM (%s) FILES = (%s) FILE_FORMAT = (FORMAT_NAME = %s)' % (
+        table, ', '.join(SCHEMA_ORDER), copy_select_sql(schema, stage),
+        ', '.join(_quote(name) for name in files), _quote(file_format))
+
+
+def put_exports(session, local_files, stage=COPY_STAGE, chunk_mb=DEFAULT_CHUNK_MB, threads=DEFAULT_THREADS):
+    """Upload the exports `local_files` as gzip chunks with upload_export().
+
+    Returns the staged chunk names relative to `stage`, for the FILES list.
+    """
+    staged_files = []
+    for path in local_files:
+        staged = upload_export(session, path, stage, chunk_mb, threads)
+        print("Staged %s: %d chunk(s), %d uploaded, %d unchanged."
+              % (staged.location, len(staged.chunks), len(staged.uploaded), len(staged.skipped)))
+        staged_files.extend(staged.files())
+    return staged_files
+
+
+def prepare_copy(session, table, schema, file_format=FILE_FORMAT):
+    """Create the named file format and, if missing, the target table."""
+    session.sql(file_format_sql(file_format)).collect()
+    session.sql(create_table_sql(table, schema)).collect()
+
+
+def copy_into(session, table, schema, files, stage=COPY_STAGE, file_format=FILE_FORMAT):
+    """Load the staged `files` into `table` with one COPY INTO; returns the rows loaded.
+
+    Files COPY already loaded (see its load history) are skipped.
+    """
+    rows_loaded = 0
+    for row in session.sql(copy_into_sql(table, schema, files, stage, file_format)).collect():
+        result = {key.lower(): value for key, value in row.as_dict().items()}
+        print("COPY %s: %s" % (result.get('file', '-'), result.get('status')))
+        rows_loaded += result.get('rows_loaded') or 0
+    return rows_loaded
@@ -0,0 +1,50 @@
+# Load stage for dbo.DimCustomer in Snowflake.
+#
+# Two load modes are available:
+#   append - insert the batch into the target table.
+#   upsert - stage the batch in a temporary table and MERGE it into the
+#            target on the customer keys, so re-runs only write new or
+#            changed rows.
+
+from functools import reduce
+
+from snowflake.snowpark.functions import when_matched
+from snowflake.snowpark.functions import when_not_matched
+
+MERGE_KEYS = ['CUSTOMERKEY', 'CUSTOMERALTERNATEKEY']
+
+LOAD_MODES = ['append', 'upsert']
+
+
+def append_table(df, table):
+    """Append `df` to `table`."""
+    df.write \
+        .mode("append") \
+        .option("table_type", "permanent") \
+        .save_as_table(table)
+
+
+def upsert_table(session, df, table, keys=MERGE_KEYS):
+    """Stage `df` in a temporary table and MERGE it into `table` on `keys`.
+
+    New keys are inserted, existing keys are updated only when a value
+    changed (compared NULL-safe with EQUAL_NULL). Returns the MergeResult
+    with the number of rows inserted and updated.
+    """
+    # A key may only appear once in the MERGE source.
+    staging_table = '%s_STAGING' % table
+    df.drop_duplicates(*keys).write \
+        .mode("overwrite") \
+        .save_as_table(staging_table, table_type="temporary")
+
+    target = session.table(table)
+    source = session.table(staging_table)
+    non_keys = [c for c in df.columns if c not in keys]
+
+    join_condition = reduce(lambda a, b: a & b, [target[k] == source[k] for k in keys])
+    changed = reduce(lambda a, b: a | b, [~target[c].equal_null(source[c]) for c in non_keys])
+
+    return target.merge(source, join_condition, [
+        when_matched(changed).update({c: source[c] for c in non_keys}),
+        when_not_matched().insert({c: source[c] for c in df.columns}),
+    ])
@@ -0,0 +1,126 @@
+# Schema of the POS "new customer" export (customer_update.csv).
+#
+# Declaring the schema up front lets Snowpark read the staged export in a
+# single pass (no separate header/type inference step) and keeps column
+# types stable from one export to the next.
+
+import json
+import os
+
+from snowflake.snowpark import types as snowpark_types
+from snowflake.snowpark.types import DateType
+from snowflake.snowpark.types import DecimalType
+from snowflake.snowpark.types import IntegerType
+from snowflake.snowpark.types import StringType
+from snowflake.snowpark.types import StructField
+from snowflake.snowpark.types import StructType
+
+# Column order of the 27-column POS export, as written in the csv header.
+CUSTOMER_UPDATE_SCHEMA = StructType([
+    StructField('NAME', StringType(), True),
+    StructField('ADDRESS', StringType(), True),
+    StructField('GENDER', StringType(), True),
+    StructField('MIDDLENAME', StringType(), True),
+    StructField('CUSTOMERKEY', IntegerType(), True),
+    StructField('GEOGRAPHYKEY', IntegerType(), True),
+    StructField('CUSTOMERALTERNATEKEY', StringType(), True),
+    StructField('TITLE', StringType(), True),
+    StructField('NAMESTYLE', IntegerType(), True),
+    StructField('BIRTHDATE', DateType(), True),
+    StructField('MARITALSTATUS', StringType(), True),
+    StructField('SUFFIX', StringType(), True),
+    StructField('EMAILADDRESS', StringType(), True),
+    StructField('YEARLYINCOME', IntegerType(), True),
+    StructField('TOTALCHILDREN', IntegerType(), True),
+    StructField('NUMBERCHILDRENATHOME', IntegerType(), True),
+    StructField('ENGLISHEDUCATION', StringType(), True),
+    StructField('SPANISHEDUCATION', StringType(), True),
+    StructField('FRENCHEDUCATION', StringType(), True),
+    StructField('ENGLISHOCCUPATION', StringType(), True),
+    StructField('SPANISHOCCUPATION', StringType(), True),
+    StructField('FRENCHOCCUPATION', StringType(), True),
+    StructField('HOUSEOWNERFLAG', IntegerType(), True),
+    StructField('NUMBERCARSOWNED', IntegerType(), True),
+    StructField('PHONE', StringType(), True),
+    StructField('DATEFIRSTPURCHASE', DateType(), True),
+    StructField('COMMUTEDISTANCE', StringType(), True),
+])
+
+# Export columns that are stored under a different name in dbo.DimCustomer.
+# NAME is split into FIRSTNAME/LASTNAME, so it keeps its declared type.
+EXPORT_TO_TARGET_COLUMNS = {
+    'ADDRESS': 'ADDRESSLINE1',
+}
+
+DEFAULT_SCHEMA_CACHE = os.path.join('schemas', 'customer_update_schema.json')
+
+
+def _type_to_json(data_type):
+    value = {'type': type(data_type).__name__}
+    if isinstance(data_type, DecimalType):
+        value['precision'] = data_type.precision
+        value['scale'] = data_type.scale
+    return value
+
+
+def _type_from_json(value):
+    type_class = getattr(snowpark_types, value['type'])
+    if type_class is DecimalType:
+        return DecimalType(value['precision'], value['scale'])
+    return type_class()
+
+
+def schema_from_target(target_schema):
+    """Derive the export schema from the schema of the dbo.DimCustomer table.
+
+    Every export column that exists in the target (directly or through
+    EXPORT_TO_TARGET_COLUMNS) takes the target column's type; the remaining
+    columns keep the declared type from CUSTOMER_UPDATE_SCHEMA.
+    """
+    target_types = {field.name.strip('"').upper(): field.datatype for field in target_schema.fields}
+    fields = []
+    for field in CUSTOMER_UPDATE_SCHEMA.fields:
+        target_name = EXPORT_TO_TARGET_COLUMNS.get(field.name, field.name)
+        fields.append(StructField(field.name, target_types.get(target_name, field.datatype), True))
+    return StructType(fields)
+
+
+def load_cached_schema(cache_path=DEFAULT_SCHEMA_CACHE):
+    """Return the cached export schema, or None if it has not been cached yet."""
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path) as f:
+        columns = json.load(f)
+    return StructType([StructField(c['name'], _type_from_json(c['datatype']), True) for c in columns])
+
+
+def save_cached_schema(schema, cache_path=DEFAULT_SCHEMA_CACHE):
+    """Write the export schema to the on-disk cache."""
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    columns = [{'name': field.name, 'datatype': _type_to_json(field.datatype)} for field in schema.fields]
+    with open(cache_path, 'w') as f:
+        json.dump(columns, f, indent=2)
+
+
+def customer_update_schema(target_schema_loader=None, cache_path=DEFAULT_SCHEMA_CACHE, refresh=False):
+    """Return the schema used to read the POS export.
+
+    Without a loader this is the declared CUSTOMER_UPDATE_SCHEMA. With a
+    loader (a callable returning the StructType of dbo.DimCustomer) the schema
+    is derived from the target table once and cached on disk; later runs read
+    it from the cache without querying Snowflake. Pass refresh=True to
+    re-derive it after the table definition changes.
+    """
+    if target_schema_loader is None:
+        return CUSTOMER_UPDATE_SCHEMA
+
+    if not refresh:
+        cached = load_cached_schema(cache_path)
+        if cached is not None:
+            return cached
+
+    schema = schema_from_target(target_schema_loader())
+    save_cached_schema(schema, cache_path)
+    return schema
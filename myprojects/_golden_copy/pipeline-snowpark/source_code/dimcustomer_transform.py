@@ -0,0 +1,72 @@
+# DimCustomer transformation.
+#
+# Turns a raw POS "new customer" export into the column layout of
+# dbo.DimCustomer. All derived columns are produced by a single select, so
+# the whole transformation compiles to one SELECT in the generated SQL.
+
+from snowflake.snowpark.functions import col
+from snowflake.snowpark.functions import contains
+from snowflake.snowpark.functions import lit
+from snowflake.snowpark.functions import replace
+from snowflake.snowpark.functions import split_part
+from snowflake.snowpark.functions import trim
+from snowflake.snowpark.functions import when
+from snowflake.snowpark.types import StringType
+
+# Reorder the schema based on what the table in SQL Server is expecting.
+SCHEMA_ORDER = ['CUSTOMERKEY','GEOGRAPHYKEY','CUSTOMERALTERNATEKEY','TITLE',
+                'FIRSTNAME','MIDDLENAME','LASTNAME','NAMESTYLE',
+                'BIRTHDATE','MARITALSTATUS','SUFFIX','GENDER','EMAILADDRESS',
+                'YEARLYINCOME','TOTALCHILDREN','NUMBERCHILDRENATHOME',
+                'ENGLISHEDUCATION','SPANISHEDUCATION','FRENCHEDUCATION',
+                'ENGLISHOCCUPATION','SPANISHOCCUPATION','FRENCHOCCUPATION',
+                'HOUSEOWNERFLAG','NUMBERCARSOWNED','ADDRESSLINE1','ADDRESSLINE2',
+                'PHONE','DATEFIRSTPURCHASE','COMMUTEDISTANCE']
+
+# NAME encoding of the export: "name:last:<last>.first:<first>".
+LAST_NAME_PREFIX = 'name:last:'
+NAME_SEPARATOR = '.first:'
+
+
+def parse_name(name):
+    """Return the (LASTNAME, FIRSTNAME) columns parsed from an encoded NAME column.
+
+    SPLIT_PART and REPLACE match literally, so no regex is evaluated and no
+    intermediate array column is built:
+    - LASTNAME is the text before the first separator, trimmed, with the
+      "name:last:" prefix removed
+    - FIRSTNAME is the text between the first and the next separator,
+      trimmed; NULL when NAME has no separator
+    """
+    separator = lit(NAME_SEPARATOR)
+    last_name = replace(trim(split_part(name, separator, lit(1))), LAST_NAME_PREFIX, '')
+    first_name = when(contains(name, separator), trim(split_part(name, separator, lit(2))))
+    return last_name, first_name
+
+
+def transform_customer_update(df):
+    """Return the POS export DataFrame `df` in the layout of dbo.DimCustomer.
+
+    - NAME ("name:last:<last>.first:<first>") is split into LASTNAME/FIRSTNAME
+    - GENDER is shortened to M/F
+    - ADDRESS is renamed to ADDRESSLINE1 and an empty ADDRESSLINE2 is added
+    - columns are upper-cased and ordered as in SCHEMA_ORDER
+    """
+    # Column names are looked up upper-cased and unquoted, so exports read
+    # with PARSE_HEADER (csv header casing) work the same as the declared schema.
+    columns = {c.strip('"').upper(): col(c) for c in df.columns}
+
+    last_name, first_name = parse_name(columns['NAME'])
+
+    derived = {
+        'LASTNAME': last_name,
+        'FIRSTNAME': first_name,
+        'GENDER': when(columns['GENDER'] == 'Male', lit('M'))
+                  .when(columns['GENDER'] == 'Female', lit('F'))
+                  .otherwise(columns['GENDER']),
+        'ADDRESSLINE1': columns['ADDRESS'],
+        'ADDRESSLINE2': lit(None).cast(StringType()),
+    }
+
+    return df.select([(derived[name] if name in derived else columns[name]).alias(name)
+                      for name in SCHEMA_ORDER])
@@ -0,0 +1,107 @@
+# High-watermark for incremental DimCustomer loads.
+#
+# The POS export keeps growing, so most of its rows are already in
+# dbo.DimCustomer. The watermark records the highest CUSTOMERKEY and
+# DATEFIRSTPURCHASE loaded so far in a small state file; an incremental run
+# filters the export on it right after the read, before any transformation,
+# so the filter is pushed down into the csv scan and old rows are never
+# transformed or written.
+#
+# A row is new when its CUSTOMERKEY is above the key watermark or its
+# DATEFIRSTPURCHASE is after the date watermark. Without a state file the
+# watermark is seeded from the target table.
+
+import datetime
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+DEFAULT_WATERMARK_FILE = os.path.join('state', 'dimcustomer_watermark.json')
+
+
+def _as_date(value):
+    """Return `value` (a date, datetime or ISO string) as a datetime.date."""
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def _max(current, candidate):
+    if candidate is None:
+        return current
+    if current is None:
+        return candidate
+    return max(current, candidate)
+
+
+@dataclass(frozen=True)
+class Watermark:
+    """Highest CUSTOMERKEY and DATEFIRSTPURCHASE already loaded (None: nothing loaded)."""
+
+    customer_key: Optional[int] = None
+    date_first_purchase: Optional[datetime.date] = None
+
+    @classmethod
+    def of(cls, customer_key, date_first_purchase):
+        """Build a watermark from raw query results (date as date, datetime or string)."""
+        return cls(None if customer_key is None else int(customer_key),
+                   _as_date(date_first_purchase))
+
+    def advance(self, customer_key, date_first_purchase):
+        """Return the watermark moved up to the given maxima (never down)."""
+        other = Watermark.of(customer_key, date_first_purchase)
+        return Watermark(_max(self.customer_key, other.customer_key),
+                         _max(self.date_first_purchase, other.date_first_purchase))
+
+    def filter_sql(self):
+        """SQL condition selecting the rows above the watermark, or None for a full load.
+
+        Plain SQL, so the same condition works with DataFrame.filter() in
+        Spark, Snowpark Connect and Snowpark.
+        """
+        conditions = []
+        if self.customer_key is not None:
+            conditions.append('CUSTOMERKEY > %d' % self.customer_key)
+        if self.date_first_purchase is not None:
+            conditions.append("DATEFIRSTPURCHASE > DATE '%s'" % self.date_first_purchase.isoformat())
+        if not conditions:
+            return None
+        return ' OR '.join(conditions)
+
+
+def load_watermark(path=DEFAULT_WATERMARK_FILE, seed=None):
+    """Return the persisted watermark.
+
+    Without a state file the watermark comes from `seed` (a callable returning
+    a Watermark, typically the maxima of the target table) and is saved, or is
+    empty when there is no seed.
+    """
+    if os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        return Watermark.of(state.get('CUSTOMERKEY'), state.get('DATEFIRSTPURCHASE'))
+
+    if seed is None:
+        return Watermark()
+    watermark = seed()
+    save_watermark(watermark, path)
+    return watermark
+
+
+def save_watermark(watermark, path=DEFAULT_WATERMARK_FILE):
+    """Persist `watermark`, replacing the state file atomically."""
+    state_dir = os.path.dirname(path)
+    if state_dir:
+        os.makedirs(state_dir, exist_ok=True)
+    date_first_purchase = watermark.date_first_purchase
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as f:
+        json.dump({'CUSTOMERKEY': watermark.customer_key,
+                   'DATEFIRSTPURCHASE': date_first_purchase.isoformat() if date_first_purchase else None},
+                  f, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,92 @@
+# Pipeline configuration.
+#
+# spark_configs.txt and sql_server_credentials.txt are small pipe-delimited
+# files:
+#
+#   Specific_Element|Value
+#   User|sa
+#
+# They are parsed once with the csv module (no pandas import at startup)
+# into a frozen PipelineConfig. Environment variables take precedence over
+# the files, so the credentials exported by setenv.sh (ADMIN_USER,
+# ADMIN_PASS) or a scheduler's secrets can replace the values on disk.
+
+import csv
+import os
+from dataclasses import dataclass
+from dataclasses import field
+
+SPARK_CONFIGS_FILE = 'spark_configs.txt'
+SQL_SERVER_CREDENTIALS_FILE = 'sql_server_credentials.txt'
+
+# Config attribute -> (file, Specific_Element, environment variables checked in order).
+SETTINGS = {
+    'driver_path': (SPARK_CONFIGS_FILE, 'Driver', ['SPARK_JDBC_DRIVER']),
+    'sql_server_user': (SQL_SERVER_CREDENTIALS_FILE, 'User', ['SQL_SERVER_USER', 'ADMIN_USER']),
+    'sql_server_password': (SQL_SERVER_CREDENTIALS_FILE, 'Password', ['SQL_SERVER_PASSWORD', 'ADMIN_PASS']),
+    'sql_server_url': (SQL_SERVER_CREDENTIALS_FILE, 'URL', ['SQL_SERVER_URL']),
+    'sql_server_port': (SQL_SERVER_CREDENTIALS_FILE, 'Port', ['SQL_SERVER_PORT']),
+    'sql_server_database': (SQL_SERVER_CREDENTIALS_FILE, 'Database', ['SQL_SERVER_DATABASE']),
+}
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    """Connection settings of the DimCustomer pipeline."""
+
+    driver_path: str
+    sql_server_user: str
+    sql_server_password: str = field(repr=False)
+    sql_server_url: str
+    sql_server_port: int
+    sql_server_database: str
+
+    def jdbc_properties(self):
+        """Connection properties for Spark's JDBC reader and writer."""
+        return {
+            "user": self.sql_server_user,
+            "password": self.sql_server_password,
+            "driver": self.driver_path
+        }
+
+
+def read_settings(path):
+    """Return the Specific_Element -> Value pairs of a pipe-delimited config file.
+
+    A missing file yields no settings, so everything can come from the environment.
+    """
+    if not os.path.exists(path):
+        return {}
+    # utf-8-sig: the files may be saved with a BOM on Windows.
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f, delimiter='|')
+        next(reader, None)  # Specific_Element|Value header
+        return {row[0].strip(): row[1].strip() for row in reader if len(row) >= 2}
+
+
+def load_pipeline_config(config_dir='.', environ=None):
+    """Read the config files in `config_dir` into a PipelineConfig.
+
+    Each setting is taken from the first environment variable in SETTINGS
+    that is set, otherwise from its file. Raises ValueError naming every
+    setting that is missing from both.
+    """
+    environ = os.environ if environ is None else environ
+    files = {}
+    values = {}
+    missing = []
+    for name, (file_name, element, env_vars) in SETTINGS.items():
+        value = next((environ[var] for var in env_vars if environ.get(var)), None)
+        if value is None:
+            if file_name not in files:
+                files[file_name] = read_settings(os.path.join(config_dir, file_name))
+            value = files[file_name].get(element)
+        if value is None:
+            missing.append('%s (%s in %s or $%s)' % (name, element, file_name, ' / $'.join(env_vars)))
+        values[name] = value
+
+    if missing:
+        raise ValueError("Missing pipeline configuration: %s" % ', '.join(missing))
+
+    values['sql_server_port'] = int(values['sql_server_port'])
+    return PipelineConfig(**values)
@@ -7,30 +7,104 @@
 
 # This is a simple POC for this pipeline into the ADW warehouse.
 
+# The scheduler polls often and most polls find no export, so the script
+# first checks for the input file and exits before Snowpark is imported or
+# a session is created when there is nothing to load.
+
+# Exports are staged as gzip chunks uploaded by parallel PUTs, skipping
+# chunks that are already on the stage unchanged (stage_upload.py).
+
+# --load-mode copy loads the export with a single COPY INTO that applies the
+# transformation on load (dimcustomer_copy.py), instead of reading it into a
+# DataFrame and writing the result back.
+
 # General Imports
-import pandas as pd
+import argparse
+import glob
 import os
-import shutil
-import datetime
-
-# Snowpark Imports
+import sys
+
+# Pipeline Imports (plain Python, no Snowpark)
+from dimcustomer_watermark import DEFAULT_WATERMARK_FILE
+from dimcustomer_watermark import Watermark
+from dimcustomer_watermark import load_watermark
+from dimcustomer_watermark import save_watermark
+from pipeline_archive import archive_file
+from pipeline_config import load_pipeline_config
+from pipeline_metrics import PipelineMetrics
+from pipeline_metrics import SnowparkQueryTracker
+from stage_upload import DEFAULT_CHUNK_MB
+from stage_upload import DEFAULT_THREADS
+from stage_upload import upload_export
+
+# Command line options.
+parser = argparse.ArgumentParser(description="Load POS customer exports into dbo.DimCustomer.")
+parser.add_argument('--schema', choices=['declared', 'target'], default='declared',
+                    help="Read the export with the declared schema, or with one derived from the "
+                         "dbo.DimCustomer table and cached on disk (default: declared)")
+parser.add_argument('--refresh-schema', action='store_true',
+                    help="Re-derive the cached schema from dbo.DimCustomer (with --schema target)")
+parser.add_argument('--input', default='customer_update.csv',
+                    help="Export file to load; with --load-mode copy also a glob of exports "
+                         "(default: customer_update.csv)")
+parser.add_argument('--load-mode', choices=['append', 'upsert', 'copy'], default='append',
+                    help="append inserts every row; upsert merges the batch on CUSTOMERKEY and "
+                         "CUSTOMERALTERNATEKEY so re-runs only write new or changed rows; copy appends "
+                         "with one server-side COPY INTO that transforms on load (default: append)")
+parser.add_argument('--put-parallel', type=int, default=DEFAULT_THREADS,
+                    help="Parallel PUTs of the compressed export chunks (default: %(default)s)")
+parser.add_argument('--chunk-mb', type=int, default=DEFAULT_CHUNK_MB,
+                    help="Uncompressed size of an uploaded export chunk in MB (default: %(default)s)")
+parser.add_argument('--sample', type=int, default=0, metavar='ROWS',
+                    help="Debug: print the first ROWS rows after reading and after transforming "
+                         "(each preview is an extra query; default: 0, no preview)")
+parser.add_argument('--incremental', action='store_true',
+                    help="Only load rows above the persisted CUSTOMERKEY/DATEFIRSTPURCHASE watermark "
+                         "(seeded from dbo.DimCustomer on the first run)")
+parser.add_argument('--watermark-file', default=DEFAULT_WATERMARK_FILE,
+                    help="State file holding the watermark for --incremental (default: %(default)s)")
+parser.add_argument('--metrics-file', default=None,
+                    help="Append the per-stage JSON metrics lines to this file (default: stdout)")
+args = parser.parse_args()
+if args.load_mode == 'copy' and args.incremental:
+    parser.error("--load-mode copy loads whole exports, it cannot be combined with --incremental")
+
+# Pre-flight: nothing to load, nothing to connect to.
+inputs = sorted(glob.glob(args.input)) if args.load_mode == 'copy' else \
+    [args.input] if os.path.exists(args.input) else []
+if not inputs:
+    print("No export to process in %s." % args.input)
+    sys.exit(0)
+
+# Snowpark Imports (only needed once there is a file to load)
 from snowflake.snowpark import Session
-from snowflake.snowpark.functions import col, split, trim, when, lit, regexp_replace
-from snowflake.snowpark.types import StringType
+from snowflake.snowpark.functions import max as snowpark_max
+
+# Pipeline Imports
+from dimcustomer_load import append_table
+from dimcustomer_load import upsert_table
+from dimcustomer_schema import customer_update_schema
+from dimcustomer_transform import transform_customer_update
+
+
+def show_sample(df, label):
+    """Print the first rows of `df` when a debug sample was requested (--sample)."""
+    if args.sample:
+        print("\n%s:" % label)
+        df.show(args.sample)
+
 
-# Credential files (using native pandas - no Snowpark session needed)
-spark_creds = pd.read_csv('spark_configs.txt', index_col=None, header=0, delimiter = "|")
-sql_server_creds = pd.read_csv('sql_server_credentials.txt', index_col=None, header=0, delimiter = "|")
+def target_watermark():
+    """Return the watermark of dbo.DimCustomer (Snowflake answers MAX() from partition metadata)."""
+    maxima = spark.table("dbo.DimCustomer") \
+        .agg(snowpark_max("CUSTOMERKEY"), snowpark_max("DATEFIRSTPURCHASE")) \
+        .collect()[0]
+    return Watermark.of(maxima[0], maxima[1])
 
-# Spark related credentials
-driver_path = spark_creds.loc[spark_creds['Specific_Element'] == 'Driver', 'Value'].item()
 
-# SQL Server related credentials
-sql_server_user = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'User', 'Value'].item()
-sql_server_password = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'Password', 'Value'].item()
-sql_server_url = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'URL', 'Value'].item()
-sql_server_port = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'Port', 'Value'].item()
-sql_server_database = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'Database', 'Value'].item()
+# Spark and SQL Server settings (spark_configs.txt, sql_server_credentials.txt,
+# overridable from the environment).
+config = load_pipeline_config()
 
 # Spark Session
 spark = Session.builder\
@@ -42,86 +116,83 @@ spark.update_query_tag({"origin":"sf_sit","name":"sma","version":{"major":8,"min
 
 # Snowpark read from a local csv file.
 # Note: Snowpark requires uploading to stage first (unlike PySpark which reads local files directly)
-# PySpark equivalent: df = spark.read.csv('customer_update.csv', header=True, inferSchema=True)
-stage_name = "@~/customer_update_stage"
-spark.file.put("customer_update.csv", stage_name, auto_compress=False, overwrite=True)
-df = spark.read.options({"PARSE_HEADER": True, "ENCODING": "UTF8", "SKIP_BLANK_LINES": True}).csv(stage_name)
-# Normalize column names: strip quotes to get unquoted identifiers (closer to PySpark behavior)
-df = df.toDF([c.strip('"') for c in df.columns])
-print("Successfully read data from CSV.")
-df.show(5)
-
-
-# --- Transformation 1: Convert string columns to uppercase ---
-# This transformation iterates through all columns in the SQL Server DataFrame.
-# If a column's data type is 'string', it applies the 'upper()' function to convert all characters to uppercase.
-# The result is a new DataFrame 'uppercase_df' with the transformed string columns.
-df_uppercase = df.select([col(c).alias(c.upper()) for c in df.columns])
-print("\nDataFrame after uppercase transformation:")
-df_uppercase.show()
-
-# Split the 'full_name' column into an array of strings
-# The split function takes the column and the delimiter.
-# We split by ".first:" to separate last name from first name
-split_col = split(df_uppercase['NAME'], lit('.first:'))
-print(split_col.getItem(0))
-
-# Extract last name and first name from the split array
-# The first element (index 0) will be the last name.
-# The second element (index 1) will be the first name.
-# Use trim() to remove any leading/trailing whitespace that might exist.
-df_transformed = df_uppercase.withColumn("LASTNAME", trim(split_col.getItem(0))) \
-                   .withColumn("FIRSTNAME", trim(split_col.getItem(1)))
-
-# Change the name - remove the "name:last:" prefix
-df_transformed = df_transformed.withColumn("NEWLASTNAME", regexp_replace("LASTNAME", "name:last:", ''))
-
-# Drop the last name column and the name column.
-df_transformed = df_transformed.drop('NAME')
-df_transformed = df_transformed.drop('LASTNAME')
-df_transformed = df_transformed.withColumnRenamed("NEWLASTNAME", "LASTNAME")
-
-# Check how it looks.
-df_transformed.show(1)
-
-# Add a field from data in an existing field. 
-df_transformed = df_transformed.withColumn('GENDER_SHORT', when(col('GENDER') == 'Male', lit('M')).when(col('GENDER') == 'Female', lit('F')).otherwise(col('GENDER')))
-
-# Drop the old column name.
-df_transformed = df_transformed.drop('GENDER')
-
-# Rename a couple of columns.
-df_transformed = df_transformed.withColumnRenamed("GENDER_SHORT", "GENDER")
-df_transformed = df_transformed.withColumnRenamed("ADDRESS", "ADDRESSLINE1")
-
-# Add another column that is missing in the csv export.
-df_transformed = df_transformed.withColumn('ADDRESSLINE2', lit(None).cast(StringType()))
-
-# Reorder the schema based on what the table in SQL Server is expecting.
-# schema order
-schema_order = ['CUSTOMERKEY','GEOGRAPHYKEY','CUSTOMERALTERNATEKEY','TITLE',
-                'FIRSTNAME','MIDDLENAME','LASTNAME','NAMESTYLE',
-                'BIRTHDATE','MARITALSTATUS','SUFFIX','GENDER','EMAILADDRESS',
-                'YEARLYINCOME','TOTALCHILDREN','NUMBERCHILDRENATHOME',
-                'ENGLISHEDUCATION','SPANISHEDUCATION','FRENCHEDUCATION',
-                'ENGLISHOCCUPATION','SPANISHOCCUPATION','FRENCHOCCUPATION',
-                'HOUSEOWNERFLAG','NUMBERCARSOWNED','ADDRESSLINE1','ADDRESSLINE2',
-                'PHONE','DATEFIRSTPURCHASE','COMMUTEDISTANCE']
-
-# Select the new schema.
-df_transformed = df_transformed.select(schema_order)
-df_transformed.show()
-
-# Write the DataFrame to SQL Server.
-# Or with additional options
-df_transformed.write \
-    .mode("append") \
-    .option("table_type", "permanent") \
-    .save_as_table("dbo.DimCustomer")
-
-# once the data has been loaded, move the file to the backup directory.
-os.makedirs('old_versions', exist_ok=True)
-shutil.move(r'customer_update.csv', r'old_versions/customer_update.csv')
-# Rename the newly moved file with today's dat/time
-today_time = datetime.datetime.now().strftime("%Y-%m-%d_%I-%M-%S")
-os.rename(r'old_versions/customer_update.csv', r'old_versions/customer_update_%s.csv'%(today_time))
+# PySpark equivalent: df = spark.read.csv('customer_update.csv', header=True, schema=schema)
+# The schema is declared up front (or derived once from the target table and cached),
+# so the header line is simply skipped and no type inference pass is needed.
+schema = customer_update_schema(
+    (lambda: spark.table("dbo.DimCustomer").schema) if args.schema == 'target' else None,
+    refresh=args.refresh_schema)
+
+# One JSON metrics line per stage, written once the run is done (see pipeline_metrics.py).
+metrics = PipelineMetrics('snowpark', args.metrics_file, SnowparkQueryTracker(spark))
+if args.load_mode == 'copy':
+    from dimcustomer_copy import copy_into
+    from dimcustomer_copy import prepare_copy
+    from dimcustomer_copy import put_exports
+
+    try:
+        # Every export is uploaded as compressed chunks by parallel PUTs.
+        with metrics.stage('read', bytes_read=sum(os.path.getsize(path) for path in inputs)):
+            staged_files = put_exports(spark, inputs, chunk_mb=args.chunk_mb, threads=args.put_parallel)
+
+        # The transformation is compiled into the COPY statement of the write stage.
+        with metrics.stage('transform'):
+            prepare_copy(spark, "dbo.DimCustomer", schema)
+
+        with metrics.stage('write') as stage:
+            stage['rows_out'] = copy_into(spark, "dbo.DimCustomer", schema, staged_files)
+            print("Copied %d row(s) into dbo.DimCustomer." % stage['rows_out'])
+
+        with metrics.stage('archive'):
+            for path in inputs:
+                print("Archived %s" % archive_file(path, 'old_versions').archived_path)
+    finally:
+        metrics.flush()
+    sys.exit(0)
+
+try:
+    with metrics.stage('read', bytes_read=os.path.getsize(args.input)):
+        staged = upload_export(spark, args.input, "@~/customer_update_stage", args.chunk_mb, args.put_parallel)
+        print("Staged %s: %d chunk(s), %d uploaded, %d unchanged."
+              % (staged.location, len(staged.chunks), len(staged.uploaded), len(staged.skipped)))
+        # Every chunk starts with the header; the gzip chunks are decompressed by the stage.
+        df = spark.read.schema(schema) \
+            .options({"SKIP_HEADER": 1, "ENCODING": "UTF8", "SKIP_BLANK_LINES": True,
+                      "FIELD_OPTIONALLY_ENCLOSED_BY": '"', "COMPRESSION": "GZIP"}) \
+            .csv(staged.location)
+
+        # Incremental load: keep only the rows above the persisted watermark, before
+        # any transformation, so older customers are filtered out in the scan.
+        if args.incremental:
+            watermark = load_watermark(args.watermark_file, seed=target_watermark)
+            condition = watermark.filter_sql()
+            if condition is not None:
+                print("Incremental load: %s" % condition)
+                df = df.filter(condition)
+        show_sample(df, "Data read from CSV")
+
+    # Transform the export into the dbo.DimCustomer layout with a single projection.
+    with metrics.stage('transform'):
+        df_transformed = transform_customer_update(df)
+        show_sample(df_transformed, "DataFrame after transformation")
+
+    # Write the DataFrame to SQL Server.
+    with metrics.stage('write') as stage:
+        if args.load_mode == 'upsert':
+            merge_result = upsert_table(spark, df_transformed, "dbo.DimCustomer")
+            print("Merged into dbo.DimCustomer: %d inserted, %d updated." % (merge_result.rows_inserted, merge_result.rows_updated))
+            stage['rows_out'] = merge_result.rows_inserted + merge_result.rows_updated
+        else:
+            append_table(df_transformed, "dbo.DimCustomer")
+
+        # The load succeeded: move the watermark past the rows that are now in the table.
+        if args.incremental:
+            loaded = target_watermark()
+            save_watermark(watermark.advance(loaded.customer_key, loaded.date_first_purchase), args.watermark_file)
+
+    # once the data has been loaded, move the file to the backup directory
+    # under a collision-free name and record it in the archive manifest.
+    with metrics.stage('archive'):
+        print("Archived %s" % archive_file(args.input, 'old_versions').archived_path)
+finally:
+    metrics.flush()
@@ -0,0 +1,228 @@
+# Per-stage metrics for the DimCustomer pipeline.
+#
+# Every stage (read, transform, write, archive) produces one JSON line with
+# the same fields in the Spark, Snowpark and Snowpark Connect ports, so runs
+# of the three engines can be compared directly:
+#
+#   {"run_id": "...", "pipeline": "dimcustomer", "engine": "spark",
+#    "stage": "write", "status": "ok", "started_at": "...",
+#    "wall_time_s": 4.2, "rows_in": 3, "rows_out": 3, "bytes_read": null,
+#    "job_ids": [2, 3], "query_ids": []}
+#
+# All three engines are lazy: read and transform only build the plan, the
+# rows are read and transformed by the job/query of the write stage, and
+# that is where the wall time and the job or query IDs show up. Row counts
+# and query statistics are only known once that work ran, so the lines are
+# written when the run (or micro-batch) is flushed, not when a stage ends.
+#
+# Values that are only known later can be given as callables; they are
+# resolved at flush time (and reported as null if the run failed before
+# they could be computed). rows_in defaults to the rows_out of the previous
+# stage.
+
+import datetime
+import json
+import time
+import uuid
+from contextlib import contextmanager
+
+# Snowflake query types that write rows into a table.
+DML_QUERY_TYPES = ['INSERT', 'MERGE', 'UPDATE', 'DELETE', 'COPY', 'CREATE_TABLE_AS_SELECT']
+
+
+class NullTracker:
+    """Tracker for runs without engine job or query IDs."""
+
+    def start(self, run_id, stage):
+        return None
+
+    def stop(self, token, record):
+        pass
+
+    def resolve(self, records):
+        pass
+
+
+class SparkJobTracker:
+    """Collects the Spark job IDs of each stage through a job group.
+
+    The job group the stage runs under is restored afterwards, so stages
+    inside a Structured Streaming micro-batch keep the stream's own group.
+    """
+
+    _PROPERTIES = ['spark.jobGroup.id', 'spark.job.description', 'spark.job.interruptOnCancel']
+
+    def __init__(self, spark):
+        self.sc = spark.sparkContext
+
+    def start(self, run_id, stage):
+        saved = {key: self.sc.getLocalProperty(key) for key in self._PROPERTIES}
+        group = 'dimcustomer-%s-%s' % (run_id, stage)
+        self.sc.setJobGroup(group, 'DimCustomer %s' % stage)
+        return group, saved
+
+    def stop(self, token, record):
+        group, saved = token
+        record['job_ids'] = sorted(self.sc.statusTracker().getJobIdsForGroup(group))
+        for key, value in saved.items():
+            self.sc.setLocalProperty(key, value)
+
+    def resolve(self, records):
+        pass
+
+
+def _query_history_sql(where):
+    return ("SELECT QUERY_ID, QUERY_TYPE, QUERY_TAG, ROWS_PRODUCED, BYTES_SCANNED "
+            "FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(RESULT_LIMIT => 10000)) "
+            "WHERE %s ORDER BY START_TIME" % where)
+
+
+def _apply_query_history(records, queries_by_stage):
+    """Fill rows_out / bytes_read of each record from its Snowflake queries.
+
+    rows_out is taken from the last query of the stage that wrote rows
+    (the INSERT or MERGE into the target), bytes_read adds up what the
+    stage's queries scanned when it was not measured at the source.
+    """
+    for record in records:
+        queries = queries_by_stage.get(record['stage'], [])
+        record['query_ids'] = [q['QUERY_ID'] for q in queries]
+        writes = [q for q in queries if q['QUERY_TYPE'] in DML_QUERY_TYPES]
+        if writes and record.get('rows_out') is None:
+            record['rows_out'] = writes[-1]['ROWS_PRODUCED']
+        if queries and record.get('bytes_read') is None:
+            record['bytes_read'] = sum(q['BYTES_SCANNED'] or 0 for q in queries)
+
+
+class SnowparkQueryTracker:
+    """Collects the Snowflake query IDs of each stage with Session.query_history().
+
+    Their row and byte statistics are read in one INFORMATION_SCHEMA query
+    when the run is flushed.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def start(self, run_id, stage):
+        history = self.session.query_history()
+        history.__enter__()
+        return history
+
+    def stop(self, token, record):
+        token.__exit__(None, None, None)
+        record['query_ids'] = [query.query_id for query in token.queries]
+
+    def resolve(self, records):
+        query_ids = [query_id for record in records for query_id in record['query_ids']]
+        if not query_ids:
+            return
+        rows = self.session.sql(_query_history_sql(
+            'QUERY_ID IN (%s)' % ', '.join("'%s'" % query_id for query_id in query_ids))).collect()
+        stats = {row['QUERY_ID']: row.as_dict() for row in rows}
+        _apply_query_history(records, {
+            record['stage']: [stats[query_id] for query_id in record['query_ids'] if query_id in stats]
+            for record in records})
+
+
+class ConnectQueryTracker:
+    """Collects the Snowflake query IDs of each stage in Snowpark Connect.
+
+    The Spark API has no query history, so every stage runs under its own
+    QUERY_TAG (set with SQL passthrough) and the tagged queries are looked
+    up in one INFORMATION_SCHEMA query when the run is flushed.
+    """
+
+    def __init__(self, spark):
+        self.spark = spark
+
+    def _sql(self, sql):
+        self.spark.conf.set("snowpark.connect.sql.passthrough", "true")
+        try:
+            return self.spark.sql(sql).collect()
+        finally:
+            self.spark.conf.set("snowpark.connect.sql.passthrough", "false")
+
+    def start(self, run_id, stage):
+        self.run_id = run_id
+        self._sql("ALTER SESSION SET QUERY_TAG = 'dimcustomer:%s:%s'" % (run_id, stage))
+        return None
+
+    def stop(self, token, record):
+        self._sql("ALTER SESSION UNSET QUERY_TAG")
+
+    def resolve(self, records):
+        if not records:
+            return
+        rows = self._sql(_query_history_sql(
+            "QUERY_TAG LIKE 'dimcustomer:%s:%%' AND QUERY_TYPE <> 'ALTER_SESSION'" % self.run_id))
+        queries_by_stage = {}
+        for row in rows:
+            query = row.asDict()
+            queries_by_stage.setdefault(query['QUERY_TAG'].rsplit(':', 1)[1], []).append(query)
+        _apply_query_history(records, queries_by_stage)
+
+
+class PipelineMetrics:
+    """Records pipeline stages and writes them as JSON lines.
+
+    Lines go to `path` (appended) or to stdout when no path is given.
+    """
+
+    def __init__(self, engine, path=None, tracker=None, pipeline='dimcustomer'):
+        self.engine = engine
+        self.path = path
+        self.tracker = tracker or NullTracker()
+        self.pipeline = pipeline
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records = []
+        self.failed = False
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """Measure the stage `name`; yields its record to fill in rows/bytes.
+
+        Extra keyword arguments (e.g. batch_id) are added to the record.
+        """
+        record = {'run_id': self.run_id, 'pipeline': self.pipeline, 'engine': self.engine,
+                  'stage': name, 'status': 'ok',
+                  'started_at': datetime.datetime.now().isoformat(timespec='milliseconds'),
+                  'wall_time_s': None, 'rows_in': None, 'rows_out': None, 'bytes_read': None,
+                  'job_ids': [], 'query_ids': []}
+        record.update(fields)
+        token = self.tracker.start(self.run_id, name)
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            self.failed = True
+            record['status'] = 'failed'
+            record['error'] = '%s: %s' % (type(e).__name__, e)
+            raise
+        finally:
+            record['wall_time_s'] = round(time.perf_counter() - started, 3)
+            self.tracker.stop(token, record)
+            self.records.append(record)
+
+    def flush(self):
+        """Resolve the deferred values and write one line per recorded stage."""
+        records, self.records = self.records, []
+        previous_rows_out = None
+        for record in records:
+            for key, value in record.items():
+                if callable(value):
+                    record[key] = None if self.failed else value()
+            if record['rows_in'] is None:
+                record['rows_in'] = previous_rows_out
+            previous_rows_out = record['rows_out']
+
+        if not self.failed:
+            self.tracker.resolve(records)
+
+        lines = [json.dumps(record, default=str) for record in records]
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.writelines(line + '\n' for line in lines)
+        else:
+            for line in lines:
+                print(line, flush=True)
@@ -36,9 +36,10 @@ Examples:
   ./cleanup_snowflake_stage.sh --help             # Show this help
 
 What gets removed:
-  - @csv_stage/old_versions/*.csv (archived files)
-  - @csv_stage/customer_update*.csv (root level files)
-  - All remaining *.csv files in the stage
+  - @csv_stage/old_versions/*.csv[.gz] (archived files and chunk folders)
+  - @csv_stage/customer_update* (root level files, upload chunks and
+    their checksum manifest)
+  - All remaining *.csv and *.csv.gz files in the stage
 
 The script will:
   1. Verify connection to Snowflake
@@ -223,19 +224,19 @@ echo "Removing all files from ${STAGE_NAME}..."
 # Remove files from old_versions subdirectory
 echo ""
 echo "Removing archived files from old_versions/..."
-result=$(execute_sql "REMOVE ${STAGE_NAME}/old_versions/ PATTERN='.*\.csv';" || echo "No files removed")
+result=$(execute_sql "REMOVE ${STAGE_NAME}/old_versions/ PATTERN='.*\.csv(\.gz)?';" || echo "No files removed")
 echo "$result"
 
 # Remove files from root level
 echo ""
 echo "Removing files from stage root..."
-result=$(execute_sql "REMOVE ${STAGE_NAME} PATTERN='customer_update.*\.csv';" || echo "No files removed")
+result=$(execute_sql "REMOVE ${STAGE_NAME} PATTERN='.*customer_update.*\.(csv|csv\.gz|manifest\.json)';" || echo "No files removed")
 echo "$result"
 
-# Alternative: Remove all CSV files
+# Alternative: Remove all CSV files (plain or gzip chunks)
 echo ""
 echo "Removing any remaining CSV files..."
-result=$(execute_sql "REMOVE ${STAGE_NAME} PATTERN='.*\.csv';" || echo "No files removed")
+result=$(execute_sql "REMOVE ${STAGE_NAME} PATTERN='.*\.csv(\.gz)?';" || echo "No files removed")
 echo "$result"
 
 echo ""
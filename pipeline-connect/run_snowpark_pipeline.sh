@@ -18,7 +18,7 @@ This script uploads a CSV file to Snowflake stage, processes it with PySpark,
 and loads the transformed data into the dbo.DIMCUSTOMER table.
 
 Usage:
-  ./run_snowpark_pipeline.sh [OPTIONS] [CONNECTION_NAME]
+  ./run_snowpark_pipeline.sh [OPTIONS] [CONNECTION_NAME] [PIPELINE_ARGS...]
 
 Options:
   --help, -h          Show this help message and exit
@@ -26,26 +26,35 @@ Options:
 Arguments:
   CONNECTION_NAME     Optional Snowflake connection from ~/.snowflake/config.toml
                       If not specified, uses the default connection
+  PIPELINE_ARGS       Optional arguments passed to the pipeline after the
+                      connection name, e.g. --schema target
 
 Examples:
   ./run_snowpark_pipeline.sh                    # Use default connection
   ./run_snowpark_pipeline.sh migrations-demo-2  # Use specific connection
+  ./run_snowpark_pipeline.sh migrations-demo-2 --schema target
+                                                # Read with the schema of dbo.DIMCUSTOMER
+  ./run_snowpark_pipeline.sh migrations-demo-2 --incremental
+                                                # Only load customers above the watermark
   ./run_snowpark_pipeline.sh --help             # Show this help
 
 Prerequisites:
   - Python 3.12 virtual environment (.venv) with snowpark-submit installed
   - AdventureWorks2017 database and schemas (run ./setup_snowflake.sh first)
   - @csv_stage created in PUBLIC schema
-  - reset_source/customer_update.csv file exists
+  - reset_source/customer_update.csv file exists; an export whose checksum
+    matches state/last_loaded_export.sha256 (written after each successful
+    run) was already loaded and is skipped
   - Snowflake connection configured in ~/.snowflake/config.toml
 
 Pipeline Steps:
   1. Ensure 'spark-connect' connection exists (auto-created from specified connection)
-  2. Upload customer_update.csv to @csv_stage
+  2. Upload customer_update.csv to @csv_stage as gzip chunks (parallel PUTs,
+     unchanged chunks skipped)
   3. Submit PySpark job via Snowpark Connect
   4. Transform data (name splitting, uppercase, gender mapping)
   5. Write to dbo.DIMCUSTOMER table
-  6. Archive processed CSV to @csv_stage/old_versions/
+  6. Archive the processed chunks to @csv_stage/old_versions/
 
 Configuration:
   Database:      AdventureWorks2017
@@ -73,6 +82,33 @@ fi
 # Ensure we're in the correct directory
 cd "$(dirname "$0")"
 
+# Pre-flight: the scheduler polls every few minutes and the POS export is
+# only replaced once a day, so most polls find the export that was already
+# loaded. Its checksum is compared with the one recorded after the last
+# successful run; when nothing changed, stop before connecting to Snowflake
+# or starting a workload. Delete the marker file to force a reload.
+EXPORT_FILE="reset_source/customer_update.csv"
+LOADED_MARKER="state/last_loaded_export.sha256"
+
+export_checksum() {
+    if command -v sha256sum &> /dev/null; then
+        sha256sum "$1" | cut -d ' ' -f 1
+    else
+        shasum -a 256 "$1" | cut -d ' ' -f 1
+    fi
+}
+
+if [ ! -f "${EXPORT_FILE}" ]; then
+    echo "No export to process in ${EXPORT_FILE}."
+    exit 0
+fi
+EXPORT_CHECKSUM=$(export_checksum "${EXPORT_FILE}")
+if [ -f "${LOADED_MARKER}" ] && [ "$(cat "${LOADED_MARKER}")" == "${EXPORT_CHECKSUM}" ]; then
+    echo "${EXPORT_FILE} was already loaded (sha256 ${EXPORT_CHECKSUM}); nothing to do."
+    echo "Delete ${LOADED_MARKER} to load it again."
+    exit 0
+fi
+
 # Source common Snowflake connection handling
 source lib/snowflake_connection.sh
 
@@ -132,9 +168,11 @@ echo "Warehouse: ${SNOWFLAKE_WAREHOUSE}"
 echo ""
 
 # Step 1: Upload the CSV file to Snowflake stage
+# The export is split into gzip chunks uploaded by parallel PUTs to
+# @csv_stage/customer_update/; chunks already on the stage with the same
+# checksum are not sent again (see source_code/stage_upload.py).
 echo "Step 1: Uploading customer_update.csv to @csv_stage..."
-snow stage copy reset_source/customer_update.csv @csv_stage \
-  --overwrite \
+python source_code/stage_upload.py reset_source/customer_update.csv @csv_stage \
   --connection "${EFFECTIVE_CONNECTION}" \
   --database "${SNOWFLAKE_DATABASE}" \
   --schema "${SNOWFLAKE_SCHEMA}"
@@ -155,7 +193,7 @@ snow stage list-files @csv_stage \
 echo ""
 
 # Step 2: Submit the pipeline to Snowflake
-# The CSV file was uploaded to @csv_stage in Step 1
+# The CSV chunks were uploaded to @csv_stage/customer_update/ in Step 1
 echo "Step 2: Submitting pipeline via Snowpark Connect..."
 echo "Note: Using local snowpark-submit with Snowpark Connect library"
 echo ""
@@ -174,23 +212,27 @@ cp source_code/sql_server_credentials.txt . 2>/dev/null || true
 # Filter out verbose snowflake_connect_server logs for cleaner output
 snowpark-submit \
   --name "${WORKLOAD_NAME}" \
-  --py-files spark_configs.txt,sql_server_credentials.txt \
-  source_code/pipeline_dimcustomer_snowflake.py 2>&1 | \
+  --py-files spark_configs.txt,sql_server_credentials.txt,source_code/dimcustomer_schema.py,source_code/dimcustomer_transform.py,source_code/dimcustomer_merge.py,source_code/dimcustomer_watermark.py,source_code/pipeline_config.py,source_code/pipeline_metrics.py,source_code/pipeline_archive.py \
+  source_code/pipeline_dimcustomer_snowflake.py "${@:2}" 2>&1 | \
   grep -v "snowflake_connect_server - INFO" | \
   grep -v "Failed to initialize Upload Scala UDF Jars"
 
+# Check the exit code (of snowpark-submit, not of the log filters)
+EXIT_CODE=${PIPESTATUS[0]}
+
 # Cleanup copied files
 rm -f spark_configs.txt sql_server_credentials.txt 2>/dev/null || true
 
-# Check the exit code
-EXIT_CODE=$?
-
 echo ""
 echo "=========================================="
 if [ $EXIT_CODE -eq 0 ]; then
     echo "✅ Pipeline completed successfully!"
     echo "=========================================="
     echo ""
+
+    # Record the loaded export for the next pre-flight
+    mkdir -p "$(dirname "${LOADED_MARKER}")"
+    echo "${EXPORT_CHECKSUM}" > "${LOADED_MARKER}"
     
     # Display final stage contents after pipeline completion
     echo "📁 Final state of @csv_stage:"
@@ -204,7 +246,7 @@ if [ $EXIT_CODE -eq 0 ]; then
     echo "ℹ️  Archived files location: @csv_stage/old_versions/"
     echo ""
     echo "To retrieve an archived file, use:"
-    echo "  snow stage copy @csv_stage/old_versions/<filename> ./ \\"
+    echo "  snow stage copy @csv_stage/old_versions/<folder>/ ./ \\"
     echo "    --connection ${EFFECTIVE_CONNECTION} \\"
     echo "    --database ${SNOWFLAKE_DATABASE} \\"
     echo "    --schema ${SNOWFLAKE_SCHEMA}"
@@ -215,7 +257,7 @@ if [ $EXIT_CODE -eq 0 ]; then
       --connection "${EFFECTIVE_CONNECTION}" \
       --database "${SNOWFLAKE_DATABASE}" \
       --schema "${SNOWFLAKE_SCHEMA}" 2>/dev/null | \
-      grep -o "old_versions/customer_update_[^|]*\.csv" | tail -1)
+      grep -o "old_versions/customer_update_[^/|]*/" | tail -1)
     
     if [ -n "$archived_file" ]; then
         echo "  snow stage copy @csv_stage/${archived_file} ./ \\"
@@ -223,7 +265,7 @@ if [ $EXIT_CODE -eq 0 ]; then
         echo "    --database ${SNOWFLAKE_DATABASE} \\"
         echo "    --schema ${SNOWFLAKE_SCHEMA}"
     else
-        echo "  snow stage copy @csv_stage/old_versions/customer_update_2025-11-24_12-00-00.csv ./ \\"
+        echo "  snow stage copy @csv_stage/old_versions/customer_update_2025-11-24_12-00-00_0123456789ab/ ./ \\"
         echo "    --connection ${EFFECTIVE_CONNECTION} \\"
         echo "    --database ${SNOWFLAKE_DATABASE} \\"
         echo "    --schema ${SNOWFLAKE_SCHEMA}"
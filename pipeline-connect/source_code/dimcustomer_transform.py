@@ -0,0 +1,79 @@
+# DimCustomer transformation.
+#
+# Turns a raw POS "new customer" export into the column layout of
+# dbo.DimCustomer. All derived columns are produced by a single select, so
+# the whole transformation is one projection in the Spark plan.
+#
+# PySpark is imported inside the functions, so the in-process Arrow engine
+# (dimcustomer_arrow.py) can share the constants without importing it.
+
+# Reorder the schema based on what the table in SQL Server is expecting.
+SCHEMA_ORDER = ['CUSTOMERKEY','GEOGRAPHYKEY','CUSTOMERALTERNATEKEY','TITLE',
+                'FIRSTNAME','MIDDLENAME','LASTNAME','NAMESTYLE',
+                'BIRTHDATE','MARITALSTATUS','SUFFIX','GENDER','EMAILADDRESS',
+                'YEARLYINCOME','TOTALCHILDREN','NUMBERCHILDRENATHOME',
+                'ENGLISHEDUCATION','SPANISHEDUCATION','FRENCHEDUCATION',
+                'ENGLISHOCCUPATION','SPANISHOCCUPATION','FRENCHOCCUPATION',
+                'HOUSEOWNERFLAG','NUMBERCARSOWNED','ADDRESSLINE1','ADDRESSLINE2',
+                'PHONE','DATEFIRSTPURCHASE','COMMUTEDISTANCE']
+
+# NAME encoding of the export: "name:last:<last>.first:<first>".
+LAST_NAME_PREFIX = 'name:last:'
+NAME_SEPARATOR = '.first:'
+
+
+def parse_name(name):
+    """Return the (LASTNAME, FIRSTNAME) columns parsed from an encoded NAME column.
+
+    Built from literal string functions only (no regex engine, no UDF), so
+    both parts are plain Catalyst expressions inside the single projection:
+    - LASTNAME is the text before the first separator, trimmed, with the
+      "name:last:" prefix removed
+    - FIRSTNAME is the text between the first and the next separator,
+      trimmed; NULL when NAME has no separator
+    """
+    from pyspark.sql.functions import instr
+    from pyspark.sql.functions import lit
+    from pyspark.sql.functions import replace
+    from pyspark.sql.functions import substring_index
+    from pyspark.sql.functions import trim
+    from pyspark.sql.functions import when
+
+    last_name = replace(trim(substring_index(name, NAME_SEPARATOR, 1)), lit(LAST_NAME_PREFIX), lit(''))
+    first_name = when(instr(name, NAME_SEPARATOR) > 0,
+                      trim(substring_index(substring_index(name, NAME_SEPARATOR, 2), NAME_SEPARATOR, -1)))
+    return last_name, first_name
+
+
+def transform_customer_update(df):
+    """Return the POS export DataFrame `df` in the layout of dbo.DimCustomer.
+
+    - NAME ("name:last:<last>.first:<first>") is split into LASTNAME/FIRSTNAME
+    - GENDER is shortened to M/F
+    - ADDRESS is renamed to ADDRESSLINE1 and an empty ADDRESSLINE2 is added
+    - columns are upper-cased and ordered as in SCHEMA_ORDER
+    """
+    from pyspark.sql.functions import col
+    from pyspark.sql.functions import lit
+    from pyspark.sql.functions import when
+    from pyspark.sql.types import StringType
+
+    # Column names are looked up upper-cased, so exports read with an
+    # inferred schema (csv header casing) work the same as the declared one.
+    columns = {c.upper(): col(c) for c in df.columns}
+
+    last_name, first_name = parse_name(columns['NAME'])
+
+    derived = {
+        'LASTNAME': last_name,
+        'FIRSTNAME': first_name,
+        'GENDER': when(columns['GENDER'] == 'Male', lit('M'))
+                  .when(columns['GENDER'] == 'Female', lit('F'))
+                  .otherwise(columns['GENDER']),
+        'ADDRESSLINE1': columns['ADDRESS'],
+        # Missing in the csv export; cast so the JDBC writer knows the type.
+        'ADDRESSLINE2': lit(None).cast(StringType()),
+    }
+
+    return df.select([(derived[name] if name in derived else columns[name]).alias(name)
+                      for name in SCHEMA_ORDER])
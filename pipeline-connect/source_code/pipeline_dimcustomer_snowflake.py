@@ -8,146 +8,191 @@
 # This is a simple POC for this pipeline into the ADW warehouse.
 
 # General Imports
-import pandas as pd
+import argparse
+import hashlib
 import os
-import shutil 
-import datetime
+import sys
+import uuid
 
 # PySpark Imports
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import col
-from pyspark.sql.functions import upper
-from pyspark.sql.functions import lower
-from pyspark.sql.functions import split
-from pyspark.sql.functions import trim
-from pyspark.sql.functions import when
-from pyspark.sql.functions import lit
-from pyspark.sql.functions import expr
-from pyspark.sql.functions import regexp_replace
-
-# Credential files.
-spark_creds = pd.read_csv('spark_configs.txt', index_col=None, header=0, delimiter = "|")
-sql_server_creds = pd.read_csv('sql_server_credentials.txt', index_col=None, header=0, delimiter = "|")
-
-# Spark related credentials
-driver_path = spark_creds.loc[spark_creds['Specific_Element'] == 'Driver', 'Value'].item()
-
-# SQL Server related credentials.
-sql_server_user = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'User', 'Value'].item()
-sql_server_password = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'Password', 'Value'].item()
-sql_server_url = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'URL', 'Value'].item()
-sql_server_port = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'Port', 'Value'].item()
-sql_server_database = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'Database', 'Value'].item()
+from pyspark.sql.functions import max as spark_max
+
+# Pipeline Imports
+from dimcustomer_merge import MERGE_KEYS
+from dimcustomer_merge import merge_sql
+from dimcustomer_schema import customer_update_schema
+from dimcustomer_transform import SCHEMA_ORDER
+from dimcustomer_transform import transform_customer_update
+from dimcustomer_watermark import Watermark
+from pipeline_archive import archive_name
+from pipeline_config import load_pipeline_config
+from pipeline_metrics import ConnectQueryTracker
+from pipeline_metrics import PipelineMetrics
+
+# Command line options.
+parser = argparse.ArgumentParser(description="Load POS customer exports into dbo.DIMCUSTOMER.")
+parser.add_argument('--schema', choices=['declared', 'target'], default='declared',
+                    help="Read the export with the declared schema, or with one derived from the "
+                         "dbo.DIMCUSTOMER table and cached on disk (default: declared)")
+parser.add_argument('--refresh-schema', action='store_true',
+                    help="Re-derive the cached schema from dbo.DIMCUSTOMER (with --schema target)")
+parser.add_argument('--load-mode', choices=['append', 'upsert'], default='append',
+                    help="append inserts every row; upsert merges the batch on CUSTOMERKEY and "
+                         "CUSTOMERALTERNATEKEY so re-runs only write new or changed rows (default: append)")
+parser.add_argument('--sample', type=int, default=0, metavar='ROWS',
+                    help="Debug: print the first ROWS rows after reading and after transforming "
+                         "(each preview is an extra query; default: 0, no preview)")
+parser.add_argument('--incremental', action='store_true',
+                    help="Only load rows above the CUSTOMERKEY/DATEFIRSTPURCHASE watermark of "
+                         "dbo.DIMCUSTOMER")
+parser.add_argument('--metrics-file', default=None,
+                    help="Append the per-stage JSON metrics lines to this file (default: stdout)")
+args = parser.parse_args()
+
+
+def show_sample(df, label):
+    """Print the first rows of `df` when a debug sample was requested (--sample)."""
+    if args.sample:
+        print("\n%s:" % label)
+        df.show(args.sample)
+
+
+# Spark and SQL Server settings (spark_configs.txt, sql_server_credentials.txt,
+# overridable from the environment).
+config = load_pipeline_config()
 
 # Spark Session
-spark = SparkSession.builder.config('spark.driver.extraClassPath', driver_path) \
+spark = SparkSession.builder.config('spark.driver.extraClassPath', config.driver_path) \
                     .appName('SparkSqlServerExample') \
                     .getOrCreate()
 
-# Spark read from Snowflake stage
-# In Snowpark Connect, files are read from stages, not local filesystem
-# The customer_update.csv was uploaded to @csv_stage via --py-files and --snowflake-stage
-df = spark.read.csv('@csv_stage/customer_update.csv', header=True, inferSchema=True)
-print("Successfully read data from CSV.")
-df.show(5)
-
-
-# --- Transformation 1: Convert string columns to uppercase ---
-# This transformation iterates through all columns in the SQL Server DataFrame.
-# If a column's data type is 'string', it applies the 'upper()' function to convert all characters to uppercase.
-# The result is a new DataFrame 'uppercase_df' with the transformed string columns.
-df_uppercase = df.select([col(c).alias(c.upper()) for c in df.columns])
-print("\nDataFrame after uppercase transformation:")
-df_uppercase.show()
-
-# Split the 'full_name' column into an array of strings
-# The split function takes the column and the delimiter.
-# We split by ", " (comma followed by a space)
-split_col = split(df_uppercase['NAME'], '.first:')
-print(split_col.getItem(0))
-
-# Extract last name and first name from the split array
-# The first element (index 0) will be the last name.
-# The second element (index 1) will be the first name.
-# Use trim() to remove any leading/trailing whitespace that might exist.
-df_transformed = df_uppercase.withColumn("LASTNAME", trim(split_col.getItem(0))) \
-                   .withColumn("FIRSTNAME", trim(split_col.getItem(1)))
-
-# Change the name.
-df_transformed = df_transformed.withColumn("NEWLASTNAME",regexp_replace("LASTNAME","name:last:",''))
-
-# Drop the last name column and the name colum.
-df_transformed = df_transformed.drop('NAME')
-df_transformed = df_transformed.drop('LASTNAME')
-df_transformed = df_transformed.withColumnRenamed("NEWLASTNAME", "LASTNAME")
-
-# Check how it looks.
-df_transformed.show(1)
-
-# Add a field from data in an existing field. 
-df_transformed = df_transformed.withColumn('GENDER_SHORT', when(col('GENDER') == 'Male', 
-                                            lit('M')).when(col('GENDER') == 'Female', lit('F')).otherwise(col('GENDER')))
-
-# Drop the old column name.
-df_transformed = df_transformed.drop('GENDER')
-
-# Rename a couple of columns.
-df_transformed = df_transformed.withColumnRenamed("GENDER_SHORT", "GENDER")
-df_transformed = df_transformed.withColumnRenamed("ADDRESS", "ADDRESSLINE1")
-
-# Add another column that is missing in the csv export.
-from pyspark.sql.types import StringType #fix: import string type to avoid null value error
-df_transformed = df_transformed.withColumn('ADDRESSLINE2', lit(None).cast(StringType())) #fix: cast to string type to avoid null value error
-
-# Reorder the schema based on what the table in SQL Server is expecting.
-# schema order
-schema_order = ['CUSTOMERKEY','GEOGRAPHYKEY','CUSTOMERALTERNATEKEY','TITLE',
-                'FIRSTNAME','MIDDLENAME','LASTNAME','NAMESTYLE',
-                'BIRTHDATE','MARITALSTATUS','SUFFIX','GENDER','EMAILADDRESS',
-                'YEARLYINCOME','TOTALCHILDREN','NUMBERCHILDRENATHOME',
-                'ENGLISHEDUCATION','SPANISHEDUCATION','FRENCHEDUCATION',
-                'ENGLISHOCCUPATION','SPANISHOCCUPATION','FRENCHOCCUPATION',
-                'HOUSEOWNERFLAG','NUMBERCARSOWNED','ADDRESSLINE1','ADDRESSLINE2',
-                'PHONE','DATEFIRSTPURCHASE','COMMUTEDISTANCE']
-
-# Select the new schema.
-df_transformed = df_transformed.select(schema_order)
-df_transformed.show()
-
-# Write the DataFrame to SQL Server.
-df_transformed.write \
-    .format("snowflake") \
-    .mode("append") \
-    .option("dbtable", "dbo.DIMCUSTOMER") \
-    .save()
-
-# once the data has been loaded, move the file to the backup directory.
-# In Snowflake, we use COPY FILES to move/rename stage files
-# Generate timestamp for archived filename
-today_time = datetime.datetime.now().strftime("%Y-%m-%d_%I-%M-%S")
-archived_filename = f'customer_update_{today_time}.csv'
-
-# Enable SQL passthrough to use Snowflake-native COPY FILES command
-spark.conf.set("snowpark.connect.sql.passthrough", "true")
+# The export as uploaded by run_snowpark_pipeline.sh (stage_upload.py): gzip
+# chunks of customer_update.csv, each with the csv header.
+stage_file = '@csv_stage/customer_update.csv'
+stage_location = '@csv_stage/customer_update/'
 
+# One row per archived export (see the archive stage below).
+ARCHIVE_MANIFEST_TABLE = 'PUBLIC.DIMCUSTOMER_ARCHIVE_MANIFEST'
+
+# Pre-flight: the job has no Snowflake connection of its own besides this
+# session, so the stage is listed through it. Scheduled polls that find an
+# export already loaded are stopped before submission by
+# run_snowpark_pipeline.sh; this catches a stage left empty (e.g. a direct
+# snowpark-submit). LIST only reads stage metadata, so an empty stage ends
+# here without scanning or writing anything.
+spark.conf.set("snowpark.connect.sql.passthrough", "true")
 try:
-    # Copy the file from @csv_stage to @csv_stage/old_versions/ with new name
-    copy_sql = f"""
-        COPY FILES 
-        INTO @csv_stage/old_versions/
-        FROM (SELECT '@csv_stage/customer_update.csv', '{archived_filename}')
-    """
-    spark.sql(copy_sql).collect()
-    print(f"File archived to: @csv_stage/old_versions/{archived_filename}")
-    
-    # Remove the original file from the stage after successful copy
-    remove_sql = "REMOVE @csv_stage/customer_update.csv"
-    spark.sql(remove_sql).collect()
-    print("Original file removed from stage")
-except Exception as e:
-    print(f"Warning: File archival failed: {e}")
+    staged_files = spark.sql(f"LIST {stage_location}").collect()
 finally:
-    # Reset passthrough to default
     spark.conf.set("snowpark.connect.sql.passthrough", "false")
+if not staged_files:
+    print(f"No export to process in {stage_location}.")
+    sys.exit(0)
+
+# Spark read from Snowflake stage
+# In Snowpark Connect, files are read from stages, not local filesystem
+# The chunks of customer_update.csv were uploaded to @csv_stage in parallel by stage_upload.py;
+# reading the folder reads them all, decompressed by the stage and split across the warehouse.
+# The schema is declared up front (or derived once from the target table and cached),
+# so the file is read in a single pass instead of an extra inferSchema scan.
+schema = customer_update_schema(
+    (lambda: spark.table("dbo.DIMCUSTOMER").schema) if args.schema == 'target' else None,
+    refresh=args.refresh_schema)
+
+# One JSON metrics line per stage, written once the run is done (see pipeline_metrics.py).
+metrics = PipelineMetrics('snowpark-connect', args.metrics_file, ConnectQueryTracker(spark))
+try:
+    # LIST reports the (compressed) size of the staged chunks.
+    with metrics.stage('read', bytes_read=sum(int(row[1]) for row in staged_files)):
+        df = spark.read.csv(stage_location, header=True, schema=schema)
+
+        # Incremental load: keep only the rows above the watermark before transforming.
+        # The job runs in a fresh container every time, so the watermark state lives
+        # in the target table itself - Snowflake answers MAX() from partition metadata.
+        if args.incremental:
+            maxima = spark.table("dbo.DIMCUSTOMER") \
+                          .agg(spark_max("CUSTOMERKEY"), spark_max("DATEFIRSTPURCHASE")) \
+                          .first()
+            condition = Watermark.of(maxima[0], maxima[1]).filter_sql()
+            if condition is not None:
+                print(f"Incremental load: {condition}")
+                df = df.filter(condition)
+        show_sample(df, "Data read from CSV")
+
+    # Transform the export into the dbo.DimCustomer layout with a single projection.
+    with metrics.stage('transform'):
+        df_transformed = transform_customer_update(df)
+        show_sample(df_transformed, "DataFrame after transformation")
+
+    # Write the DataFrame to SQL Server.
+    with metrics.stage('write'):
+        if args.load_mode == 'upsert':
+            # Stage the batch (each key once), then apply it with a single MERGE so a
+            # re-run after a partial failure only writes new or changed rows. The
+            # staging table is per run, so concurrent runs do not overwrite each
+            # other's rows, and it is dropped even when the MERGE fails.
+            staging_table = "dbo.DIMCUSTOMER_STAGING_%s" % uuid.uuid4().hex[:8].upper()
+            try:
+                df_transformed.dropDuplicates(MERGE_KEYS).write \
+                    .format("snowflake") \
+                    .mode("overwrite") \
+                    .option("dbtable", staging_table) \
+                    .save()
+
+                spark.conf.set("snowpark.connect.sql.passthrough", "true")
+                merge_result = spark.sql(merge_sql("dbo.DIMCUSTOMER", staging_table, SCHEMA_ORDER,
+                                                   dialect='snowflake')).collect()
+                print(f"Merged into dbo.DIMCUSTOMER: {merge_result}")
+            finally:
+                spark.conf.set("snowpark.connect.sql.passthrough", "true")
+                try:
+                    spark.sql(f"DROP TABLE IF EXISTS {staging_table}").collect()
+                finally:
+                    spark.conf.set("snowpark.connect.sql.passthrough", "false")
+        else:
+            df_transformed.write \
+                .format("snowflake") \
+                .mode("append") \
+                .option("dbtable", "dbo.DIMCUSTOMER") \
+                .save()
+
+    with metrics.stage('archive'):
+        # once the data has been loaded, move the file to the backup directory.
+        # The chunks are archived together in a folder whose name carries a UTC
+        # timestamp and a digest of the MD5s LIST reported for them, so
+        # concurrent or same-minute runs never collide.
+        # Every archived export is recorded in the manifest table. A failing step
+        # fails the run instead of leaving a half-archived export unnoticed.
+        staged_size = sum(int(row[1]) for row in staged_files)
+        staged_md5 = hashlib.md5(''.join(sorted(row[2] for row in staged_files)).encode('utf-8')).hexdigest()
+        archived_folder = os.path.splitext(archive_name(stage_file, staged_md5))[0]
+        archived_file = f"@csv_stage/old_versions/{archived_folder}/"
+
+        # Enable SQL passthrough to use Snowflake-native COPY FILES command
+        spark.conf.set("snowpark.connect.sql.passthrough", "true")
+        try:
+            spark.sql(f"""
+                COPY FILES
+                INTO {archived_file}
+                FROM {stage_location}
+            """).collect()
+            spark.sql(f"""
+                CREATE TABLE IF NOT EXISTS {ARCHIVE_MANIFEST_TABLE} (
+                    SOURCE VARCHAR, ARCHIVED_PATH VARCHAR, MD5 VARCHAR, BYTES NUMBER,
+                    ARCHIVED_AT TIMESTAMP_TZ)
+            """).collect()
+            spark.sql(f"""
+                INSERT INTO {ARCHIVE_MANIFEST_TABLE} (SOURCE, ARCHIVED_PATH, MD5, BYTES, ARCHIVED_AT)
+                SELECT '{stage_location}', '{archived_file}', '{staged_md5}', {staged_size}, CURRENT_TIMESTAMP()
+            """).collect()
+            # Remove the original chunks from the stage after successful copy
+            spark.sql(f"REMOVE {stage_location}").collect()
+            print(f"File archived to: {archived_file}")
+        finally:
+            # Reset passthrough to default
+            spark.conf.set("snowpark.connect.sql.passthrough", "false")
+finally:
+    metrics.flush()
 
 # some rogue code that doesn't make any sense!
\ No newline at end of file
@@ -0,0 +1,191 @@
+# Chunked, compressed, parallel upload of a POS export to a Snowflake stage.
+#
+# A single PUT of one large uncompressed csv is sent over one connection and
+# leaves the warehouse a single file to scan. Instead, the export is:
+#
+#   split      - into chunks of about --chunk-mb uncompressed, cut at record
+#                boundaries, each starting with the csv header so every chunk
+#                reads on its own (SKIP_HEADER = 1 / header=True);
+#   compressed - gzip without a timestamp, so the same rows always give the
+#                same bytes and the same checksum;
+#   uploaded   - by a pool of threads, one PUT per chunk.
+#
+# The chunks land in a folder named after the export, next to a checksum
+# manifest:
+#
+#   @csv_stage/customer_update/part-00000.csv.gz
+#   @csv_stage/customer_update/part-00001.csv.gz
+#   @csv_stage/customer_update.manifest.json
+#
+# A chunk whose checksum matches the manifest and that is still on the stage
+# is not uploaded again, so re-sending an export, or one that only grew at
+# the end, only uploads what changed. Chunks left over from a longer
+# previous export are removed, so reading the folder returns exactly the
+# current export.
+#
+# Used by the Snowpark pipeline and, from run_snowpark_pipeline.sh, by the
+# Snowpark Connect pipeline:
+#
+#   python stage_upload.py --connection my-conn customer_update.csv @csv_stage
+
+import argparse
+import gzip
+import io
+import json
+import os
+import posixpath
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from pipeline_archive import file_sha256
+
+DEFAULT_CHUNK_MB = 128
+DEFAULT_THREADS = 4
+COMPRESS_LEVEL = 6
+
+CHUNK_NAME = 'part-%05d.csv.gz'
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+@dataclass(frozen=True)
+class StagedExport:
+    """Result of upload_export(): where the chunks are and what was sent."""
+
+    location: str
+    chunks: tuple
+    uploaded: tuple
+    skipped: tuple
+    removed: tuple
+
+    def files(self):
+        """Chunk paths relative to the stage, e.g. customer_update/part-00000.csv.gz."""
+        folder = posixpath.basename(self.location.rstrip('/'))
+        return [posixpath.join(folder, name) for name in self.chunks]
+
+
+def export_location(path, stage):
+    """Stage folder of the chunks of the export at `path`, e.g. @csv_stage/customer_update/."""
+    return '%s/%s/' % (stage.rstrip('/'), os.path.splitext(os.path.basename(path))[0])
+
+
+def split_export(path, out_dir, chunk_bytes=DEFAULT_CHUNK_MB << 20):
+    """Split the export at `path` into gzip chunks in `out_dir`; returns their paths.
+
+    A chunk is closed at the first line break after `chunk_bytes` that is not
+    inside a quoted field. Every chunk starts with the header line.
+    """
+    chunk_paths = []
+    chunk = None
+    with open(path, 'rb') as f:
+        header = f.readline()
+        size = quotes = 0
+        for line in f:
+            if chunk is None:
+                chunk_paths.append(os.path.join(out_dir, CHUNK_NAME % len(chunk_paths)))
+                chunk = gzip.GzipFile(chunk_paths[-1], 'wb', compresslevel=COMPRESS_LEVEL, mtime=0)
+                chunk.write(header)
+                size = 0
+            chunk.write(line)
+            size += len(line)
+            quotes += line.count(b'"')
+            if size >= chunk_bytes and quotes % 2 == 0:
+                chunk.close()
+                chunk = None
+    if chunk is not None:
+        chunk.close()
+    if not chunk_paths:
+        # Header-only export: still stage one (empty) chunk.
+        chunk_paths.append(os.path.join(out_dir, CHUNK_NAME % 0))
+        with gzip.GzipFile(chunk_paths[-1], 'wb', compresslevel=COMPRESS_LEVEL, mtime=0) as chunk:
+            chunk.write(header)
+    return chunk_paths
+
+
+def read_stage_manifest(session, location):
+    """Return {chunk name: sha256} of the manifest next to `location` ({} if there is none)."""
+    try:
+        stream = session.file.get_stream(location.rstrip('/') + MANIFEST_SUFFIX)
+    except Exception:
+        return {}
+    return json.loads(stream.read().decode('utf-8'))
+
+
+def list_stage_chunks(session, location):
+    """Return the names of the files in the stage folder `location`."""
+    return {posixpath.basename(row[0]) for row in session.sql("LIST %s" % location).collect()}
+
+
+def upload_export(session, path, stage, chunk_mb=DEFAULT_CHUNK_MB, threads=DEFAULT_THREADS):
+    """Stage the export at `path` under `stage` as compressed chunks; returns a StagedExport."""
+    location = export_location(path, stage)
+    manifest = read_stage_manifest(session, location)
+    on_stage = list_stage_chunks(session, location)
+
+    with tempfile.TemporaryDirectory(prefix='stage_upload_') as work_dir:
+        chunk_paths = split_export(path, work_dir, chunk_mb << 20)
+        checksums = {os.path.basename(chunk): file_sha256(chunk) for chunk in chunk_paths}
+        pending = [chunk for chunk in chunk_paths
+                   if not (os.path.basename(chunk) in on_stage
+                           and manifest.get(os.path.basename(chunk)) == checksums[os.path.basename(chunk)])]
+
+        def put(chunk):
+            # Parallelism comes from the pool, one connection per chunk.
+            session.file.put(chunk, location, parallel=1, auto_compress=False,
+                             source_compression='GZIP', overwrite=True)
+
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='stage-upload') as pool:
+            list(pool.map(put, pending))
+
+    removed = sorted(on_stage - set(checksums))
+    for name in removed:
+        session.sql("REMOVE %s%s" % (location, name)).collect()
+
+    # Written last: a failed run leaves the old manifest, so nothing is skipped by mistake.
+    session.file.put_stream(io.BytesIO(json.dumps(checksums, indent=2).encode('utf-8')),
+                            location.rstrip('/') + MANIFEST_SUFFIX, auto_compress=False, overwrite=True)
+
+    uploaded = tuple(os.path.basename(chunk) for chunk in pending)
+    return StagedExport(location=location,
+                        chunks=tuple(sorted(checksums)),
+                        uploaded=uploaded,
+                        skipped=tuple(sorted(set(checksums) - set(uploaded))),
+                        removed=tuple(removed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upload a POS export to a stage as compressed chunks.")
+    parser.add_argument('export', help="Local csv export")
+    parser.add_argument('stage', help="Stage to upload to, e.g. @csv_stage")
+    parser.add_argument('--connection', default=None,
+                        help="Connection name from ~/.snowflake/config.toml (default: the default connection)")
+    parser.add_argument('--database', default=None, help="Database of the stage")
+    parser.add_argument('--schema', default=None, help="Schema of the stage")
+    parser.add_argument('--chunk-mb', type=int, default=DEFAULT_CHUNK_MB,
+                        help="Uncompressed size of a chunk in MB (default: %(default)s)")
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help="Parallel PUTs (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    from snowflake.snowpark import Session
+
+    builder = Session.builder
+    if args.connection:
+        builder = builder.config('connection_name', args.connection)
+    for key in ['database', 'schema']:
+        if getattr(args, key):
+            builder = builder.config(key, getattr(args, key))
+    session = builder.create()
+    try:
+        staged = upload_export(session, args.export, args.stage, args.chunk_mb, args.threads)
+    finally:
+        session.close()
+    print("Staged %s to %s: %d chunk(s), %d uploaded, %d unchanged, %d removed."
+          % (args.export, staged.location, len(staged.chunks), len(staged.uploaded), len(staged.skipped),
+             len(staged.removed)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,45 @@
 #!/bin/bash
 # Run the pipeline_dimcustomer.py script in the Spark cluster
+# Any arguments are passed through to the pipeline, e.g.:
+#   ./run_pipeline.sh                # process source_code/customer_update.csv
+#   ./run_pipeline.sh --stream       # process every export in source_code/landing/
+#   ./run_pipeline.sh --stream --watch   # keep polling source_code/landing/
+#   ./run_pipeline.sh --engine spark     # submit to the cluster even for a small export
+#   ./run_pipeline.sh --replay-from 2025-11-01 --load-mode upsert   # re-feed the archive
 
 set -e
 
+# Pre-flight: check for pending exports with plain python (no JVM, no Spark
+# session). Scheduled polls that find nothing stop here, cheaply. Exit code 4
+# means the export is small enough for the in-process Arrow engine.
+PREFLIGHT_CODE=0
+docker exec spark-master bash -c "cd /opt/spark-work && python3 pipeline_dimcustomer.py --preflight $*" \
+  || PREFLIGHT_CODE=$?
+if [ $PREFLIGHT_CODE -eq 3 ]; then
+    echo "Nothing to process."
+    exit 0
+elif [ $PREFLIGHT_CODE -ne 0 ] && [ $PREFLIGHT_CODE -ne 4 ]; then
+    echo "Pre-flight check failed with exit code: $PREFLIGHT_CODE"
+    exit $PREFLIGHT_CODE
+fi
+
 echo "Starting pipeline execution..."
 echo "================================"
 
-docker exec spark-master bash -c "cd /opt/spark-work && \
-  /opt/spark/bin/spark-submit \
-  --master spark://spark-master:7077 \
-  --driver-class-path /opt/spark/jars/mssql-jdbc-13.2.1.jre11.jar \
-  --conf spark.executor.extraClassPath=/opt/spark/jars/mssql-jdbc-13.2.1.jre11.jar \
-  pipeline_dimcustomer.py"
-
-EXIT_CODE=$?
+EXIT_CODE=0
+if [ $PREFLIGHT_CODE -eq 4 ]; then
+    echo "Small export - running in-process with the Arrow engine (no spark-submit)."
+    docker exec spark-master bash -c "cd /opt/spark-work && python3 pipeline_dimcustomer.py --engine arrow $*" \
+      || EXIT_CODE=$?
+else
+    docker exec spark-master bash -c "cd /opt/spark-work && \
+      /opt/spark/bin/spark-submit \
+      --master spark://spark-master:7077 \
+      --driver-class-path /opt/spark/jars/mssql-jdbc-13.2.1.jre11.jar \
+      --conf spark.executor.extraClassPath=/opt/spark/jars/mssql-jdbc-13.2.1.jre11.jar \
+      pipeline_dimcustomer.py --engine spark $*" \
+      || EXIT_CODE=$?
+fi
 
 if [ $EXIT_CODE -eq 0 ]; then
     echo "================================"
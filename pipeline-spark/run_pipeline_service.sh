@@ -0,0 +1,37 @@
+#!/bin/bash
+# Run the DimCustomer pipeline service in the Spark cluster: one long-lived
+# Spark application with warm sessions that runs submitted pipeline jobs
+# (see source_code/pipeline_service.py).
+#   ./run_pipeline_service.sh start [--sessions 4]    # start it in the background
+#   ./run_pipeline_service.sh start --stand-in        # local-mode Spark, Parquet instead of SQL Server
+#   ./run_pipeline_service.sh submit --input customer_update.csv --load-mode upsert
+#   ./run_pipeline_service.sh status
+#   ./run_pipeline_service.sh stop
+
+set -e
+
+COMMAND=$1
+shift || true
+
+case "$COMMAND" in
+    start)
+        docker exec -d spark-master bash -c "cd /opt/spark-work && \
+          /opt/spark/bin/spark-submit \
+          --master spark://spark-master:7077 \
+          --driver-class-path /opt/spark/jars/mssql-jdbc-13.2.1.jre11.jar \
+          --conf spark.executor.extraClassPath=/opt/spark/jars/mssql-jdbc-13.2.1.jre11.jar \
+          pipeline_service.py serve $* > pipeline_service.log 2>&1"
+        echo "Pipeline service starting, log in source_code/pipeline_service.log"
+        ;;
+    submit)
+        # The client is plain python: submitting a job does not start a JVM.
+        docker exec spark-master bash -c "cd /opt/spark-work && python3 pipeline_service.py submit -- $*"
+        ;;
+    status|stop)
+        docker exec spark-master bash -c "cd /opt/spark-work && python3 pipeline_service.py $COMMAND"
+        ;;
+    *)
+        echo "Usage: $0 start|submit|status|stop [options]"
+        exit 1
+        ;;
+esac
@@ -0,0 +1,23 @@
+#!/bin/bash
+# Load every AdventureWorks feed described in source_code/tables/*.json in one
+# Spark application (see source_code/table_loader.py).
+# Any arguments are passed through to the loader, e.g.:
+#   ./run_table_loader.sh                          # every table with a pending export
+#   ./run_table_loader.sh --table dimcustomer      # only some of them
+#   ./run_table_loader.sh --max-workers 8          # more tables at the same time
+
+set -e
+
+EXIT_CODE=0
+docker exec spark-master bash -c "cd /opt/spark-work && \
+  /opt/spark/bin/spark-submit \
+  --master spark://spark-master:7077 \
+  --driver-class-path /opt/spark/jars/mssql-jdbc-13.2.1.jre11.jar \
+  --conf spark.executor.extraClassPath=/opt/spark/jars/mssql-jdbc-13.2.1.jre11.jar \
+  table_loader.py $*" \
+  || EXIT_CODE=$?
+
+if [ $EXIT_CODE -ne 0 ]; then
+    echo "Table loader failed with exit code: $EXIT_CODE"
+    exit $EXIT_CODE
+fi
@@ -0,0 +1,129 @@
+# Columnar archive of processed DimCustomer exports.
+#
+# Instead of keeping every processed export as an uncompressed csv copy,
+# the archive stage can convert it to Parquet with zstd compression,
+# partitioned by the (UTC) date it was loaded:
+#
+#   old_versions/parquet/LOAD_DATE=2025-11-24/customer_update_<timestamp>_<hash>.parquet
+#
+# The files hold the export rows with the declared column types, so a
+# replay reads them back with the same schema as a fresh export, and a
+# date-range replay only opens the partitions of that range. The csv is read
+# like Spark reads it (only empty fields are NULL, see dimcustomer_arrow.py),
+# so a replay loads exactly the values of the original run. The csv is
+# streamed into the Parquet file batch by batch, so large exports are never
+# held in memory. Naming, the atomic move and the manifest entry come from
+# pipeline_archive.py.
+#
+# Exports kept as csv (--archive-format csv, or an export that does not
+# convert to the declared types) are not in a partition; a replay finds
+# them through the manifest, by the UTC date they were archived on.
+
+import datetime
+import os
+import uuid
+
+from pipeline_archive import DEFAULT_ARCHIVE_DIR
+from pipeline_archive import archive_file
+from pipeline_archive import archive_name
+from pipeline_archive import link_atomically
+from pipeline_archive import read_manifest
+from pipeline_archive import store_copy
+
+ARCHIVE_FORMATS = ['parquet', 'csv']
+
+PARQUET_DIR = 'parquet'
+PARTITION_COLUMN = 'LOAD_DATE'
+COMPRESSION = 'zstd'
+
+
+def partition_dir(archive_dir, load_date):
+    """Directory of the Parquet partition holding the exports loaded on `load_date`."""
+    return os.path.join(archive_dir, PARQUET_DIR, '%s=%s' % (PARTITION_COLUMN, load_date.isoformat()))
+
+
+def store_parquet(path, archive_dir, sha256, now):
+    """Archive the export at `path` as a zstd Parquet file in its load-date partition.
+
+    The file is written under a hidden temporary name (Spark and PyArrow
+    skip files starting with '.') and then linked to its final name, so
+    readers never see a partial file. Returns the archived path.
+    """
+    import pyarrow.parquet as pq
+    from dimcustomer_arrow import ARROW_SCHEMA
+    from dimcustomer_arrow import open_customer_update
+
+    target_dir = partition_dir(archive_dir, now.date())
+    os.makedirs(target_dir, exist_ok=True)
+    stem = os.path.splitext(archive_name(path, sha256, now))[0]
+    archived_path = os.path.join(target_dir, stem + '.parquet')
+    tmp_path = os.path.join(target_dir, '.%s.%s.tmp' % (stem, uuid.uuid4().hex[:8]))
+
+    try:
+        with pq.ParquetWriter(tmp_path, ARROW_SCHEMA, compression=COMPRESSION) as writer:
+            for batch in open_customer_update(path):
+                writer.write_batch(batch)
+        link_atomically(tmp_path, archived_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return archived_path
+
+
+def archive_export(path, archive_dir=DEFAULT_ARCHIVE_DIR, archive_format='parquet'):
+    """Archive a processed export in `archive_format`; returns the ArchivedFile.
+
+    An export that cannot be converted to the declared column types (the
+    loaders turn such values into NULLs, the converter does not) is archived
+    as csv instead, so the archive never loses the original content.
+    """
+    if archive_format == 'csv':
+        return archive_file(path, archive_dir)
+
+    import pyarrow as pa
+
+    try:
+        return archive_file(path, archive_dir, store=store_parquet)
+    except pa.ArrowInvalid as e:
+        print("Cannot archive %s as Parquet (%s), keeping the csv." % (path, e))
+        return archive_file(path, archive_dir, store=store_copy)
+
+
+def replay_partitions(archive_dir, start, end):
+    """Return the partition directories of the load dates from `start` to `end` (inclusive)."""
+    root = os.path.join(archive_dir, PARQUET_DIR)
+    if not os.path.isdir(root):
+        return []
+    prefix = PARTITION_COLUMN + '='
+    partitions = []
+    for name in sorted(os.listdir(root)):
+        if not name.startswith(prefix):
+            continue
+        try:
+            load_date = datetime.date.fromisoformat(name[len(prefix):])
+        except ValueError:
+            continue
+        if start <= load_date <= end:
+            partitions.append(os.path.join(root, name))
+    return partitions
+
+
+def replay_files(partitions):
+    """Return the Parquet files of `partitions`, skipping temporary files."""
+    return [os.path.join(partition, name)
+            for partition in partitions
+            for name in sorted(os.listdir(partition))
+            if name.endswith('.parquet') and not name.startswith(('.', '_'))]
+
+
+def replay_csv_files(archive_dir, start, end):
+    """Return the exports archived as csv on the load dates from `start` to `end` (inclusive)."""
+    paths = []
+    for record in read_manifest(archive_dir):
+        if not record.archived_path.endswith('.csv'):
+            continue
+        load_date = datetime.datetime.fromisoformat(record.archived_at).date()
+        path = os.path.join(archive_dir, os.path.basename(record.archived_path))
+        if start <= load_date <= end and os.path.exists(path):
+            paths.append(path)
+    return paths
@@ -0,0 +1,247 @@
+# In-process DimCustomer engine for small exports.
+#
+# Most daily exports hold a few thousand rows. Submitting those to the Spark
+# cluster costs seconds of JVM start-up and scheduling for milliseconds of
+# work, so below a row-count threshold the pipeline runs the same read,
+# transformation and load in the driver process with PyArrow instead:
+#
+#   read      - pyarrow.csv with the column types of CUSTOMER_UPDATE_SCHEMA
+#   transform - vectorized Arrow compute kernels with the semantics of the
+#               Spark expressions in dimcustomer_transform.py (literal
+#               NAME split, space-only trim, ...), so the output is identical
+#   load      - multi-row INSERTs (or a staged MERGE) over one pymssql
+#               connection, in a single transaction
+#
+# The engine does not import pyspark at all, so a small run pays neither
+# for a JVM nor for the PySpark import.
+
+import re
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+from dimcustomer_dedup import FIELD_SEPARATOR
+from dimcustomer_dedup import NULL_MARKER
+from dimcustomer_dedup import hash_text
+from dimcustomer_merge import MERGE_KEYS
+from dimcustomer_merge import merge_sql
+from dimcustomer_transform import LAST_NAME_PREFIX
+from dimcustomer_transform import NAME_SEPARATOR
+from dimcustomer_transform import SCHEMA_ORDER
+
+# CUSTOMER_UPDATE_SCHEMA (dimcustomer_schema.py) in Arrow types: StringType
+# is string, IntegerType int32 and DateType date32.
+ARROW_SCHEMA = pa.schema([
+    ('NAME', pa.string()),
+    ('ADDRESS', pa.string()),
+    ('GENDER', pa.string()),
+    ('MIDDLENAME', pa.string()),
+    ('CUSTOMERKEY', pa.int32()),
+    ('GEOGRAPHYKEY', pa.int32()),
+    ('CUSTOMERALTERNATEKEY', pa.string()),
+    ('TITLE', pa.string()),
+    ('NAMESTYLE', pa.int32()),
+    ('BIRTHDATE', pa.date32()),
+    ('MARITALSTATUS', pa.string()),
+    ('SUFFIX', pa.string()),
+    ('EMAILADDRESS', pa.string()),
+    ('YEARLYINCOME', pa.int32()),
+    ('TOTALCHILDREN', pa.int32()),
+    ('NUMBERCHILDRENATHOME', pa.int32()),
+    ('ENGLISHEDUCATION', pa.string()),
+    ('SPANISHEDUCATION', pa.string()),
+    ('FRENCHEDUCATION', pa.string()),
+    ('ENGLISHOCCUPATION', pa.string()),
+    ('SPANISHOCCUPATION', pa.string()),
+    ('FRENCHOCCUPATION', pa.string()),
+    ('HOUSEOWNERFLAG', pa.int32()),
+    ('NUMBERCARSOWNED', pa.int32()),
+    ('PHONE', pa.string()),
+    ('DATEFIRSTPURCHASE', pa.date32()),
+    ('COMMUTEDISTANCE', pa.string()),
+])
+
+# Arrow type -> SQL Server type the Spark JDBC writer creates.
+SQL_TYPES = {
+    pa.string(): 'NVARCHAR(MAX)',
+    pa.int32(): 'INTEGER',
+    pa.date32(): 'DATE',
+}
+
+# SQL Server accepts at most 1000 rows in one INSERT ... VALUES list.
+INSERT_ROWS = 1000
+
+
+def _csv_options():
+    # Like Spark's csv reader with a schema, the header row is skipped and
+    # columns are taken by position; empty fields (quoted or not) are read as
+    # nulls. Only empty fields: pyarrow's default null markers ("NA", "NULL",
+    # "nan", ...) are kept as text, as Spark does. Shared by the engine and
+    # the Parquet archive (dimcustomer_archive.py).
+    return dict(read_options=pa_csv.ReadOptions(column_names=ARROW_SCHEMA.names, skip_rows=1),
+                convert_options=pa_csv.ConvertOptions(column_types=ARROW_SCHEMA, null_values=[''],
+                                                      strings_can_be_null=True,
+                                                      quoted_strings_can_be_null=True))
+
+
+def read_customer_update(path):
+    """Read the POS export at `path` into an Arrow table with the declared schema."""
+    return pa_csv.read_csv(path, **_csv_options())
+
+
+def open_customer_update(path):
+    """Open the POS export at `path` as a stream of record batches with the declared schema."""
+    return pa_csv.open_csv(path, **_csv_options())
+
+
+def filter_new_rows(table, watermark):
+    """Keep only the rows of `table` above `watermark` (see Watermark.filter_sql())."""
+    conditions = []
+    if watermark.customer_key is not None:
+        conditions.append(pc.greater(table['CUSTOMERKEY'], pa.scalar(watermark.customer_key, pa.int32())))
+    if watermark.date_first_purchase is not None:
+        conditions.append(pc.greater(table['DATEFIRSTPURCHASE'],
+                                     pa.scalar(watermark.date_first_purchase, pa.date32())))
+    if not conditions:
+        return table
+    print("Incremental load: %s" % watermark.filter_sql())
+    condition = conditions[0]
+    for other in conditions[1:]:
+        # SQL OR: a NULL on one side does not hide a match on the other.
+        condition = pc.or_kleene(condition, other)
+    return table.filter(condition)
+
+
+def row_hashes(table):
+    """Return the dedup hash of every row of `table` (see dimcustomer_dedup.row_hash_column())."""
+    # Arrow casts integers and dates to the same strings as Spark's cast('string').
+    texts = pc.binary_join_element_wise(
+        *[pc.fill_null(pc.cast(column, pa.string()), NULL_MARKER) for column in table.columns], FIELD_SEPARATOR)
+    return [hash_text(text) for text in texts.to_pylist()]
+
+
+def drop_loaded_rows(table, dedup):
+    """Drop the rows of `table` that `dedup` (a DedupIndex) saw loaded before.
+
+    Returns the remaining table and the hashes of its rows, to record once
+    they are written.
+    """
+    hashes = row_hashes(table)
+    loaded = dedup.loaded_rows(set(hashes))
+    if loaded:
+        print("Skipping %d already loaded row(s)." % len(loaded))
+        table = table.filter(pc.invert(pc.is_in(pa.array(hashes, pa.string()),
+                                                value_set=pa.array(sorted(loaded), pa.string()))))
+    return table, set(hashes) - loaded
+
+
+def _list_item(lists, index):
+    """Element `index` of every list, null when the list is shorter (Spark's getItem())."""
+    positions = pc.add(lists.offsets[:-1], index)
+    positions = pc.if_else(pc.greater(pc.list_value_length(lists), index), positions, None)
+    return pc.take(lists.values, positions)
+
+
+def transform_customer_update(table):
+    """Return the export `table` in the layout of dbo.DimCustomer.
+
+    Arrow version of dimcustomer_transform.transform_customer_update():
+    - NAME is split on the literal separator into LASTNAME/FIRSTNAME (see
+      dimcustomer_transform.parse_name()), trimmed of spaces like Spark's trim()
+    - GENDER is shortened to M/F
+    - ADDRESS is renamed to ADDRESSLINE1 and an empty ADDRESSLINE2 is added
+    - columns are ordered as in SCHEMA_ORDER
+    """
+    split_col = pc.split_pattern(table['NAME'].combine_chunks(), NAME_SEPARATOR)
+    gender = table['GENDER']
+
+    derived = {
+        'LASTNAME': pc.replace_substring(pc.utf8_trim(_list_item(split_col, 0), ' '), LAST_NAME_PREFIX, ''),
+        'FIRSTNAME': pc.utf8_trim(_list_item(split_col, 1), ' '),
+        'GENDER': pc.if_else(pc.equal(gender, 'Male'), 'M',
+                             pc.if_else(pc.equal(gender, 'Female'), 'F', gender)),
+        'ADDRESSLINE1': table['ADDRESS'],
+        'ADDRESSLINE2': pa.nulls(table.num_rows, pa.string()),
+    }
+
+    return pa.table([derived[name] if name in derived else table[name] for name in SCHEMA_ORDER],
+                    names=SCHEMA_ORDER)
+
+
+def watermark_maxima(table):
+    """Return the highest CUSTOMERKEY and DATEFIRSTPURCHASE of `table` (None when empty)."""
+    return pc.max(table['CUSTOMERKEY']).as_py(), pc.max(table['DATEFIRSTPURCHASE']).as_py()
+
+
+def connect(config):
+    """Open a pymssql connection to the SQL Server of the JDBC URL in `config`."""
+    import pymssql
+
+    host = re.match(r'jdbc:sqlserver://([^:;\\]+)', config.sql_server_url).group(1)
+    return pymssql.connect(server=host, port=config.sql_server_port, user=config.sql_server_user,
+                           password=config.sql_server_password, database=config.sql_server_database)
+
+
+def create_table_sql(table_name, table):
+    """CREATE TABLE for `table` with the column types Spark's JDBC writer uses."""
+    return 'CREATE TABLE %s (%s)' % (table_name, ', '.join(
+        '%s %s' % (field.name, SQL_TYPES[field.type]) for field in table.schema))
+
+
+def _insert_rows(cursor, table_name, table):
+    columns = table.column_names
+    values = '(%s)' % ', '.join(['%s'] * len(columns))
+    rows = list(zip(*[column.to_pylist() for column in table.columns]))
+    for start in range(0, len(rows), INSERT_ROWS):
+        chunk = rows[start:start + INSERT_ROWS]
+        cursor.execute('INSERT INTO %s (%s) VALUES %s' % (table_name, ', '.join(columns),
+                                                          ', '.join([values] * len(chunk))),
+                       tuple(value for row in chunk for value in row))
+
+
+def append_table(connection, table, table_name='dbo.DimCustomer'):
+    """Insert every row of `table`, creating the target table if needed (like Spark's append)."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("IF OBJECT_ID('%s') IS NULL %s" % (table_name, create_table_sql(table_name, table)))
+        _insert_rows(cursor, table_name, table)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+
+def upsert_table(connection, table, table_name='dbo.DimCustomer', keys=MERGE_KEYS):
+    """Stage `table` in a temp table and MERGE it into `table_name` on `keys`.
+
+    Same MERGE as dimcustomer_load.upsert_jdbc(). Returns the number of
+    rows inserted or updated.
+    """
+    # A key may only appear once in the MERGE source.
+    key_rows = list(zip(*[table[key].to_pylist() for key in keys]))
+    first_index = {}
+    for index, key in enumerate(key_rows):
+        first_index.setdefault(key, index)
+    table = table.take(sorted(first_index.values()))
+
+    staging_table = '#%s_staging' % table_name.split('.')[-1]
+    cursor = connection.cursor()
+    try:
+        cursor.execute(create_table_sql(staging_table, table))
+        _insert_rows(cursor, staging_table, table)
+        cursor.execute(merge_sql(table_name, staging_table, table.column_names, keys, dialect='tsql'))
+        merged_rows = cursor.rowcount
+        cursor.execute('DROP TABLE %s' % staging_table)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return merged_rows
+
+
+def read_target_watermark(connection, table_name='dbo.DimCustomer'):
+    """Return the CUSTOMERKEY and DATEFIRSTPURCHASE maxima of the target table."""
+    cursor = connection.cursor()
+    cursor.execute('SELECT MAX(CustomerKey), MAX(DateFirstPurchase) FROM %s' % table_name)
+    return cursor.fetchone()
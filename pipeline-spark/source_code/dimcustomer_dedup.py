@@ -0,0 +1,156 @@
+# Deduplication index for DimCustomer loads.
+#
+# The POS re-sends exports, and nothing in the target table tells a re-sent
+# file from a new one. The index remembers, in a small SQLite database next
+# to the watermark state file:
+#
+#   files     - the SHA-256 of every export that was loaded, so a re-sent
+#               file is recognised with one primary-key lookup and skipped
+#               before Spark is started;
+#   row_keys  - a hash of every loaded row, so rows already loaded from an
+#               earlier, different export are filtered out before the write.
+#
+# A row hash covers all the columns of the export row, so a customer whose
+# details changed is still loaded (and merged with --load-mode upsert); only
+# exact repeats are dropped. Spark (row_hash_column()) and the Arrow engine
+# (dimcustomer_arrow.row_hashes()) compute the same hash, so both engines share one index.
+# Loads are recorded only after the write succeeded, so a failed load is
+# picked up again by the next run.
+
+import datetime
+import hashlib
+import os
+import sqlite3
+import sys
+import urllib.parse
+
+DEFAULT_DEDUP_FILE = os.path.join('state', 'dimcustomer_dedup.sqlite3')
+
+# Column holding the row hash while a batch is deduplicated.
+ROW_HASH_COLUMN = '_ROW_HASH'
+
+# Hex characters of the SHA-256 kept per row: 64 bits, no collisions in
+# practice at the size of a customer dimension.
+ROW_HASH_LENGTH = 16
+FIELD_SEPARATOR = '\x1f'
+NULL_MARKER = '\x00'
+
+# Parameters per statement (SQLite's default limit is 999).
+LOOKUP_CHUNK = 500
+
+
+def hash_text(text):
+    """Return the row hash of `text`, the row's values joined with FIELD_SEPARATOR."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:ROW_HASH_LENGTH]
+
+
+def row_hash(values):
+    """Return the hash of one export row, given its values as strings (None for NULL)."""
+    return hash_text(FIELD_SEPARATOR.join(NULL_MARKER if value is None else value for value in values))
+
+
+def row_hash_column(columns):
+    """Spark expression computing row_hash() of `columns`."""
+    from pyspark.sql.functions import coalesce
+    from pyspark.sql.functions import col
+    from pyspark.sql.functions import concat_ws
+    from pyspark.sql.functions import lit
+    from pyspark.sql.functions import sha2
+    from pyspark.sql.functions import substring
+
+    text = concat_ws(FIELD_SEPARATOR, *[coalesce(col(name).cast('string'), lit(NULL_MARKER)) for name in columns])
+    return substring(sha2(text, 256), 1, ROW_HASH_LENGTH)
+
+
+class DedupIndex:
+    """Content hashes of the exports and rows loaded so far (see the module comment)."""
+
+    def __init__(self, path=DEFAULT_DEDUP_FILE, read_only=False):
+        self.path = path
+        if read_only:
+            # Lookups only (--preflight): nothing is created or written.
+            self.connection = sqlite3.connect('file:%s?mode=ro' % urllib.parse.quote(os.path.abspath(path)),
+                                              uri=True, timeout=30)
+            return
+        state_dir = os.path.dirname(path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        # Stream micro-batches call back from a py4j thread; the index is
+        # still used by one batch at a time.
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS files ('
+                                    'sha256 TEXT PRIMARY KEY, source TEXT, loaded_at TEXT)'
+                                    ' WITHOUT ROWID')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS row_keys (row_hash TEXT PRIMARY KEY) WITHOUT ROWID')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def has_file(self, sha256):
+        """Return True when an export with content `sha256` was loaded before."""
+        return self.connection.execute('SELECT 1 FROM files WHERE sha256 = ?', (sha256,)).fetchone() is not None
+
+    def loaded_rows(self, row_hashes):
+        """Return the subset of `row_hashes` that was loaded before."""
+        return _loaded_rows(self.connection, row_hashes)
+
+    def record_load(self, files, row_hashes):
+        """Record the (sha256, source) `files` and the `row_hashes` of a successful load.
+
+        Written in one transaction, so an interrupted run records nothing.
+        `row_hashes` may be an iterator; it is consumed as it is written.
+        """
+        loaded_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO files VALUES (?, ?, ?)',
+                                        [(sha256, source, loaded_at) for sha256, source in files])
+            self.connection.executemany('INSERT OR IGNORE INTO row_keys VALUES (?)',
+                                        ((value,) for value in row_hashes))
+
+
+def _loaded_rows(connection, row_hashes):
+    row_hashes = list(row_hashes)
+    loaded = set()
+    for start in range(0, len(row_hashes), LOOKUP_CHUNK):
+        chunk = row_hashes[start:start + LOOKUP_CHUNK]
+        loaded.update(row[0] for row in connection.execute(
+            'SELECT row_hash FROM row_keys WHERE row_hash IN (%s)' % ', '.join(['?'] * len(chunk)), chunk))
+    return loaded
+
+
+def loaded_rows_lookup(path):
+    """mapInArrow function keeping the row hashes (first column) found in the index at `path`.
+
+    Runs on the executors, one batch of hashes at a time, so the hashes of
+    an export are never gathered on the driver. `path` must be absolute and
+    visible to the executors (source_code/ is mounted on every Spark
+    container); the index is opened read-only, so a path they cannot see
+    fails instead of reading as an empty index.
+    """
+    from pyspark import cloudpickle
+
+    # spark-submit only ships the main script: send this module's code with
+    # the function instead of importing it on the executors.
+    cloudpickle.register_pickle_by_value(sys.modules[__name__])
+    uri = 'file:%s?mode=ro' % urllib.parse.quote(path)
+
+    def lookup(batches):
+        import pyarrow as pa
+
+        connection = sqlite3.connect(uri, uri=True, timeout=30)
+        try:
+            for batch in batches:
+                loaded = _loaded_rows(connection, batch.column(0).to_pylist())
+                yield pa.RecordBatch.from_arrays([pa.array(sorted(loaded), pa.string())],
+                                                 names=[batch.schema.names[0]])
+        finally:
+            connection.close()
+
+    return lookup
@@ -0,0 +1,128 @@
+# Load stage for dbo.DimCustomer in SQL Server.
+#
+# Spark's JDBC writer opens one connection per DataFrame partition and sends
+# rows in JDBC batches. With the defaults (whatever partitioning the read
+# produced, 1000-row batches, plain INSERTs) a large customer load ends up
+# as a single row-by-row insert connection. The options below make the
+# parallelism and batching explicit and let mssql-jdbc use its bulk-copy API
+# for batch inserts.
+#
+# Two load modes are available:
+#   append - insert the batch into the target table.
+#   upsert - stage the batch and MERGE it into the target on the customer
+#            keys, so re-runs only write new or changed rows.
+#
+# For tests without SQL Server, `stand_in_dir` redirects the writes to
+# Parquet files, one folder per table (pipeline_service.py --stand-in).
+
+import os
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from dimcustomer_merge import MERGE_KEYS
+from dimcustomer_merge import merge_sql
+
+LOAD_MODES = ['append', 'upsert']
+
+ISOLATION_LEVELS = ['NONE', 'READ_UNCOMMITTED', 'READ_COMMITTED', 'REPEATABLE_READ', 'SERIALIZABLE']
+
+
+@dataclass(frozen=True)
+class JdbcWriteOptions:
+    """Tuning knobs for the JDBC write to SQL Server."""
+
+    # Number of parallel insert connections. None sizes it to the cluster:
+    # the total executor cores (2 workers x 2 cores in docker-compose.yml).
+    num_partitions: Optional[int] = None
+    # Rows sent per JDBC batch round trip.
+    batch_size: int = 10000
+    # Transaction isolation level of the insert connections (Spark's default).
+    isolation_level: str = 'READ_UNCOMMITTED'
+    # Let mssql-jdbc turn batch INSERTs into a bulk copy.
+    use_bulk_copy: bool = True
+    # Testing: append the rows to Parquet files in this folder instead of SQL Server.
+    stand_in_dir: Optional[str] = None
+
+
+def write_partitions(spark, options):
+    """Return the number of parallel insert connections to use."""
+    return options.num_partitions or spark.sparkContext.defaultParallelism
+
+
+def _write_stand_in(df, table, options):
+    df.write.mode('append').parquet(os.path.join(options.stand_in_dir, table))
+
+
+def _write_jdbc(df, url, properties, table, mode, options):
+    if options.stand_in_dir:
+        return _write_stand_in(df, table, options)
+    num_partitions = write_partitions(df.sparkSession, options)
+
+    # The JDBC writer can only coalesce down to numPartitions; spread small
+    # reads (one csv file is usually one partition) over all connections.
+    if df.rdd.getNumPartitions() < num_partitions:
+        df = df.repartition(num_partitions)
+
+    connection_properties = dict(properties)
+    connection_properties['useBulkCopyForBatchInsert'] = 'true' if options.use_bulk_copy else 'false'
+
+    df.write \
+      .option('numPartitions', num_partitions) \
+      .option('batchsize', options.batch_size) \
+      .option('isolationLevel', options.isolation_level) \
+      .jdbc(url=url, table=table, mode=mode, properties=connection_properties)
+
+
+def append_jdbc(df, url, properties, table, options=JdbcWriteOptions()):
+    """Append `df` to `table` with parallel, batched (and optionally bulk-copied) inserts."""
+    _write_jdbc(df, url, properties, table, 'append', options)
+
+
+def execute_jdbc(spark, url, properties, statements):
+    """Run SQL statements on the driver over a single JDBC connection.
+
+    Returns the update count of each statement.
+    """
+    jvm = spark.sparkContext._gateway.jvm
+    jvm.java.lang.Class.forName(properties['driver'])
+    connection_properties = jvm.java.util.Properties()
+    for key, value in properties.items():
+        connection_properties.setProperty(key, str(value))
+
+    connection = jvm.java.sql.DriverManager.getConnection(url, connection_properties)
+    try:
+        statement = connection.createStatement()
+        try:
+            return [statement.executeUpdate(sql) for sql in statements]
+        finally:
+            statement.close()
+    finally:
+        connection.close()
+
+
+def upsert_jdbc(df, url, properties, table, options=JdbcWriteOptions(), keys=MERGE_KEYS):
+    """Stage `df` and MERGE it into `table` on `keys`.
+
+    The batch is written to a per-run staging table next to the target with
+    the same parallel, batched writer as append mode, then applied with one
+    set-based MERGE: new keys are inserted, existing keys are updated only
+    when a value changed. The staging table is dropped afterwards.
+    Returns the number of rows inserted or updated.
+    """
+    # A key may only appear once in the MERGE source.
+    df = df.dropDuplicates(keys)
+    if options.stand_in_dir:
+        # The stand-in cannot MERGE: the deduplicated batch is appended.
+        _write_stand_in(df, table, options)
+        return df.count()
+
+    staging_table = '%s_staging_%s' % (table, uuid.uuid4().hex[:8])
+    try:
+        _write_jdbc(df, url, properties, staging_table, 'overwrite', options)
+        merged_rows, = execute_jdbc(df.sparkSession, url, properties,
+                                    [merge_sql(table, staging_table, df.columns, keys, dialect='tsql')])
+    finally:
+        execute_jdbc(df.sparkSession, url, properties,
+                     ["DROP TABLE IF EXISTS %s" % staging_table])
+    return merged_rows
@@ -0,0 +1,43 @@
+# Set-based MERGE (upsert) of a staged batch into dbo.DimCustomer.
+#
+# The batch is first written to a staging table, then applied to the target
+# with a single MERGE keyed on the customer keys. Rows that already exist
+# with identical values are left untouched, so re-running a partially failed
+# load only writes the rows that are new or changed.
+
+MERGE_KEYS = ['CUSTOMERKEY', 'CUSTOMERALTERNATEKEY']
+
+DIALECTS = ['tsql', 'snowflake']
+
+
+def _changed_condition(columns, dialect):
+    """SQL condition that is true when any non-key column differs (NULL-safe)."""
+    if dialect == 'tsql':
+        # SQL Server 2017 has no IS DISTINCT FROM; EXCEPT compares NULLs as equal.
+        return 'EXISTS (SELECT %s EXCEPT SELECT %s)' % (
+            ', '.join('s.%s' % c for c in columns),
+            ', '.join('t.%s' % c for c in columns))
+    return ' OR '.join('t.%s IS DISTINCT FROM s.%s' % (c, c) for c in columns)
+
+
+def merge_sql(target, staging, columns, keys=MERGE_KEYS, dialect='tsql'):
+    """Return the MERGE statement applying `staging` to `target`.
+
+    `columns` are the columns of both tables (e.g. SCHEMA_ORDER); `keys` the
+    subset identifying a customer. `dialect` is 'tsql' for SQL Server or
+    'snowflake'.
+    """
+    if dialect not in DIALECTS:
+        raise ValueError("Unknown SQL dialect: %s (expected one of %s)" % (dialect, ', '.join(DIALECTS)))
+
+    non_keys = [c for c in columns if c not in keys]
+    return '\n'.join([
+        'MERGE INTO %s t' % target,
+        'USING %s s' % staging,
+        '    ON %s' % ' AND '.join('t.%s = s.%s' % (k, k) for k in keys),
+        'WHEN MATCHED AND (%s) THEN' % _changed_condition(non_keys, dialect),
+        '    UPDATE SET %s' % ', '.join('%s = s.%s' % (c, c) for c in non_keys),
+        'WHEN NOT MATCHED THEN',
+        '    INSERT (%s)' % ', '.join(columns),
+        '    VALUES (%s);' % ', '.join('s.%s' % c for c in columns),
+    ])
@@ -0,0 +1,162 @@
+# Archival of processed POS exports.
+#
+# A processed export is moved to the archive directory exactly once, under a
+# name no other run can produce:
+#
+#   customer_update_2025-11-24_14-05-09-123456_3f2a9c81d0e4.csv
+#                   (UTC timestamp, microseconds)  (content hash)
+#
+# The move is a hard link to the new name followed by an unlink of the old
+# one. Creating the link fails instead of overwriting when the name is
+# taken, and only one of several workers racing for the same export can
+# unlink it; the others drop their link again and report that it was
+# already archived. Timestamps are UTC and use a 24-hour clock, so neither
+# AM/PM nor daylight-saving changes can reuse a name.
+#
+# Every archived file is recorded as one JSON line in the manifest of the
+# archive directory (old_versions/manifest.jsonl), with its SHA-256, so later
+# runs can tell whether an export with the same content was processed before.
+#
+# By default the export is archived as-is. A `store` function can archive it
+# in another representation instead (see dimcustomer_archive.py for the
+# Parquet archive); it must create its file atomically too.
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from dataclasses import asdict
+from dataclasses import dataclass
+
+DEFAULT_ARCHIVE_DIR = 'old_versions'
+MANIFEST_FILE = 'manifest.jsonl'
+
+# Characters of the content hash used in archive names.
+NAME_DIGEST_LENGTH = 12
+
+
+@dataclass(frozen=True)
+class ArchivedFile:
+    """One archived export, as recorded in the manifest."""
+
+    source: str
+    archived_path: str
+    sha256: str
+    bytes: int
+    archived_at: str
+
+
+class AlreadyArchivedError(FileNotFoundError):
+    """The export disappeared while being archived: another worker archived it first."""
+
+
+def file_sha256(path, block_size=1 << 20):
+    """Return the hex SHA-256 of the file at `path`, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def utc_timestamp(now=None):
+    """UTC timestamp used in archive names, e.g. 2025-11-24_14-05-09-123456."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return now.strftime('%Y-%m-%d_%H-%M-%S-%f')
+
+
+def archive_name(file_name, digest, now=None):
+    """Return the archive name of `file_name` for content `digest` archived at `now` (UTC)."""
+    stem, extension = os.path.splitext(os.path.basename(file_name))
+    return '%s_%s_%s%s' % (stem, utc_timestamp(now), digest[:NAME_DIGEST_LENGTH], extension)
+
+
+def link_atomically(path, archived_path):
+    """Hard-link `path` to `archived_path`; fails if `archived_path` exists."""
+    try:
+        os.link(path, archived_path)
+    except OSError as e:
+        if isinstance(e, FileExistsError) or not os.path.exists(path):
+            raise
+        # Different filesystem (or no hard links): copy next to the target
+        # first, so the final name still appears atomically.
+        tmp_path = '%s.%s.tmp' % (archived_path, uuid.uuid4().hex[:8])
+        shutil.copy2(path, tmp_path)
+        try:
+            os.link(tmp_path, archived_path)
+        finally:
+            os.unlink(tmp_path)
+
+
+def store_copy(path, archive_dir, sha256, now):
+    """Archive the export as-is under its archive name; returns the archived path."""
+    archived_path = os.path.join(archive_dir, archive_name(path, sha256, now))
+    link_atomically(path, archived_path)
+    return archived_path
+
+
+def append_manifest(record, archive_dir=DEFAULT_ARCHIVE_DIR):
+    """Append `record` to the manifest of `archive_dir` as one JSON line.
+
+    The line is written with a single O_APPEND write, so concurrent workers
+    do not interleave their records.
+    """
+    line = (json.dumps(asdict(record)) + '\n').encode('utf-8')
+    fd = os.open(os.path.join(archive_dir, MANIFEST_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def read_manifest(archive_dir=DEFAULT_ARCHIVE_DIR):
+    """Return the ArchivedFile records of the manifest of `archive_dir`."""
+    path = os.path.join(archive_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [ArchivedFile(**json.loads(line)) for line in f if line.strip()]
+
+
+def is_archived(path=None, archive_dir=DEFAULT_ARCHIVE_DIR, sha256=None):
+    """Return True when an export with the content of `path` (or `sha256`) was archived before."""
+    sha256 = sha256 or file_sha256(path)
+    return any(record.sha256 == sha256 for record in read_manifest(archive_dir))
+
+
+def archive_file(path, archive_dir=DEFAULT_ARCHIVE_DIR, store=store_copy):
+    """Move the processed export at `path` into `archive_dir` and record it in the manifest.
+
+    `store(path, archive_dir, sha256, now)` creates the archived file and
+    returns its path, raising FileExistsError when the name is taken.
+    Returns the ArchivedFile. Raises AlreadyArchivedError when another
+    worker archived the same export first.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    try:
+        sha256 = file_sha256(path)
+        size = os.path.getsize(path)
+        while True:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            try:
+                archived_path = store(path, archive_dir, sha256, now)
+                break
+            except FileExistsError:
+                # Same content archived within the same microsecond: take the next one.
+                continue
+    except FileNotFoundError:
+        raise AlreadyArchivedError("%s was already archived by another worker" % path)
+
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        # Another worker moved the export first; its link is the archived copy.
+        os.unlink(archived_path)
+        raise AlreadyArchivedError("%s was already archived by another worker" % path)
+
+    record = ArchivedFile(source=os.path.basename(path), archived_path=archived_path, sha256=sha256,
+                          bytes=size, archived_at=now.isoformat(timespec='microseconds'))
+    append_manifest(record, archive_dir)
+    return record
@@ -1,135 +1,767 @@
 # Table update in SQL Server.
 # POS generates a "new customer" export each day.
 # This update is a csv file that gets generated.
-# This script reads the output csv file into a 
+# This script reads the output csv file into a
 # spark dataframe, does some simple transformations,
 # then loads the table in SQL Server.
 
 # This is a simple POC for this pipeline into the ADW warehouse.
 
+# Two run modes are supported:
+#   batch  (default) - process the single customer_update.csv file.
+#   stream (--stream) - pick up every export dropped into the landing folder
+#                       and process them as micro-batches in one long-lived
+#                       Spark session (Structured Streaming).
+# With --incremental only the rows above the persisted CUSTOMERKEY /
+# DATEFIRSTPURCHASE watermark are transformed and loaded.
+# Each run (or micro-batch) writes one JSON metrics line per stage, see
+# pipeline_metrics.py.
+
+# The scheduler polls often and most polls find no export. A cheap pre-flight
+# runs before anything else: when there is nothing to process the script
+# exits without importing PySpark or creating a Spark session. PySpark and
+# the modules built on it are therefore imported inside the functions that
+# need them, not at module level.
+
+# Small exports do not need the cluster at all: below --arrow-threshold rows
+# a batch run uses the in-process PyArrow engine (dimcustomer_arrow.py),
+# which produces the same rows as the Spark path and loads them over
+# pymssql. --engine forces one engine or the other.
+
+# Processed exports are archived as zstd Parquet files partitioned by load
+# date (dimcustomer_archive.py; --archive-format csv keeps plain copies).
+# --replay-from/--replay-to re-feed the archived exports of a date range,
+# Parquet or csv, through the transformation and load, e.g. after a fix to
+# the transform.
+
+# With --dedup, exports and rows that were loaded before are skipped
+# (dimcustomer_dedup.py): a re-sent export is archived without being loaded,
+# and rows already loaded from another export are dropped before the write.
+
+# main() can run on a session it is given instead of building one:
+# pipeline_service.py keeps warm sessions and runs submitted jobs on them.
+
 # General Imports
-import pandas as pd
-import os
-import shutil 
+import argparse
 import datetime
+import glob
+import os
+import sys
+from urllib.parse import unquote, urlparse
+
+# Pipeline Imports (plain Python, no PySpark)
+from dimcustomer_archive import ARCHIVE_FORMATS
+from dimcustomer_archive import archive_export
+from dimcustomer_archive import replay_csv_files
+from dimcustomer_archive import replay_files
+from dimcustomer_archive import replay_partitions
+from dimcustomer_dedup import DEFAULT_DEDUP_FILE
+from dimcustomer_dedup import DedupIndex
+from dimcustomer_load import ISOLATION_LEVELS
+from dimcustomer_load import JdbcWriteOptions
+from dimcustomer_load import LOAD_MODES
+from dimcustomer_load import append_jdbc
+from dimcustomer_load import upsert_jdbc
+from dimcustomer_watermark import DEFAULT_WATERMARK_FILE
+from dimcustomer_watermark import Watermark
+from dimcustomer_watermark import load_watermark
+from dimcustomer_watermark import save_watermark
+from pipeline_archive import DEFAULT_ARCHIVE_DIR
+from pipeline_archive import AlreadyArchivedError
+from pipeline_archive import file_sha256
+from pipeline_config import load_pipeline_config
+from pipeline_metrics import PipelineMetrics
+from pipeline_metrics import SparkJobTracker
+
+# Spark and SQL Server settings (spark_configs.txt, sql_server_credentials.txt,
+# overridable from the environment).
+config = load_pipeline_config()
+
+# Exit code of --preflight when there is no export to process.
+NO_INPUT_EXIT_CODE = 3
+# Exit code of --preflight when the export is small enough for the Arrow engine.
+ARROW_ENGINE_EXIT_CODE = 4
+
+ENGINES = ['auto', 'spark', 'arrow']
+DEFAULT_ARROW_THRESHOLD = 100000
+
+
+def show_sample(df, label, sample_rows):
+    """Print the first rows of `df` when a debug sample was requested.
+
+    Every show() is a separate Spark job, so production runs (sample_rows=0)
+    skip it and execute exactly one read -> write job.
+    """
+    if sample_rows:
+        print("\n%s:" % label)
+        df.show(sample_rows)
+
+
+def show_arrow_sample(table, label, sample_rows):
+    """Print the first rows of an Arrow table when a debug sample was requested."""
+    if sample_rows:
+        print("\n%s:" % label)
+        print(table.slice(0, sample_rows).to_pandas().to_string())
+
+
+def target_schema_loader(spark):
+    """Return a callable that fetches the column types of dbo.DimCustomer over JDBC.
+
+    Resolving a JDBC relation only queries the table metadata, no rows are read.
+    """
+    def load():
+        return spark.read.jdbc(url=config.sql_server_url,
+                               table='dbo.DimCustomer',
+                               properties=config.jdbc_properties()).schema
+    return load
+
+
+def target_watermark_loader(spark):
+    """Return a callable that reads the current watermark of dbo.DimCustomer over JDBC.
+
+    Used to seed the state file on the first incremental run; SQL Server
+    answers the two MAX() aggregates, only one row comes back.
+    """
+    def load():
+        row = spark.read.jdbc(url=config.sql_server_url,
+                              table='(SELECT MAX(CustomerKey) AS CUSTOMERKEY, '
+                                    'MAX(DateFirstPurchase) AS DATEFIRSTPURCHASE '
+                                    'FROM dbo.DimCustomer) AS watermark',
+                              properties=config.jdbc_properties()).first()
+        return Watermark.of(row['CUSTOMERKEY'], row['DATEFIRSTPURCHASE'])
+    return load
+
+
+def filter_new_rows(df, watermark):
+    """Keep only the export rows above `watermark`.
+
+    Applied straight after the read, so Spark pushes the filter down into
+    the csv scan and the older rows never reach the transformation.
+    """
+    condition = watermark.filter_sql()
+    if condition is None:
+        return df
+    print("Incremental load: %s" % condition)
+    return df.filter(condition)
+
+
+def skip_loaded_exports(paths, dedup, archive_dir=DEFAULT_ARCHIVE_DIR, archive_format='parquet'):
+    """Archive the exports whose content was loaded before, without loading them again.
+
+    Returns {path: sha256} of the exports still to load. Each check is one
+    primary-key lookup in the dedup index, however many loads it holds.
+    """
+    new_exports = {}
+    for path in paths:
+        sha256 = file_sha256(path)
+        if not dedup.has_file(sha256):
+            new_exports[path] = sha256
+            continue
+        print("%s was loaded before, archiving it without loading." % path)
+        try:
+            archive_export(path, archive_dir, archive_format)
+        except AlreadyArchivedError as e:
+            print(e)
+    return new_exports
+
+
+def new_exports(paths, dedup_file):
+    """Return the exports of `paths` whose content is not in the dedup index, without changing anything."""
+    if not os.path.exists(dedup_file):
+        return list(paths)
+    with DedupIndex(dedup_file, read_only=True) as dedup:
+        return [path for path in paths if not dedup.has_file(file_sha256(path))]
+
+
+def drop_loaded_rows(df, dedup):
+    """Drop the rows of `df` that `dedup` saw loaded before.
+
+    Returns the remaining DataFrame and a DataFrame of the hashes of its
+    rows, to record once they are written (see local_values()). The distinct
+    hashes of the batch are looked up in the index on the executors
+    (dimcustomer_dedup.loaded_rows_lookup()), and the rows whose hash was
+    found are removed with an anti-join, so the driver never holds the
+    hashes of the export.
+
+    The lookup runs once, here, and its result is kept on the executors
+    (localCheckpoint()). Neither the write nor the returned hashes read the
+    index again, so record_load() can consume them inside its write
+    transaction. Otherwise the executors would re-open the index while the
+    driver holds its write lock, block on it, and read a half-written index.
+    """
+    from dimcustomer_dedup import ROW_HASH_COLUMN
+    from dimcustomer_dedup import loaded_rows_lookup
+    from dimcustomer_dedup import row_hash_column
+
+    df = df.withColumn(ROW_HASH_COLUMN, row_hash_column(df.columns))
+    row_hashes = df.select(ROW_HASH_COLUMN).distinct()
+    loaded = row_hashes.mapInArrow(loaded_rows_lookup(os.path.abspath(dedup.path)),
+                                   '%s string' % ROW_HASH_COLUMN).localCheckpoint()
+    df = df.join(loaded, ROW_HASH_COLUMN, 'left_anti')
+    return df.drop(ROW_HASH_COLUMN), row_hashes.join(loaded, ROW_HASH_COLUMN, 'left_anti')
+
+
+def local_values(df):
+    """Iterate over the first column of `df`, one partition at a time on the driver."""
+    return (row[0] for row in df.toLocalIterator())
+
+
+def observe_watermark(df):
+    """Collect the maxima of the rows in `df` as a side effect of writing it.
+
+    Returns the observed DataFrame and the Observation; its values are
+    available once the write has run, without a separate aggregation job.
+    """
+    from pyspark.sql import Observation
+    from pyspark.sql.functions import max as spark_max
+
+    observation = Observation('watermark')
+    df = df.observe(observation,
+                    spark_max('CUSTOMERKEY').alias('CUSTOMERKEY'),
+                    # Strings come back through py4j as-is, dates do not.
+                    spark_max('DATEFIRSTPURCHASE').cast('string').alias('DATEFIRSTPURCHASE'))
+    return df, observation
+
+
+def observe_rows(df, name):
+    """Count the rows of `df` as a side effect of the job that consumes it.
+
+    Returns the observed DataFrame and a callable returning the count once
+    that job has run (see pipeline_metrics.py); no extra count() job is run.
+    """
+    from pyspark.sql import Observation
+    from pyspark.sql.functions import count
+    from pyspark.sql.functions import lit
+
+    observation = Observation(name)
+    df = df.observe(observation, count(lit(1)).alias('rows'))
+    return df, lambda: observation.get['rows']
+
+
+def write_dimcustomer(df_transformed, write_options=JdbcWriteOptions(), load_mode='append'):
+    """Load the transformed DataFrame into dbo.DimCustomer in SQL Server.
+
+    load_mode 'append' inserts every row; 'upsert' merges the batch on the
+    customer keys so that a re-run does not duplicate rows. Returns the
+    number of merged rows in upsert mode, None in append mode.
+    """
+    properties = config.jdbc_properties()
+    if load_mode == 'upsert':
+        merged_rows = upsert_jdbc(df_transformed, config.sql_server_url, properties,
+                                  table='dbo.DimCustomer', options=write_options)
+        print("Merged %d new or changed row(s) into dbo.DimCustomer." % merged_rows)
+        return merged_rows
+    else:
+        append_jdbc(df_transformed, config.sql_server_url, properties,
+                    table='dbo.DimCustomer', options=write_options)
+
+
+def write_incremental(df_transformed, watermark, watermark_file,
+                      write_options=JdbcWriteOptions(), load_mode='append'):
+    """Load `df_transformed` and persist the watermark advanced past its rows.
+
+    The state file is only updated after the write succeeded, so a failed
+    load is picked up again by the next run. Returns the new watermark and
+    the result of write_dimcustomer().
+    """
+    df_transformed, observation = observe_watermark(df_transformed)
+    merged_rows = write_dimcustomer(df_transformed, write_options, load_mode)
+
+    maxima = observation.get
+    watermark = watermark.advance(maxima['CUSTOMERKEY'], maxima['DATEFIRSTPURCHASE'])
+    save_watermark(watermark, watermark_file)
+    return watermark, merged_rows
+
+
+def run_batch(spark, schema, input_path='customer_update.csv', sample_rows=0,
+              write_options=JdbcWriteOptions(), load_mode='append', watermark_file=None,
+              metrics_file=None, archive_dir=DEFAULT_ARCHIVE_DIR, archive_format='parquet', dedup=None):
+    """Process a single export file: read, transform, load, archive.
+
+    With a `watermark_file` only the rows above the persisted watermark are
+    loaded; with a `dedup` index only the rows not loaded before. Stage
+    metrics go to `metrics_file` (default: stdout).
+    """
+    from dimcustomer_transform import transform_customer_update
+
+    metrics = PipelineMetrics('spark', metrics_file, SparkJobTracker(spark))
+    try:
+        with metrics.stage('read', bytes_read=os.path.getsize(input_path)) as stage:
+            # Spark read from a local csv file, in a single pass with the declared schema.
+            df = spark.read.csv(input_path, header=True, schema=schema)
+            if watermark_file:
+                watermark = load_watermark(watermark_file, seed=target_watermark_loader(spark))
+                df = filter_new_rows(df, watermark)
+            if dedup:
+                df, row_hashes = drop_loaded_rows(df, dedup)
+            show_sample(df, "Data read from CSV", sample_rows)
+            df, stage['rows_out'] = observe_rows(df, 'read')
+
+        with metrics.stage('transform') as stage:
+            df_transformed = transform_customer_update(df)
+            show_sample(df_transformed, "DataFrame after transformation", sample_rows)
+            df_transformed, stage['rows_out'] = observe_rows(df_transformed, 'transform')
+            transformed_rows = stage['rows_out']
+
+        # Write the DataFrame to SQL Server.
+        with metrics.stage('write') as stage:
+            if watermark_file:
+                watermark, merged_rows = write_incremental(df_transformed, watermark, watermark_file,
+                                                           write_options, load_mode)
+            else:
+                merged_rows = write_dimcustomer(df_transformed, write_options, load_mode)
+            stage['rows_out'] = transformed_rows if merged_rows is None else merged_rows
+            if dedup:
+                dedup.record_load([(file_sha256(input_path), os.path.basename(input_path))],
+                                  local_values(row_hashes))
+
+        # once the data has been loaded, move the file to the backup directory.
+        with metrics.stage('archive'):
+            print("Archived %s" % archive_export(input_path, archive_dir, archive_format).archived_path)
+    finally:
+        metrics.flush()
+
+
+def run_arrow(input_path='customer_update.csv', sample_rows=0, load_mode='append', watermark_file=None,
+              metrics_file=None, archive_dir=DEFAULT_ARCHIVE_DIR, archive_format='parquet', dedup=None):
+    """Process a single export file in-process with PyArrow: read, transform, load, archive.
+
+    Same steps and output as run_batch(), without a Spark session.
+    """
+    import dimcustomer_arrow
+
+    metrics = PipelineMetrics('arrow', metrics_file)
+    connection = dimcustomer_arrow.connect(config)
+    try:
+        with metrics.stage('read', bytes_read=os.path.getsize(input_path)) as stage:
+            table = dimcustomer_arrow.read_customer_update(input_path)
+            if watermark_file:
+                watermark = load_watermark(watermark_file, seed=lambda: Watermark.of(
+                    *dimcustomer_arrow.read_target_watermark(connection)))
+                table = dimcustomer_arrow.filter_new_rows(table, watermark)
+            if dedup:
+                table, row_hashes = dimcustomer_arrow.drop_loaded_rows(table, dedup)
+            show_arrow_sample(table, "Data read from CSV", sample_rows)
+            stage['rows_out'] = table.num_rows
+
+        with metrics.stage('transform') as stage:
+            table = dimcustomer_arrow.transform_customer_update(table)
+            show_arrow_sample(table, "Table after transformation", sample_rows)
+            stage['rows_out'] = table.num_rows
+
+        with metrics.stage('write') as stage:
+            if load_mode == 'upsert':
+                stage['rows_out'] = dimcustomer_arrow.upsert_table(connection, table)
+                print("Merged %d new or changed row(s) into dbo.DimCustomer." % stage['rows_out'])
+            else:
+                dimcustomer_arrow.append_table(connection, table)
+                stage['rows_out'] = table.num_rows
+            if watermark_file:
+                save_watermark(watermark.advance(*dimcustomer_arrow.watermark_maxima(table)), watermark_file)
+            if dedup:
+                dedup.record_load([(file_sha256(input_path), os.path.basename(input_path))], row_hashes)
+
+        with metrics.stage('archive'):
+            print("Archived %s" % archive_export(input_path, archive_dir, archive_format).archived_path)
+    finally:
+        connection.close()
+        metrics.flush()
+
+
+def run_stream(spark, schema, landing_dir, checkpoint_dir, archive_dir=DEFAULT_ARCHIVE_DIR,
+               files_per_batch=None, watch=False, trigger_interval='1 minute', sample_rows=0,
+               write_options=JdbcWriteOptions(), load_mode='append', watermark_file=None,
+               metrics_file=None, archive_format='parquet', dedup=None):
+    """Process every export in the landing folder as Structured Streaming micro-batches.
+
+    Each micro-batch goes through the same transformation chain as batch mode.
+    A file is archived only after the batch containing it has been written to
+    SQL Server; if the write fails the file stays in the landing folder and the
+    batch is retried from the checkpoint on the next run. With a
+    `watermark_file` each micro-batch only loads the rows above the watermark
+    left by the previous one. With a `dedup` index, files loaded before are
+    archived without loading them and rows loaded before are dropped. Stage
+    metrics are written after every micro-batch.
+    """
+    from pyspark.sql.functions import col
+    from pyspark.sql.functions import input_file_name
+    from dimcustomer_transform import transform_customer_update
+
+    landing_dir = os.path.abspath(landing_dir)
+    archive_dir = os.path.abspath(archive_dir)
+    state = {}
+    if watermark_file:
+        state['watermark'] = load_watermark(watermark_file, seed=target_watermark_loader(spark))
+
+    reader = spark.readStream \
+                  .schema(schema) \
+                  .option("header", True) \
+                  .option("pathGlobFilter", "*.csv")
+    if files_per_batch:
+        reader = reader.option("maxFilesPerTrigger", files_per_batch)
+    df_stream = reader.csv(landing_dir) \
+                      .withColumn("_SOURCE_FILE", input_file_name())
+
+    metrics = PipelineMetrics('spark', metrics_file, SparkJobTracker(spark))
+
+    def process_batch(batch_df, batch_id):
+        batch_df, rows_read = observe_rows(batch_df, 'read')
+        batch_df.persist()
+        try:
+            with metrics.stage('read', batch_id=batch_id) as stage:
+                source_uris = {unquote(urlparse(row['_SOURCE_FILE']).path): row['_SOURCE_FILE'] for row in
+                               batch_df.select('_SOURCE_FILE').distinct().collect()}
+                source_files = list(source_uris)
+                stage['rows_out'] = rows_read
+                stage['bytes_read'] = sum(os.path.getsize(path) for path in source_files
+                                          if os.path.exists(path))
+            if not source_files:
+                return
+            print("Micro-batch %s: %d file(s)" % (batch_id, len(source_files)))
+            if dedup:
+                new_exports = skip_loaded_exports(source_files, dedup, archive_dir, archive_format)
+                source_files = list(new_exports)
+                if not source_files:
+                    return
+
+            with metrics.stage('transform', batch_id=batch_id) as stage:
+                df = batch_df
+                if dedup:
+                    df = df.filter(col('_SOURCE_FILE').isin([source_uris[path] for path in source_files]))
+                df = df.drop('_SOURCE_FILE')
+                if watermark_file:
+                    df = filter_new_rows(df, state['watermark'])
+                if dedup:
+                    df, row_hashes = drop_loaded_rows(df, dedup)
+                df_transformed = transform_customer_update(df)
+                show_sample(df_transformed, "Micro-batch %s after transformation" % batch_id, sample_rows)
+                df_transformed, stage['rows_out'] = observe_rows(df_transformed, 'transform')
+                transformed_rows = stage['rows_out']
+
+            with metrics.stage('write', batch_id=batch_id) as stage:
+                if watermark_file:
+                    state['watermark'], merged_rows = write_incremental(df_transformed, state['watermark'],
+                                                                        watermark_file, write_options, load_mode)
+                else:
+                    merged_rows = write_dimcustomer(df_transformed, write_options, load_mode)
+                stage['rows_out'] = transformed_rows if merged_rows is None else merged_rows
+                if dedup:
+                    dedup.record_load([(sha256, os.path.basename(path)) for path, sha256 in new_exports.items()],
+                                      local_values(row_hashes))
+
+            # The batch is in SQL Server - archive the files it came from.
+            with metrics.stage('archive', batch_id=batch_id):
+                for local_path in source_files:
+                    try:
+                        print("Archived %s" % archive_export(local_path, archive_dir,
+                                                             archive_format).archived_path)
+                    except AlreadyArchivedError as e:
+                        print(e)
+        finally:
+            batch_df.unpersist()
+            metrics.flush()
+
+    writer = df_stream.writeStream \
+                      .foreachBatch(process_batch) \
+                      .option("checkpointLocation", os.path.abspath(checkpoint_dir))
+    if watch:
+        # Keep polling the landing folder for the rest of the day.
+        writer = writer.trigger(processingTime=trigger_interval)
+    else:
+        # Drain everything that has landed so far, then stop.
+        writer = writer.trigger(availableNow=True)
+
+    query = writer.start()
+    query.awaitTermination()
+
+
+def read_archived(spark, archived_paths):
+    """Read archived exports, Parquet files and csv copies, into one DataFrame.
+
+    The Parquet files carry the declared column types, so they are read
+    without a schema; the csv copies are read with the declared schema.
+    """
+    from dimcustomer_schema import CUSTOMER_UPDATE_SCHEMA
+
+    parquet_paths = [path for path in archived_paths if path.endswith('.parquet')]
+    csv_paths = [path for path in archived_paths if not path.endswith('.parquet')]
+    frames = []
+    if parquet_paths:
+        frames.append(spark.read.parquet(*parquet_paths))
+    if csv_paths:
+        frames.append(spark.read.csv(csv_paths, header=True, schema=CUSTOMER_UPDATE_SCHEMA))
+    df = frames[0]
+    for other in frames[1:]:
+        df = df.unionByName(other)
+    return df
+
+
+def run_replay(spark, replay_paths, sample_rows=0, write_options=JdbcWriteOptions(), load_mode='append',
+               watermark_file=None, metrics_file=None):
+    """Re-feed archived exports through the transformation and load.
+
+    They are read by read_archived() and go through the same steps as a
+    fresh export. Nothing is archived again. Use load_mode 'upsert' to
+    replay over rows already in dbo.DimCustomer without duplicating them.
+    """
+    from dimcustomer_transform import transform_customer_update
+
+    metrics = PipelineMetrics('spark', metrics_file, SparkJobTracker(spark))
+    try:
+        with metrics.stage('read', bytes_read=sum(os.path.getsize(path) for path in replay_paths)) as stage:
+            print("Replaying %d archived export(s)" % len(replay_paths))
+            df = read_archived(spark, replay_paths)
+            if watermark_file:
+                watermark = load_watermark(watermark_file, seed=target_watermark_loader(spark))
+                df = filter_new_rows(df, watermark)
+            show_sample(df, "Data read from the archive", sample_rows)
+            df, stage['rows_out'] = observe_rows(df, 'read')
+
+        with metrics.stage('transform') as stage:
+            df_transformed = transform_customer_update(df)
+            show_sample(df_transformed, "DataFrame after transformation", sample_rows)
+            df_transformed, stage['rows_out'] = observe_rows(df_transformed, 'transform')
+            transformed_rows = stage['rows_out']
+
+        with metrics.stage('write') as stage:
+            if watermark_file:
+                watermark, merged_rows = write_incremental(df_transformed, watermark, watermark_file,
+                                                           write_options, load_mode)
+            else:
+                merged_rows = write_dimcustomer(df_transformed, write_options, load_mode)
+            stage['rows_out'] = transformed_rows if merged_rows is None else merged_rows
+    finally:
+        metrics.flush()
+
+
+def pending_inputs(input_path='customer_update.csv', stream=False, landing_dir='landing', replay=None,
+                   archive_dir=DEFAULT_ARCHIVE_DIR):
+    """Return the export files waiting to be processed.
+
+    Only looks at the local filesystem, so it is cheap enough to run on
+    every scheduler poll before Spark is started. `replay` is a (start, end)
+    date range of archived exports to re-feed.
+    """
+    if replay:
+        return replay_files(replay_partitions(archive_dir, *replay)) + replay_csv_files(archive_dir, *replay)
+    if stream:
+        return sorted(glob.glob(os.path.join(landing_dir, '*.csv')))
+    return [input_path] if os.path.exists(input_path) else []
+
+
+def count_rows(path, limit=None):
+    """Count the data rows of an export, stopping once more than `limit` were seen.
+
+    Only counts line breaks, so deciding that an export is too big for the
+    Arrow engine costs no more than reading `limit` rows.
+    """
+    lines = 0
+    block = b''
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+            if limit is not None and lines > limit + 1:
+                return lines - 1
+    if block and not block.endswith(b'\n'):
+        # A last row without a trailing line break.
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def select_engine(args):
+    """Return the engine to run with: 'arrow' for small batch exports, 'spark' otherwise."""
+    if args.engine != 'auto':
+        return args.engine
+    if args.stream or args.watch or args.schema == 'target' or args.replay:
+        return 'spark'
+    return 'arrow' if count_rows(args.input, args.arrow_threshold) <= args.arrow_threshold else 'spark'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load POS customer exports into dbo.DimCustomer.")
+    parser.add_argument('--input', default='customer_update.csv',
+                        help="Export file to process in batch mode (default: customer_update.csv)")
+    parser.add_argument('--schema', choices=['declared', 'target'], default='declared',
+                        help="Read the export with the declared schema, or with one derived from the "
+                             "dbo.DimCustomer table and cached on disk (default: declared)")
+    parser.add_argument('--refresh-schema', action='store_true',
+                        help="Re-derive the cached schema from dbo.DimCustomer (with --schema target)")
+    parser.add_argument('--sample', type=int, default=0, metavar='ROWS',
+                        help="Debug: print the first ROWS rows after reading and after transforming "
+                             "(each preview is an extra Spark job; default: 0, no preview)")
+    parser.add_argument('--load-mode', choices=LOAD_MODES, default='append',
+                        help="append inserts every row; upsert merges the batch on CUSTOMERKEY and "
+                             "CUSTOMERALTERNATEKEY so re-runs only write new or changed rows (default: append)")
+    parser.add_argument('--write-partitions', type=int, default=None,
+                        help="Parallel JDBC insert connections (default: total executor cores)")
+    parser.add_argument('--batch-size', type=int, default=JdbcWriteOptions.batch_size,
+                        help="Rows per JDBC insert batch (default: %(default)s)")
+    parser.add_argument('--isolation-level', choices=ISOLATION_LEVELS,
+                        default=JdbcWriteOptions.isolation_level,
+                        help="Transaction isolation level of the insert connections (default: %(default)s)")
+    parser.add_argument('--no-bulk-copy', dest='bulk_copy', action='store_false',
+                        help="Send plain batched INSERTs instead of the mssql-jdbc bulk copy")
+    parser.add_argument('--stand-in-dir', default=None, metavar='DIR',
+                        help="Testing: write the rows to Parquet files in DIR instead of SQL Server "
+                             "(Spark engine only; upsert appends; --incremental needs an existing "
+                             "watermark file)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only load rows above the persisted CUSTOMERKEY/DATEFIRSTPURCHASE watermark "
+                             "(seeded from dbo.DimCustomer on the first run)")
+    parser.add_argument('--watermark-file', default=DEFAULT_WATERMARK_FILE,
+                        help="State file holding the watermark for --incremental (default: %(default)s)")
+    parser.add_argument('--dedup', action='store_true',
+                        help="Skip exports whose content was loaded before and drop rows loaded before")
+    parser.add_argument('--dedup-file', default=DEFAULT_DEDUP_FILE,
+                        help="SQLite index of the loaded exports and rows for --dedup (default: %(default)s)")
+    parser.add_argument('--stream', action='store_true',
+                        help="Process every export in the landing folder as micro-batches")
+    parser.add_argument('--landing-dir', default='landing',
+                        help="Folder watched in stream mode (default: landing)")
+    parser.add_argument('--checkpoint-dir', default='checkpoints/dimcustomer',
+                        help="Structured Streaming checkpoint location (default: checkpoints/dimcustomer)")
+    parser.add_argument('--files-per-batch', type=int, default=None,
+                        help="Maximum number of files per micro-batch (default: all available)")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running and poll the landing folder instead of stopping once it is drained")
+    parser.add_argument('--trigger-interval', default='1 minute',
+                        help="Polling interval used with --watch (default: 1 minute)")
+    parser.add_argument('--archive-dir', default=DEFAULT_ARCHIVE_DIR,
+                        help="Archive of the processed exports (default: %(default)s)")
+    parser.add_argument('--archive-format', choices=ARCHIVE_FORMATS, default='parquet',
+                        help="parquet archives each processed export as a zstd Parquet file partitioned by "
+                             "load date, csv keeps a plain copy (default: %(default)s)")
+    parser.add_argument('--replay-from', type=datetime.date.fromisoformat, default=None, metavar='YYYY-MM-DD',
+                        help="Re-feed the exports archived from this load date on (Parquet or csv), "
+                             "instead of processing new exports")
+    parser.add_argument('--replay-to', type=datetime.date.fromisoformat, default=None, metavar='YYYY-MM-DD',
+                        help="Last load date to replay (default: today, UTC)")
+    parser.add_argument('--engine', choices=ENGINES, default='auto',
+                        help="spark runs on the Spark cluster, arrow in-process with PyArrow; auto picks arrow "
+                             "for batch exports of at most --arrow-threshold rows (default: auto)")
+    parser.add_argument('--arrow-threshold', type=int, default=DEFAULT_ARROW_THRESHOLD, metavar='ROWS',
+                        help="Largest export processed by the Arrow engine with --engine auto "
+                             "(default: %(default)s)")
+    parser.add_argument('--metrics-file', default=None,
+                        help="Append the per-stage JSON metrics lines to this file (default: stdout)")
+    parser.add_argument('--preflight', action='store_true',
+                        help="Only check for pending exports, without starting Spark: exit 0 when there "
+                             "is work for Spark, %d when the Arrow engine will run and %d when there is none "
+                             "(read-only: with --dedup, a re-sent export is only archived by the run)"
+                             % (ARROW_ENGINE_EXIT_CODE, NO_INPUT_EXIT_CODE))
+    args = parser.parse_args(argv)
+    if args.replay_to and not args.replay_from:
+        parser.error("--replay-to needs --replay-from")
+    args.replay = None
+    if args.replay_from:
+        if args.stream or args.dedup:
+            parser.error("--replay-from re-feeds loaded exports, it cannot be combined with --stream or --dedup")
+        args.replay = (args.replay_from, args.replay_to or datetime.datetime.now(datetime.timezone.utc).date())
+    if args.engine == 'arrow' and (args.stream or args.schema == 'target' or args.replay):
+        parser.error("--engine arrow only runs batch mode with the declared schema")
+    if args.stand_in_dir:
+        if args.engine == 'arrow' or args.schema == 'target':
+            parser.error("--stand-in-dir only replaces the Spark writes, it cannot be combined with "
+                         "--engine arrow or --schema target")
+        args.engine = 'spark'
+    return args
+
+
+def main(argv=None, spark=None):
+    """Run the pipeline; returns the exit code.
+
+    `spark` is a warm session to run on (see pipeline_service.py); by default
+    a session is built once there is work for Spark.
+    """
+    args = parse_args(argv)
+
+    # Pre-flight: stop before PySpark is imported when there is nothing to do.
+    # --watch keeps polling the landing folder itself, so it always starts.
+    pending = pending_inputs(args.input, args.stream, args.landing_dir, args.replay, args.archive_dir)
+    if not args.watch and not pending:
+        if args.replay:
+            print("No archived export loaded from %s to %s." % args.replay)
+        else:
+            print("No export to process in %s." % (args.landing_dir if args.stream else args.input))
+        return NO_INPUT_EXIT_CODE if args.preflight else 0
+
+    # --preflight only reads: it never creates the index or archives an export.
+    dedup = DedupIndex(args.dedup_file) if args.dedup and not args.preflight else None
+    if args.dedup and not args.stream and not args.watch:
+        if args.preflight:
+            # Only re-sent exports: the real run archives them before any
+            # session starts, so the in-process run is enough.
+            if not new_exports(pending, args.dedup_file):
+                return ARROW_ENGINE_EXIT_CODE if args.schema == 'declared' else 0
+        elif not skip_loaded_exports(pending, dedup, args.archive_dir, args.archive_format):
+            # A re-sent export is archived here, without starting Spark.
+            return 0
+    engine = select_engine(args)
+    if args.preflight:
+        return ARROW_ENGINE_EXIT_CODE if engine == 'arrow' else 0
+
+    watermark_file = args.watermark_file if args.incremental else None
+
+    if engine == 'arrow':
+        run_arrow(args.input, sample_rows=args.sample,
+                  load_mode=args.load_mode,
+                  watermark_file=watermark_file,
+                  metrics_file=args.metrics_file,
+                  archive_dir=args.archive_dir,
+                  archive_format=args.archive_format,
+                  dedup=dedup)
+        return 0
+
+    from dimcustomer_schema import customer_update_schema
+
+    # Spark Session
+    if spark is None:
+        from pyspark.sql import SparkSession
 
-# PySpark Imports
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import col
-from pyspark.sql.functions import upper
-from pyspark.sql.functions import lower
-from pyspark.sql.functions import split
-from pyspark.sql.functions import trim
-from pyspark.sql.functions import when
-from pyspark.sql.functions import lit
-from pyspark.sql.functions import expr
-from pyspark.sql.functions import regexp_replace
-
-# Credential files.
-spark_creds = pd.read_csv('spark_configs.txt', index_col=None, header=0, delimiter = "|")
-sql_server_creds = pd.read_csv('sql_server_credentials.txt', index_col=None, header=0, delimiter = "|")
-
-# Spark related credentials
-driver_path = spark_creds.loc[spark_creds['Specific_Element'] == 'Driver', 'Value'].item()
-
-# SQL Server related credentials.
-sql_server_user = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'User', 'Value'].item()
-sql_server_password = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'Password', 'Value'].item()
-sql_server_url = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'URL', 'Value'].item()
-sql_server_port = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'Port', 'Value'].item()
-sql_server_database = sql_server_creds.loc[sql_server_creds['Specific_Element'] == 'Database', 'Value'].item()
-
-# Spark Session
-spark = SparkSession.builder.config('spark.driver.extraClassPath', driver_path) \
-                    .appName('SparkSqlServerExample') \
-                    .getOrCreate()
-
-# Spark read from a local csv file.
-df = spark.read.csv('customer_update.csv', header=True, inferSchema=True)
-print("Successfully read data from CSV.")
-df.show(5)
-
-
-# --- Transformation 1: Convert string columns to uppercase ---
-# This transformation iterates through all columns in the SQL Server DataFrame.
-# If a column's data type is 'string', it applies the 'upper()' function to convert all characters to uppercase.
-# The result is a new DataFrame 'uppercase_df' with the transformed string columns.
-df_uppercase = df.select([col(c).alias(c.upper()) for c in df.columns])
-print("\nDataFrame after uppercase transformation:")
-df_uppercase.show()
-
-# Split the 'full_name' column into an array of strings
-# The split function takes the column and the delimiter.
-# We split by ", " (comma followed by a space)
-split_col = split(df_uppercase['NAME'], '.first:')
-print(split_col.getItem(0))
-
-# Extract last name and first name from the split array
-# The first element (index 0) will be the last name.
-# The second element (index 1) will be the first name.
-# Use trim() to remove any leading/trailing whitespace that might exist.
-df_transformed = df_uppercase.withColumn("LASTNAME", trim(split_col.getItem(0))) \
-                   .withColumn("FIRSTNAME", trim(split_col.getItem(1)))
-
-# Change the name.
-df_transformed = df_transformed.withColumn("NEWLASTNAME",regexp_replace("LASTNAME","name:last:",''))
-
-# Drop the last name column and the name colum.
-df_transformed = df_transformed.drop('NAME')
-df_transformed = df_transformed.drop('LASTNAME')
-df_transformed = df_transformed.withColumnRenamed("NEWLASTNAME", "LASTNAME")
-
-# Check how it looks.
-df_transformed.show(1)
-
-# Add a field from data in an existing field. 
-df_transformed = df_transformed.withColumn('GENDER_SHORT', when(col('GENDER') == 'Male', 
-                                            lit('M')).when(col('GENDER') == 'Female', lit('F')).otherwise(col('GENDER')))
-
-# Drop the old column name.
-df_transformed = df_transformed.drop('GENDER')
-
-# Rename a couple of columns.
-df_transformed = df_transformed.withColumnRenamed("GENDER_SHORT", "GENDER")
-df_transformed = df_transformed.withColumnRenamed("ADDRESS", "ADDRESSLINE1")
-
-# Add another column that is missing in the csv export.
-from pyspark.sql.types import StringType #fix: import string type to avoid null value error
-df_transformed = df_transformed.withColumn('ADDRESSLINE2', lit(None).cast(StringType())) #fix: cast to string type to avoid null value error
-
-# Reorder the schema based on what the table in SQL Server is expecting.
-# schema order
-schema_order = ['CUSTOMERKEY','GEOGRAPHYKEY','CUSTOMERALTERNATEKEY','TITLE',
-                'FIRSTNAME','MIDDLENAME','LASTNAME','NAMESTYLE',
-                'BIRTHDATE','MARITALSTATUS','SUFFIX','GENDER','EMAILADDRESS',
-                'YEARLYINCOME','TOTALCHILDREN','NUMBERCHILDRENATHOME',
-                'ENGLISHEDUCATION','SPANISHEDUCATION','FRENCHEDUCATION',
-                'ENGLISHOCCUPATION','SPANISHOCCUPATION','FRENCHOCCUPATION',
-                'HOUSEOWNERFLAG','NUMBERCARSOWNED','ADDRESSLINE1','ADDRESSLINE2',
-                'PHONE','DATEFIRSTPURCHASE','COMMUTEDISTANCE']
-
-# Select the new schema.
-df_transformed = df_transformed.select(schema_order)
-df_transformed.show()
-
-# Write the DataFrame to SQL Server.
-df_transformed.write.jdbc(url=sql_server_url,
-              table='dbo.DimCustomer',
-              mode="append", 
-              properties={
-                  "user": sql_server_user,
-                  "password": sql_server_password,
-                  "driver": driver_path
-              })
-
-# once the data has been loaded, move the file to the backup directory.
-shutil.move(r'customer_update.csv', r'old_versions/customer_update.csv')
-
-# Rename the newly moved file with today's dat/time
-today_time = datetime.datetime.now().strftime("%Y-%m-%d_%I-%M-%S")
-os.rename(r'old_versions/customer_update.csv', r'old_versions/customer_update_%s.csv'%(today_time))
+        spark = SparkSession.builder.config('spark.driver.extraClassPath', config.driver_path) \
+                            .appName('SparkSqlServerExample') \
+                            .getOrCreate()
 
+    write_options = JdbcWriteOptions(num_partitions=args.write_partitions,
+                                     batch_size=args.batch_size,
+                                     isolation_level=args.isolation_level,
+                                     use_bulk_copy=args.bulk_copy,
+                                     stand_in_dir=args.stand_in_dir)
 
+    schema = customer_update_schema(
+        target_schema_loader(spark) if args.schema == 'target' else None,
+        refresh=args.refresh_schema)
 
+    if args.replay:
+        run_replay(spark, pending, sample_rows=args.sample,
+                   write_options=write_options,
+                   load_mode=args.load_mode,
+                   watermark_file=watermark_file,
+                   metrics_file=args.metrics_file)
+    elif args.stream:
+        run_stream(spark, schema, args.landing_dir, args.checkpoint_dir,
+                   archive_dir=args.archive_dir,
+                   files_per_batch=args.files_per_batch,
+                   watch=args.watch,
+                   trigger_interval=args.trigger_interval,
+                   sample_rows=args.sample,
+                   write_options=write_options,
+                   load_mode=args.load_mode,
+                   watermark_file=watermark_file,
+                   metrics_file=args.metrics_file,
+                   archive_format=args.archive_format,
+                   dedup=dedup)
+    else:
+        run_batch(spark, schema, args.input, sample_rows=args.sample,
+                  write_options=write_options,
+                  load_mode=args.load_mode,
+                  watermark_file=watermark_file,
+                  metrics_file=args.metrics_file,
+                  archive_dir=args.archive_dir,
+                  archive_format=args.archive_format,
+                  dedup=dedup)
+    return 0
 
 
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+# Long-running DimCustomer pipeline service with warm Spark sessions.
+#
+# Every spark-submit of pipeline_dimcustomer.py starts a JVM, registers an
+# application with the cluster master, waits for executors and loads the
+# JDBC driver before the first row is read. For short, frequent loads that
+# startup is most of the run. The service pays it once and then runs
+# submitted jobs on a pool of warm sessions:
+#
+#   spark-submit pipeline_service.py serve --sessions 2           # start it
+#   python pipeline_service.py submit -- --input customer_update.csv --load-mode upsert
+#   python pipeline_service.py status
+#   python pipeline_service.py stop
+#
+# A job is the command line of pipeline_dimcustomer.py; it runs through the
+# same main(), on a session lent from the pool. The sessions share one
+# SparkContext (spark.newSession()) but not their SQL settings or temporary
+# views, and each job runs in its own FAIR scheduler pool, so a large load
+# does not hold back a small one. Jobs beyond the pool size wait for a free
+# session. Small exports still go to the in-process Arrow engine and do not
+# use a session at all.
+#
+# Jobs are submitted over a local TCP socket, one JSON line each way:
+#
+#   -> {"command": "run", "argv": ["--input", "customer_update.csv"]}
+#   <- {"exit_code": 0, "error": null, "seconds": 1.42}
+#
+# The client is plain Python, so submitting a job does not start a JVM.
+#
+# --stand-in runs the service on a local-mode Spark session and writes the
+# rows to Parquet files under output/stand_in/ instead of SQL Server, so the
+# service and its jobs can be tested without the cluster or the warehouse.
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 47400
+DEFAULT_SESSIONS = 2
+DEFAULT_STAND_IN_DIR = os.path.join('output', 'stand_in')
+
+# Options a submitted job cannot use: --watch never returns and --preflight
+# exit codes only make sense before a session is started.
+REJECTED_OPTIONS = ['--watch', '--preflight']
+
+
+class SessionPool:
+    """Warm Spark sessions, each lent to one job at a time."""
+
+    def __init__(self, spark, size=DEFAULT_SESSIONS):
+        self.size = size
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(spark.newSession())
+
+    @contextmanager
+    def session(self, pool_name):
+        """Borrow a session (waiting for a free one); its jobs run in FAIR pool `pool_name`."""
+        spark = self.idle.get()
+        spark.sparkContext.setLocalProperty('spark.scheduler.pool', pool_name)
+        try:
+            yield spark
+        finally:
+            spark.sparkContext.setLocalProperty('spark.scheduler.pool', None)
+            self.idle.put(spark)
+
+    def busy(self):
+        return self.size - self.idle.qsize()
+
+
+class PipelineService(socketserver.ThreadingTCPServer):
+    """Runs submitted pipeline jobs on a SessionPool (see the module comment)."""
+
+    allow_reuse_address = True
+
+    def __init__(self, address, pool, stand_in_dir=None):
+        super().__init__(address, JobHandler)
+        self.pool = pool
+        self.stand_in_dir = stand_in_dir
+        self.lock = threading.Lock()
+        self.jobs_run = 0
+        self.jobs_failed = 0
+        self.started = time.time()
+
+    def run_job(self, argv):
+        """Run pipeline_dimcustomer.main(argv) on a pooled session; returns the response."""
+        from pipeline_dimcustomer import main
+
+        rejected = [option for option in REJECTED_OPTIONS if option in argv]
+        if rejected:
+            return {'exit_code': 2, 'error': "not supported by the service: %s" % ', '.join(rejected),
+                    'seconds': 0.0}
+        if self.stand_in_dir:
+            argv = list(argv) + ['--stand-in-dir', self.stand_in_dir]
+
+        with self.lock:
+            self.jobs_run += 1
+            job_id = self.jobs_run
+        start = time.perf_counter()
+        error = None
+        with self.pool.session('job-%d' % job_id) as spark:
+            try:
+                exit_code = main(argv, spark=spark)
+            except SystemExit as e:
+                # Raised by argparse for a bad command line (or --help); its
+                # message went to the service's stderr.
+                exit_code = e.code if isinstance(e.code, int) else 2
+                if exit_code:
+                    error = "invalid pipeline options, see the service log"
+            except Exception as e:
+                traceback.print_exc()
+                exit_code, error = 1, '%s: %s' % (type(e).__name__, e)
+        if exit_code:
+            with self.lock:
+                self.jobs_failed += 1
+        seconds = round(time.perf_counter() - start, 3)
+        print("Job %d %s: exit code %s in %.1fs." % (job_id, ' '.join(argv), exit_code, seconds))
+        return {'exit_code': exit_code, 'error': error, 'seconds': seconds}
+
+    def status(self):
+        with self.lock:
+            return {'sessions': self.pool.size, 'busy': self.pool.busy(), 'jobs_run': self.jobs_run,
+                    'jobs_failed': self.jobs_failed, 'uptime_seconds': round(time.time() - self.started),
+                    'stand_in_dir': self.stand_in_dir}
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """One request line in, one response line out."""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            command = request.get('command', 'run')
+            if command == 'run':
+                response = self.server.run_job([str(arg) for arg in request.get('argv', [])])
+            elif command == 'status':
+                response = self.server.status()
+            elif command == 'stop':
+                # shutdown() waits for serve_forever(), which waits for this handler.
+                threading.Thread(target=self.server.shutdown).start()
+                response = {'stopping': True}
+            else:
+                response = {'error': "unknown command: %s" % command}
+        except ValueError as e:
+            response = {'error': "bad request: %s" % e}
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+def build_session(stand_in=False):
+    """The service's Spark session: on the cluster, or local-mode for --stand-in."""
+    from pyspark.sql import SparkSession
+    from pipeline_dimcustomer import config
+
+    builder = SparkSession.builder.appName('DimCustomerPipelineService') \
+                          .config('spark.scheduler.mode', 'FAIR')
+    if stand_in:
+        builder = builder.master('local[*]')
+    else:
+        builder = builder.config('spark.driver.extraClassPath', config.driver_path)
+    return builder.getOrCreate()
+
+
+def serve(args):
+    stand_in_dir = os.path.abspath(args.stand_in_dir) if args.stand_in else None
+    spark = build_session(args.stand_in)
+    service = PipelineService((args.host, args.port), SessionPool(spark, args.sessions), stand_in_dir)
+    print("Pipeline service listening on %s:%d with %d warm session(s)%s."
+          % (args.host, args.port, args.sessions, ' (stand-in: %s)' % stand_in_dir if stand_in_dir else ''))
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+        spark.stop()
+    return 0
+
+
+def request(host, port, message, timeout=None):
+    """Send one request to the service and return its response."""
+    with socket.create_connection((host, port), timeout=timeout) as connection:
+        connection.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        return json.loads(connection.makefile('rb').readline())
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Warm-session service for the DimCustomer pipeline.")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="Address of the service (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="Port of the service (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help="Start the service (in the foreground)")
+    serve_parser.add_argument('--sessions', type=int, default=DEFAULT_SESSIONS,
+                              help="Warm sessions, i.e. jobs running at the same time (default: %(default)s)")
+    serve_parser.add_argument('--stand-in', action='store_true',
+                              help="Run on local-mode Spark and write to Parquet files instead of SQL Server")
+    serve_parser.add_argument('--stand-in-dir', default=DEFAULT_STAND_IN_DIR,
+                              help="Folder of the stand-in tables (default: %(default)s)")
+
+    submit_parser = commands.add_parser('submit', help="Run a pipeline job and wait for it")
+    submit_parser.add_argument('argv', nargs=argparse.REMAINDER,
+                               help="pipeline_dimcustomer.py options, after --")
+    commands.add_parser('status', help="Print the state of the service")
+    commands.add_parser('stop', help="Stop the service once the running jobs are done")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'serve':
+        return serve(args)
+
+    if args.command == 'submit':
+        job_argv = args.argv[1:] if args.argv[:1] == ['--'] else args.argv
+        message = {'command': 'run', 'argv': job_argv}
+    else:
+        message = {'command': args.command}
+    try:
+        response = request(args.host, args.port, message)
+    except ConnectionRefusedError:
+        print("No pipeline service on %s:%d." % (args.host, args.port))
+        return 1
+    print(json.dumps(response))
+    return response.get('exit_code', 1 if response.get('error') else 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,296 @@
+# Config-driven loader for AdventureWorks feeds.
+#
+# Most dimension and fact feeds have the shape of the DimCustomer export:
+# read a csv with a known schema, rename, split and map a few columns,
+# reorder them for the target table, append (or merge) into SQL Server.
+# Instead of one script and one spark-submit per table, each feed is
+# described by a JSON spec in tables/ and one process loads the whole
+# nightly batch:
+#
+#   spark-submit table_loader.py                      # every spec in tables/
+#   spark-submit table_loader.py --table dimcustomer  # only some of them
+#
+# The tables are loaded concurrently by a bounded pool of threads sharing one
+# Spark session. The session uses the FAIR scheduler with one pool per
+# table, so a large feed does not hold back the small ones. Every table is
+# read, transformed, written and archived like pipeline_dimcustomer.py's
+# batch mode, with one metrics line per stage (pipeline = table name).
+#
+# A spec looks like this (see tables/dimcustomer.json for a full one):
+#
+#   {
+#     "name": "dimcustomer",
+#     "source": "customer_update.csv",
+#     "target_table": "dbo.DimCustomer",
+#     "load_mode": "append",                       (or "upsert" with "merge_keys")
+#     "schema": {"NAME": "string", "CUSTOMERKEY": "int", ...},
+#     "select": [
+#       "CUSTOMERKEY",                                              copy a column
+#       {"name": "ADDRESSLINE1", "from": "ADDRESS"},                rename
+#       {"name": "FIRSTNAME", "split": "NAME", "separator": ".first:", "part": 1},
+#       {"name": "GENDER", "map": "GENDER", "values": {"Male": "M"}},
+#       {"name": "ADDRESSLINE2", "literal": null, "type": "string"}
+#     ]
+#   }
+#
+# "schema" lists the csv columns in file order with Spark SQL types. "select"
+# lists the target columns in table order. A split part is trimmed and
+# "strip_prefix" removes a literal prefix from it; parts beyond the last
+# separator are NULL. Values a "map" does not list are kept as they are.
+
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from dimcustomer_load import JdbcWriteOptions
+from dimcustomer_load import LOAD_MODES
+from dimcustomer_load import append_jdbc
+from dimcustomer_load import upsert_jdbc
+from pipeline_archive import DEFAULT_ARCHIVE_DIR
+from pipeline_archive import archive_file
+from pipeline_config import load_pipeline_config
+from pipeline_metrics import PipelineMetrics
+from pipeline_metrics import SparkJobTracker
+
+DEFAULT_TABLES_DIR = 'tables'
+DEFAULT_MAX_WORKERS = 4
+
+# Keys of a "select" entry that define how the column is computed.
+EXPRESSION_KEYS = ['from', 'split', 'map', 'literal']
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    """One feed: where its export is, how it maps onto the target table."""
+
+    name: str
+    source: str
+    target_table: str
+    schema: tuple
+    select: tuple
+    load_mode: str = 'append'
+    merge_keys: tuple = ()
+    header: bool = True
+
+    def schema_ddl(self):
+        """The csv schema as a Spark DDL string, e.g. 'NAME string, CUSTOMERKEY int'."""
+        return ', '.join('%s %s' % (column, data_type) for column, data_type in self.schema)
+
+
+def _check_select(name, entry):
+    if isinstance(entry, str):
+        return entry
+    if not isinstance(entry, dict) or 'name' not in entry:
+        raise ValueError("%s: a select entry is a column name or an object with a 'name': %r" % (name, entry))
+    kinds = [key for key in EXPRESSION_KEYS if key in entry]
+    if len(kinds) != 1:
+        raise ValueError("%s: column %s needs exactly one of %s" % (name, entry['name'], ', '.join(EXPRESSION_KEYS)))
+    if kinds[0] == 'split' and 'separator' not in entry:
+        raise ValueError("%s: split column %s needs a 'separator'" % (name, entry['name']))
+    if kinds[0] == 'map' and not entry.get('values'):
+        raise ValueError("%s: map column %s needs 'values'" % (name, entry['name']))
+    return entry
+
+
+def table_spec(config):
+    """Build a TableSpec from a parsed JSON spec, validating it."""
+    missing = [key for key in ['name', 'source', 'target_table', 'schema', 'select'] if key not in config]
+    if missing:
+        raise ValueError("%s: missing %s" % (config.get('name', 'table spec'), ', '.join(missing)))
+    name = config['name']
+    load_mode = config.get('load_mode', 'append')
+    if load_mode not in LOAD_MODES:
+        raise ValueError("%s: load_mode must be one of %s" % (name, ', '.join(LOAD_MODES)))
+    merge_keys = tuple(config.get('merge_keys', ()))
+    if load_mode == 'upsert' and not merge_keys:
+        raise ValueError("%s: upsert needs merge_keys" % name)
+    return TableSpec(name=name,
+                     source=config['source'],
+                     target_table=config['target_table'],
+                     schema=tuple(config['schema'].items()),
+                     select=tuple(_check_select(name, entry) for entry in config['select']),
+                     load_mode=load_mode,
+                     merge_keys=merge_keys,
+                     header=config.get('header', True))
+
+
+def load_table_specs(tables_dir=DEFAULT_TABLES_DIR, names=None):
+    """Return the TableSpecs of the *.json files in `tables_dir` (only `names`, if given)."""
+    specs = []
+    for path in sorted(glob.glob(os.path.join(tables_dir, '*.json'))):
+        with open(path) as f:
+            specs.append(table_spec(json.load(f)))
+    if names:
+        unknown = set(names) - {spec.name for spec in specs}
+        if unknown:
+            raise ValueError("No spec in %s for: %s" % (tables_dir, ', '.join(sorted(unknown))))
+        specs = [spec for spec in specs if spec.name in names]
+    return specs
+
+
+def split_part(column, separator, part, strip_prefix=None):
+    """Part `part` (0-based) of `column` split on the literal `separator`, trimmed.
+
+    Same literal string functions as dimcustomer_transform.parse_name();
+    NULL when `column` has fewer than `part` separators.
+    """
+    from pyspark.sql.functions import lit
+    from pyspark.sql.functions import replace
+    from pyspark.sql.functions import substring_index
+    from pyspark.sql.functions import trim
+    from pyspark.sql.functions import when
+
+    value = trim(substring_index(substring_index(column, separator, part + 1), separator, -1))
+    if strip_prefix:
+        value = replace(value, lit(strip_prefix), lit(''))
+    if part == 0:
+        return value
+    # With fewer than `part` separators substring_index returns the whole string.
+    return when(substring_index(column, separator, part) != column, value)
+
+
+def column_expression(entry, columns):
+    """Spark column for one "select" entry; `columns` maps upper-cased names to columns."""
+    from pyspark.sql.functions import lit
+    from pyspark.sql.functions import when
+
+    if isinstance(entry, str):
+        return columns[entry.upper()].alias(entry)
+    name = entry['name']
+    if 'from' in entry:
+        expression = columns[entry['from'].upper()]
+    elif 'split' in entry:
+        expression = split_part(columns[entry['split'].upper()], entry['separator'], entry.get('part', 0),
+                                entry.get('strip_prefix'))
+    elif 'map' in entry:
+        source = columns[entry['map'].upper()]
+        (value, mapped), *others = entry['values'].items()
+        expression = when(source == value, lit(mapped))
+        for value, mapped in others:
+            expression = expression.when(source == value, lit(mapped))
+        expression = expression.otherwise(source)
+    else:
+        expression = lit(entry['literal'])
+    if 'type' in entry:
+        # Needed for NULL literals, so the JDBC writer knows the column type.
+        expression = expression.cast(entry['type'])
+    return expression.alias(name)
+
+
+def transform_table(df, spec):
+    """Return `df` in the layout of the spec's target table, as one projection."""
+    from pyspark.sql.functions import col
+
+    # Looked up upper-cased, like dimcustomer_transform.transform_customer_update().
+    columns = {c.upper(): col(c) for c in df.columns}
+    return df.select([column_expression(entry, columns) for entry in spec.select])
+
+
+def load_table(spark, spec, write_options=JdbcWriteOptions(), metrics_file=None,
+               archive_dir=DEFAULT_ARCHIVE_DIR, config=None):
+    """Read, transform, write and archive the export of one table spec.
+
+    Returns False when there was no export to load.
+    """
+    if not os.path.exists(spec.source):
+        print("%s: no export in %s." % (spec.name, spec.source))
+        return False
+    config = config or load_pipeline_config()
+
+    # Jobs of this thread run in the table's own FAIR pool.
+    spark.sparkContext.setLocalProperty('spark.scheduler.pool', spec.name)
+    metrics = PipelineMetrics('spark', metrics_file, SparkJobTracker(spark), pipeline=spec.name)
+    try:
+        with metrics.stage('read', bytes_read=os.path.getsize(spec.source)):
+            df = spark.read.csv(spec.source, header=spec.header, schema=spec.schema_ddl())
+
+        with metrics.stage('transform'):
+            df_transformed = transform_table(df, spec)
+
+        with metrics.stage('write') as stage:
+            properties = config.jdbc_properties()
+            if spec.load_mode == 'upsert':
+                stage['rows_out'] = upsert_jdbc(df_transformed, config.sql_server_url, properties,
+                                                table=spec.target_table, options=write_options,
+                                                keys=list(spec.merge_keys))
+            else:
+                append_jdbc(df_transformed, config.sql_server_url, properties,
+                            table=spec.target_table, options=write_options)
+
+        with metrics.stage('archive'):
+            archive_file(spec.source, os.path.join(archive_dir, spec.name))
+    finally:
+        metrics.flush()
+    print("%s: loaded %s into %s." % (spec.name, spec.source, spec.target_table))
+    return True
+
+
+def load_tables(spark, specs, max_workers=DEFAULT_MAX_WORKERS, **load_options):
+    """Load every spec concurrently, at most `max_workers` at a time.
+
+    A failing table does not stop the others. Returns {name: exception} of
+    the tables that failed.
+    """
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='table-loader') as pool:
+        futures = {spec.name: pool.submit(load_table, spark, spec, **load_options)
+                   for spec in specs}
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print("%s: load failed: %s" % (name, e))
+                failures[name] = e
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load AdventureWorks feeds described by JSON table specs.")
+    parser.add_argument('--tables-dir', default=DEFAULT_TABLES_DIR,
+                        help="Folder of the *.json table specs (default: %(default)s)")
+    parser.add_argument('--table', dest='tables', action='append', metavar='NAME',
+                        help="Only load this table (repeatable; default: every spec)")
+    parser.add_argument('--max-workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help="Tables loaded at the same time (default: %(default)s)")
+    parser.add_argument('--write-partitions', type=int, default=None,
+                        help="Parallel JDBC insert connections per table (default: total executor cores)")
+    parser.add_argument('--batch-size', type=int, default=JdbcWriteOptions.batch_size,
+                        help="Rows per JDBC insert batch (default: %(default)s)")
+    parser.add_argument('--archive-dir', default=DEFAULT_ARCHIVE_DIR,
+                        help="Processed exports are archived to a sub-folder per table (default: %(default)s)")
+    parser.add_argument('--metrics-file', default=None,
+                        help="Append the per-stage JSON metrics lines to this file (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    specs = [spec for spec in load_table_specs(args.tables_dir, args.tables) if os.path.exists(spec.source)]
+    if not specs:
+        print("No export to process.")
+        return 0
+
+    from pyspark.sql import SparkSession
+
+    config = load_pipeline_config()
+    spark = SparkSession.builder.config('spark.driver.extraClassPath', config.driver_path) \
+                        .config('spark.scheduler.mode', 'FAIR') \
+                        .appName('TableLoader') \
+                        .getOrCreate()
+
+    failures = load_tables(spark, specs, max_workers=args.max_workers,
+                           write_options=JdbcWriteOptions(num_partitions=args.write_partitions,
+                                                          batch_size=args.batch_size),
+                           metrics_file=args.metrics_file,
+                           archive_dir=args.archive_dir,
+                           config=config)
+    print("Loaded %d of %d table(s)." % (len(specs) - len(failures), len(specs)))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
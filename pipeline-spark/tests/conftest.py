@@ -0,0 +1,61 @@
+# Shared fixtures of the pipeline-spark tests.
+#
+# The pipeline modules are flat scripts in source_code/, imported the way
+# spark-submit runs them (source_code on the path). Spark runs in local
+# mode; no cluster or SQL Server is needed.
+
+import os
+import sys
+
+import pytest
+
+SOURCE_CODE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'source_code')
+sys.path.insert(0, SOURCE_CODE)
+
+# One POS export row, in the column order of CUSTOMER_UPDATE_SCHEMA.
+BASE_ROW = ['name:last:Cardoce.first:Fernando', '6to Piso Torre La Sabana', 'Male', '', '11000', '26',
+            'AW00011000', '', '0', '1971-10-06', 'M', '', 'fernando.cardoce@snowflake.com', '90000', '2', '0',
+            'Bachelors', 'Licenciatura', 'Bac + 4', 'Professional', 'Profesional', 'Cadre', '1', '0',
+            '1 (11) 500 555-0162', '2011-01-19', '1-2 Miles']
+
+# Text values that pyarrow treats as nulls by default but Spark keeps.
+NULL_LIKE_LITERALS = {'ADDRESS': 'NA', 'MIDDLENAME': 'NULL', 'TITLE': 'N/A', 'SUFFIX': 'nan',
+                      'EMAILADDRESS': '-NaN', 'SPANISHEDUCATION': 'null', 'FRENCHEDUCATION': '#N/A'}
+
+
+@pytest.fixture(scope='session')
+def spark():
+    from pyspark.sql import SparkSession
+
+    session = SparkSession.builder.master('local[1]').appName('pipeline-spark-tests') \
+                          .config('spark.ui.enabled', 'false').getOrCreate()
+    yield session
+    session.stop()
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """The pipeline_dimcustomer module; it reads its settings files from source_code/ on import."""
+    monkeypatch.chdir(SOURCE_CODE)
+    import pipeline_dimcustomer
+
+    return pipeline_dimcustomer
+
+
+@pytest.fixture
+def literal_export(tmp_path):
+    """An export with null-like text literals, an empty field and a quoted empty field."""
+    from dimcustomer_schema import CUSTOMER_UPDATE_SCHEMA
+
+    names = CUSTOMER_UPDATE_SCHEMA.names
+    literal_row = list(BASE_ROW)
+    for column, value in NULL_LIKE_LITERALS.items():
+        literal_row[names.index(column)] = value
+    literal_row[names.index('CUSTOMERKEY')] = '11001'
+    quoted_empty_row = ['"%s"' % value for value in BASE_ROW]
+    quoted_empty_row[names.index('CUSTOMERKEY')] = '11002'
+
+    path = tmp_path / 'customer_update.csv'
+    path.write_text('\n'.join([','.join(names), ','.join(BASE_ROW), ','.join(literal_row),
+                               ','.join(quoted_empty_row)]) + '\n', encoding='utf-8')
+    return str(path)
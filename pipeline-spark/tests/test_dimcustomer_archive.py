@@ -0,0 +1,54 @@
+import datetime
+import shutil
+
+import dimcustomer_archive
+from conftest import NULL_LIKE_LITERALS
+from dimcustomer_schema import CUSTOMER_UPDATE_SCHEMA
+from dimcustomer_transform import transform_customer_update
+
+
+def sorted_rows(df):
+    return sorted((row.asDict() for row in df.collect()), key=lambda row: row['CUSTOMERKEY'])
+
+
+def test_parquet_archive_replays_the_export(spark, literal_export, tmp_path):
+    kept = str(tmp_path / 'original.csv')
+    shutil.copyfile(literal_export, kept)
+    archive_dir = str(tmp_path / 'old_versions')
+
+    archived = dimcustomer_archive.archive_export(literal_export, archive_dir, 'parquet')
+    assert archived.archived_path.endswith('.parquet')
+
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    replay_paths = dimcustomer_archive.replay_files(dimcustomer_archive.replay_partitions(archive_dir, today, today))
+    assert replay_paths == [archived.archived_path]
+
+    archived_df = spark.read.parquet(*replay_paths)
+    export_df = spark.read.csv(kept, header=True, schema=CUSTOMER_UPDATE_SCHEMA)
+    assert sorted(map(tuple, archived_df.collect())) == sorted(map(tuple, export_df.collect()))
+    literal_row = archived_df.where('CUSTOMERKEY = 11001').collect()[0]
+    for column, value in NULL_LIKE_LITERALS.items():
+        assert literal_row[column] == value
+
+    # A replay loads the same rows as the original run.
+    assert sorted_rows(transform_customer_update(archived_df)) == sorted_rows(transform_customer_update(export_df))
+
+
+def test_replay_reads_csv_archives_too(spark, pipeline, literal_export, tmp_path):
+    export_df = spark.read.csv(literal_export, header=True, schema=CUSTOMER_UPDATE_SCHEMA)
+    # The same export, archived once as Parquet and once as csv.
+    expected = sorted([tuple(row) for row in export_df.collect()] * 2)
+    copy = str(tmp_path / 'customer_update_copy.csv')
+    shutil.copyfile(literal_export, copy)
+    archive_dir = str(tmp_path / 'old_versions')
+
+    parquet = dimcustomer_archive.archive_export(literal_export, archive_dir, 'parquet')
+    csv = dimcustomer_archive.archive_export(copy, archive_dir, 'csv')
+
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    replay_paths = pipeline.pending_inputs(replay=(today, today), archive_dir=archive_dir)
+    assert replay_paths == [parquet.archived_path, csv.archived_path]
+    assert sorted(map(tuple, pipeline.read_archived(spark, replay_paths).collect())) == expected
+
+    yesterday = today - datetime.timedelta(days=1)
+    assert pipeline.pending_inputs(replay=(yesterday, yesterday), archive_dir=archive_dir) == []
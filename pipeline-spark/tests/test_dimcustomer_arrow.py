@@ -0,0 +1,46 @@
+import pyarrow as pa
+
+import dimcustomer_arrow
+from conftest import NULL_LIKE_LITERALS
+from dimcustomer_schema import CUSTOMER_UPDATE_SCHEMA
+
+
+def test_arrow_schema_matches_the_declared_schema():
+    from pyspark.sql.types import DateType
+    from pyspark.sql.types import IntegerType
+    from pyspark.sql.types import StringType
+
+    arrow_types = {StringType(): pa.string(), IntegerType(): pa.int32(), DateType(): pa.date32()}
+    assert dimcustomer_arrow.ARROW_SCHEMA == pa.schema(
+        [(field.name, arrow_types[field.dataType]) for field in CUSTOMER_UPDATE_SCHEMA.fields])
+
+
+def test_engine_does_not_import_pyspark():
+    import subprocess
+    import sys
+
+    from conftest import SOURCE_CODE
+
+    code = 'import sys, dimcustomer_arrow; sys.exit(any(m.startswith("pyspark") for m in sys.modules))'
+    assert subprocess.run([sys.executable, '-c', code], cwd=SOURCE_CODE).returncode == 0
+
+
+def test_read_matches_spark_csv_reader(spark, literal_export):
+    arrow_rows = dimcustomer_arrow.read_customer_update(literal_export).to_pylist()
+    spark_rows = [row.asDict() for row in
+                  spark.read.csv(literal_export, header=True, schema=CUSTOMER_UPDATE_SCHEMA).collect()]
+    assert arrow_rows == spark_rows
+
+
+def test_null_like_literals_are_kept_as_text(literal_export):
+    rows = {row['CUSTOMERKEY']: row for row in dimcustomer_arrow.read_customer_update(literal_export).to_pylist()}
+    for column, value in NULL_LIKE_LITERALS.items():
+        assert rows[11001][column] == value
+    # Empty fields, quoted or not, are nulls.
+    assert rows[11000]['MIDDLENAME'] is None
+    assert rows[11002]['MIDDLENAME'] is None
+
+
+def test_streamed_batches_match_the_table(literal_export):
+    streamed = pa.Table.from_batches(list(dimcustomer_arrow.open_customer_update(literal_export)))
+    assert streamed.equals(dimcustomer_arrow.read_customer_update(literal_export))
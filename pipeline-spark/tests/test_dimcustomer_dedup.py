@@ -0,0 +1,76 @@
+import dimcustomer_arrow
+from dimcustomer_dedup import DedupIndex
+from dimcustomer_schema import CUSTOMER_UPDATE_SCHEMA
+
+
+def test_drop_loaded_rows_uses_the_index(spark, pipeline, literal_export, tmp_path):
+    hashes = dimcustomer_arrow.row_hashes(dimcustomer_arrow.read_customer_update(literal_export))
+    df = spark.read.csv(literal_export, header=True, schema=CUSTOMER_UPDATE_SCHEMA)
+
+    with DedupIndex(str(tmp_path / 'state' / 'dedup.sqlite3')) as dedup:
+        dedup.record_load([('earlier', 'earlier.csv')], hashes[:1])
+
+        remaining, new_hashes = pipeline.drop_loaded_rows(df, dedup)
+        assert sorted(row['CUSTOMERKEY'] for row in remaining.collect()) == [11001, 11002]
+        assert sorted(pipeline.local_values(new_hashes)) == sorted(hashes[1:])
+
+        dedup.record_load([('export', 'customer_update.csv')], pipeline.local_values(new_hashes))
+        remaining, new_hashes = pipeline.drop_loaded_rows(df, dedup)
+        assert remaining.count() == 0
+        assert list(pipeline.local_values(new_hashes)) == []
+
+
+def test_record_load_consumes_the_new_hashes_in_its_transaction(spark, pipeline, literal_export, tmp_path):
+    hashes = dimcustomer_arrow.row_hashes(dimcustomer_arrow.read_customer_update(literal_export))
+    df = spark.read.csv(literal_export, header=True, schema=CUSTOMER_UPDATE_SCHEMA)
+
+    with DedupIndex(str(tmp_path / 'dedup.sqlite3')) as dedup:
+        dedup.record_load([('earlier', 'earlier.csv')], hashes[:1])
+        remaining, new_hashes = pipeline.drop_loaded_rows(df, dedup)
+
+        # Hold the write lock, as record_load() does once its transaction
+        # spills to the file: consuming the lazy hashes must not read the index.
+        dedup.connection.execute('BEGIN EXCLUSIVE')
+        dedup.record_load([('export', 'customer_update.csv')], pipeline.local_values(new_hashes))
+
+        assert dedup.loaded_rows(hashes) == set(hashes)
+        assert sorted(row['CUSTOMERKEY'] for row in remaining.collect()) == [11001, 11002]
+
+
+def test_lookup_fails_on_a_missing_index(spark, pipeline, literal_export, tmp_path):
+    import pytest
+
+    df = spark.read.csv(literal_export, header=True, schema=CUSTOMER_UPDATE_SCHEMA)
+    dedup = DedupIndex(str(tmp_path / 'dedup.sqlite3'))
+    dedup.close()
+    dedup.path = str(tmp_path / 'missing' / 'dedup.sqlite3')
+    # The lookup runs when the rows are dropped, before anything is written.
+    with pytest.raises(Exception, match='unable to open database'):
+        pipeline.drop_loaded_rows(df, dedup)
+
+
+def test_preflight_does_not_archive_or_record(pipeline, literal_export, tmp_path):
+    from pipeline_archive import file_sha256
+
+    dedup_file = str(tmp_path / 'state' / 'dedup.sqlite3')
+    archive_dir = str(tmp_path / 'old_versions')
+    argv = ['--preflight', '--dedup', '--dedup-file', dedup_file, '--input', literal_export,
+            '--archive-dir', archive_dir]
+
+    # New export, no index yet: the index is not created.
+    assert pipeline.main(argv) == pipeline.ARROW_ENGINE_EXIT_CODE
+    assert not (tmp_path / 'state').exists()
+
+    # Re-sent export: it stays in place for the run to archive.
+    with DedupIndex(dedup_file) as dedup:
+        dedup.record_load([(file_sha256(literal_export), 'customer_update.csv')], [])
+    before = (tmp_path / 'state' / 'dedup.sqlite3').read_bytes()
+    assert pipeline.main(argv) == pipeline.ARROW_ENGINE_EXIT_CODE
+    assert (tmp_path / 'customer_update.csv').exists()
+    assert not (tmp_path / 'old_versions').exists()
+    assert (tmp_path / 'state' / 'dedup.sqlite3').read_bytes() == before
+
+    # The run archives it without loading.
+    assert pipeline.main(argv[1:]) == 0
+    assert not (tmp_path / 'customer_update.csv').exists()
+    assert (tmp_path / 'old_versions').exists()
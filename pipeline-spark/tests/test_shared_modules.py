@@ -0,0 +1,39 @@
+# The ports keep their own copies of the modules they share: each port's
+# source_code/ is what gets mounted in the Spark containers, shipped with
+# --py-files and the snowflake.yml notebook artifacts, or run standalone
+# (the Snowpark golden copy). The copies must stay identical; edit one and
+# copy it to the others.
+
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SPARK = 'pipeline-spark/source_code'
+CONNECT = 'pipeline-connect/source_code'
+SNOWPARK = 'myprojects/_golden_copy/pipeline-snowpark/source_code'
+
+SHARED_MODULES = {
+    'pipeline_config.py': [SPARK, CONNECT, SNOWPARK],
+    'pipeline_metrics.py': [SPARK, CONNECT, SNOWPARK],
+    'pipeline_archive.py': [SPARK, CONNECT, SNOWPARK],
+    'dimcustomer_watermark.py': [SPARK, CONNECT, SNOWPARK],
+    # PySpark modules, used by the Spark and Snowpark Connect ports.
+    'dimcustomer_merge.py': [SPARK, CONNECT],
+    'dimcustomer_schema.py': [SPARK, CONNECT],
+    'dimcustomer_transform.py': [SPARK, CONNECT],
+    'stage_upload.py': [CONNECT, SNOWPARK],
+}
+
+
+def read(port, module):
+    with open(os.path.join(ROOT, port, module), 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('module', sorted(SHARED_MODULES))
+def test_port_copies_are_identical(module):
+    first, *others = SHARED_MODULES[module]
+    for port in others:
+        assert read(port, module) == read(first, module), "%s/%s differs from %s/%s" % (
+            port, module, first, module)
@@ -0,0 +1,51 @@
+-- Materialized salesperson metrics behind the Sales Performance Dashboard.
+--
+-- Snowflake keeps DBO.SALESPERSON_METRICS up to date itself: the dynamic
+-- table re-runs the four-table join and the RANK() over each territory only
+-- when a source table changed, at most TARGET_LAG behind it, and
+-- incrementally where it can. The dashboard (ui/streamlit_salesperson_dashboard.py)
+-- reads it with a single-table scan and uses its LAST_ALTERED as cache version.
+--
+-- Run after the data migration. It takes the place of the SQL Server table
+-- of the same name, which is maintained by ui/streamlit_sqlserver/salesperson_metrics.sql;
+-- drop the migrated copies first:
+-- DROP TABLE IF EXISTS ADVENTUREWORKS2017.DBO.SALESPERSON_METRICS;
+-- DROP TABLE IF EXISTS ADVENTUREWORKS2017.DBO.SALESPERSON_METRICS_STATE;
+
+CREATE OR REPLACE DYNAMIC TABLE ADVENTUREWORKS2017.DBO.SALESPERSON_METRICS
+    TARGET_LAG = '1 minute'
+    WAREHOUSE = COMPUTE_WH
+    REFRESH_MODE = AUTO
+    INITIALIZE = ON_CREATE
+AS
+WITH salesperson AS (
+    SELECT
+        sp.BusinessEntityID,
+        CONCAT(per.FirstName, ' ', per.LastName) AS salesperson_name,
+        st.Name AS territory_name,
+        st."Group" AS region_group,
+        sp.SalesYTD AS sales_ytd,
+        sp.SalesLastYear AS sales_last_year,
+        COALESCE(sp.SalesYTD, 0) - COALESCE(sp.SalesLastYear, 0) AS yoy_change,
+        CASE
+            WHEN sp.SalesQuota > 0
+            THEN ROUND((sp.SalesYTD / sp.SalesQuota) * 100, 2)
+            ELSE NULL
+        END AS quota_achievement_pct
+    FROM ADVENTUREWORKS2017.Sales.SalesPerson sp
+    INNER JOIN ADVENTUREWORKS2017.HumanResources.Employee e
+        ON sp.BusinessEntityID = e.BusinessEntityID
+    INNER JOIN ADVENTUREWORKS2017.Person.Person per
+        ON e.BusinessEntityID = per.BusinessEntityID
+    LEFT JOIN ADVENTUREWORKS2017.Sales.SalesTerritory st
+        ON sp.TerritoryID = st.TerritoryID
+    WHERE sp.SalesYTD > 0
+)
+SELECT
+    *,
+    RANK() OVER (PARTITION BY territory_name ORDER BY sales_ytd DESC) AS rank_in_territory
+FROM salesperson;
+
+-- quick verify
+-- SELECT * FROM ADVENTUREWORKS2017.DBO.SALESPERSON_METRICS ORDER BY territory_name, rank_in_territory;
+-- SHOW DYNAMIC TABLES LIKE 'SALESPERSON_METRICS' IN SCHEMA ADVENTUREWORKS2017.DBO;
@@ -1,8 +1,16 @@
 # Sales Performance Dashboard - Streamlit in Snowflake
 # AdventureWorks: Salesperson Performance by Territory
 
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Page Configuration
@@ -19,52 +27,212 @@ st.set_page_config(
 session = st.connection('snowflake').session()
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Data Query
+# Data Queries
+# The sidebar filters are pushed down into SQL with bind variables, so each
+# view fetches only the filter choices, one row of KPIs, one row per
+# territory and a bounded list of salespeople.
 # ─────────────────────────────────────────────────────────────────────────────
-@st.cache_data(ttl=600)
-def load_salesperson_data():
-    """Load salesperson performance data from AdventureWorks"""
-    query = """
-    WITH salesperson_metrics AS (
-        SELECT 
-            sp.BusinessEntityID,
-            CONCAT(per.FirstName, ' ', per.LastName) AS salesperson_name,
-            st.Name AS territory_name,
-            st."Group" AS region_group,
-            sp.SalesQuota,
-            sp.SalesYTD,
-            sp.SalesLastYear,
-            COALESCE(sp.SalesYTD, 0) - COALESCE(sp.SalesLastYear, 0) AS yoy_change,
-            CASE 
-                WHEN sp.SalesQuota > 0 
-                THEN ROUND((sp.SalesYTD / sp.SalesQuota) * 100, 2)
-                ELSE NULL 
-            END AS quota_achievement_pct
-        FROM Sales.SalesPerson sp
-        INNER JOIN HumanResources.Employee e 
-            ON sp.BusinessEntityID = e.BusinessEntityID
-        INNER JOIN Person.Person per 
-            ON e.BusinessEntityID = per.BusinessEntityID
-        LEFT JOIN Sales.SalesTerritory st 
-            ON sp.TerritoryID = st.TerritoryID
-    )
-    SELECT 
-        territory_name,
-        region_group,
-        salesperson_name,
-        SalesYTD AS sales_ytd,
-        SalesLastYear AS sales_last_year,
-        yoy_change,
-        quota_achievement_pct,
-        RANK() OVER (PARTITION BY territory_name ORDER BY SalesYTD DESC) AS rank_in_territory
-    FROM salesperson_metrics
-    WHERE SalesYTD > 0
-    ORDER BY region_group, territory_name, SalesYTD DESC
+# Every view reads the dynamic table DBO.SALESPERSON_METRICS
+# (snowflake-db-additions/salesperson-metrics.sql): salespeople with sales
+# this year, with the joins and the rank within their territory
+# materialized, so every view is a single-table scan. The rank is computed
+# before any filter, so "#1 in territory" does not change with the sales
+# threshold.
+
+# Columns the detail table can be sorted by (ORDER BY cannot be a bind variable).
+SORT_COLUMNS = ['SALES_YTD', 'YOY_CHANGE', 'QUOTA_ACHIEVEMENT_PCT', 'SALESPERSON_NAME']
+
+# Salespeople shown in the charts and in the detail table.
+CHART_ROW_LIMIT = 50
+TABLE_ROW_LIMIT = 1000
+
+# Table behind the dashboard; its LAST_ALTERED changes with every refresh
+# of the dynamic table that changed its rows.
+SOURCE_TABLES = [('DBO', 'SALESPERSON_METRICS')]
+
+def arrow_frame(table):
+    """DataFrame of an Arrow table with Arrow-backed columns; NUMBER becomes int64 or float64"""
+    columns = []
+    for column in table.columns:
+        if pa.types.is_decimal(column.type):
+            column = pc.cast(column, pa.int64() if column.type.scale == 0 else pa.float64(), safe=False)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, names=table.column_names).to_pandas(types_mapper=pd.ArrowDtype)
+
+def run_query(query, params=()):
+    """Run a query with bind variables; the result arrives as Arrow batches and stays Arrow-backed"""
+    return arrow_frame(session.sql(query, params=list(params)).to_arrow())
+
+def source_versions():
+    """{table: last altered} of SOURCE_TABLES (metadata only, no warehouse scan)"""
+    condition = ' OR '.join(['(TABLE_SCHEMA = ? AND TABLE_NAME = ?)'] * len(SOURCE_TABLES))
+    versions = run_query(f"SELECT TABLE_SCHEMA || '.' || TABLE_NAME, LAST_ALTERED "
+                         f"FROM INFORMATION_SCHEMA.TABLES WHERE {condition}",
+                         [name for table in SOURCE_TABLES for name in table])
+    return {row[0]: row[1] for row in versions.itertuples(index=False)}
+
+class ResultCache:
+    """Query results kept until the source tables change.
+
+    The version of the sources is checked at most every `poll_seconds`. A
+    result whose sources changed (or older than `max_age`) is still returned
+    while a background thread re-runs its query; the next rerun gets the
+    fresh one. Only the first request of a view waits for Snowflake.
+
+    A failed refresh is logged. After `max_failures` in a row the entry is
+    dropped, and one older than `max_stale` is not served, so the next
+    request runs the query itself instead of showing old numbers forever.
     """
-    return session.sql(query).to_pandas()
 
-# Load data
-df = load_salesperson_data()
+    def __init__(self, run, versions, poll_seconds=60, max_age=3600, max_stale=4 * 3600, max_entries=256,
+                 max_failures=3):
+        self._run = run
+        self._versions = versions
+        self.poll_seconds = poll_seconds
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (query, params) -> (version, fetched_at, result)
+        self._refreshing = set()
+        self._failures = {}             # (query, params) -> failed refreshes in a row
+        self._current = None
+        self._checked_at = 0.0
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+
+    def versions(self):
+        with self._lock:
+            if self._current is not None and time.monotonic() - self._checked_at < self.poll_seconds:
+                return self._current
+        current = tuple(sorted(self._versions().items()))
+        with self._lock:
+            self._current, self._checked_at = current, time.monotonic()
+        return current
+
+    def _store(self, key, version, result):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), result)
+            self._entries.move_to_end(key)
+            self._failures.pop(key, None)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._failures.pop(evicted, None)
+
+    def _refresh(self, key, version):
+        try:
+            result = self._run(*key)
+        except Exception:
+            with self._lock:
+                failures = self._failures.get(key, 0) + 1
+                self._failures[key] = failures
+                evicted = failures >= self.max_failures
+                if evicted:
+                    self._entries.pop(key, None)
+                    self._failures.pop(key, None)
+            logging.getLogger(__name__).warning(
+                "Background refresh of a cached result (params %r) failed %d time(s) in a row; %s",
+                key[1], failures, 'dropped the entry' if evicted else 'serving the stale result', exc_info=True)
+        else:
+            self._store(key, version, result)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, query, params=()):
+        key = (query, tuple(params))
+        version = self.versions()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                cached_version, fetched_at, result = entry
+                age = time.monotonic() - fetched_at
+                # Too old to serve: its refreshes keep failing, run the query here.
+                if age <= self.max_stale:
+                    stale = cached_version != version or age > self.max_age
+                    if stale and key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._pool.submit(self._refresh, key, version)
+                    return result
+        result = self._run(*key)
+        self._store(key, version, result)
+        return result
+
+@st.cache_resource
+def get_result_cache():
+    """Results shared by every session, refreshed when the source tables change"""
+    return ResultCache(run_query, source_versions)
+
+def cached_query(query, params=()):
+    """Run a query through the change-aware cache"""
+    return get_result_cache().get(query, params)
+
+def where_sql(regions, territories, min_sales, top_only):
+    """WHERE clause and bind variables of the sidebar selection"""
+    conditions, params = [], []
+    for column, values in [('region_group', regions), ('territory_name', territories)]:
+        if values:
+            conditions.append(f"{column} IN ({', '.join(['?'] * len(values))})")
+            params.extend(values)
+        else:
+            conditions.append('1 = 0')  # nothing selected: nothing matches
+    conditions.append('sales_ytd >= ?')
+    params.append(min_sales)
+    if top_only:
+        conditions.append('rank_in_territory = 1')
+    return 'WHERE ' + ' AND '.join(conditions), tuple(params)
+
+def load_filter_options():
+    """One row per region and territory, with its salespeople count and sales range"""
+    return cached_query("""
+    SELECT region_group, territory_name, COUNT(*) AS num_salespeople,
+           MIN(sales_ytd) AS min_sales_ytd, MAX(sales_ytd) AS max_sales_ytd
+    FROM DBO.SALESPERSON_METRICS
+    GROUP BY region_group, territory_name
+    ORDER BY region_group, territory_name
+    """)
+
+def load_summary(filters):
+    """KPIs of the filtered salespeople (one row)"""
+    where, params = where_sql(*filters)
+    return cached_query(f"""
+    SELECT COUNT(*) AS num_salespeople,
+           COALESCE(SUM(sales_ytd), 0) AS total_sales_ytd,
+           AVG(quota_achievement_pct) AS avg_quota_achievement_pct,
+           COALESCE(SUM(yoy_change), 0) AS total_yoy_change
+    FROM DBO.SALESPERSON_METRICS
+    {where}
+    """, params).iloc[0]
+
+def load_territory_totals(filters):
+    """Sales and salespeople count per territory of the filtered salespeople"""
+    where, params = where_sql(*filters)
+    return cached_query(f"""
+    SELECT territory_name, SUM(sales_ytd) AS sales_ytd, COUNT(*) AS num_salespeople
+    FROM DBO.SALESPERSON_METRICS
+    {where}
+    GROUP BY territory_name
+    ORDER BY sales_ytd DESC
+    """, params)
+
+def load_salespeople(filters, sort_by='SALES_YTD', limit=TABLE_ROW_LIMIT):
+    """The first `limit` filtered salespeople, sorted by `sort_by` (one of SORT_COLUMNS)"""
+    if sort_by not in SORT_COLUMNS:
+        raise ValueError(f"Cannot sort by {sort_by}")
+    where, params = where_sql(*filters)
+    direction = 'ASC' if sort_by == 'SALESPERSON_NAME' else 'DESC NULLS LAST'
+    return cached_query(f"""
+    SELECT territory_name, region_group, salesperson_name, sales_ytd, sales_last_year,
+           yoy_change, quota_achievement_pct, rank_in_territory
+    FROM DBO.SALESPERSON_METRICS
+    {where}
+    ORDER BY {sort_by} {direction}
+    LIMIT {int(limit)}
+    """, params)
+
+# Load the filter choices
+options_df = load_filter_options()
 
 # ─────────────────────────────────────────────────────────────────────────────
 # App Header
@@ -80,7 +248,7 @@ with st.sidebar:
     st.header("🔍 Filters")
     
     # Region filter
-    all_regions = df['REGION_GROUP'].dropna().unique().tolist()
+    all_regions = options_df['REGION_GROUP'].dropna().unique().tolist()
     selected_regions = st.multiselect(
         "Select Region(s)",
         options=all_regions,
@@ -89,7 +257,7 @@ with st.sidebar:
     )
     
     # Territory filter (dependent on region selection)
-    available_territories = df[df['REGION_GROUP'].isin(selected_regions)]['TERRITORY_NAME'].dropna().unique().tolist()
+    available_territories = options_df[options_df['REGION_GROUP'].isin(selected_regions)]['TERRITORY_NAME'].dropna().unique().tolist()
     selected_territories = st.multiselect(
         "Select Territory(ies)",
         options=available_territories,
@@ -98,8 +266,8 @@ with st.sidebar:
     )
     
     # Sales threshold slider
-    min_sales = float(df['SALES_YTD'].min())
-    max_sales = float(df['SALES_YTD'].max())
+    min_sales = float(options_df['MIN_SALES_YTD'].min())
+    max_sales = float(options_df['MAX_SALES_YTD'].max())
     sales_threshold = st.slider(
         "Minimum Sales YTD ($)",
         min_value=min_sales,
@@ -120,16 +288,13 @@ with st.sidebar:
     st.caption("💡 Tip: Use filters to drill down into specific regions or territories")
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Apply Filters
+# Apply Filters (in SQL: only the rows and aggregates of this view are fetched)
 # ─────────────────────────────────────────────────────────────────────────────
-filtered_df = df[
-    (df['REGION_GROUP'].isin(selected_regions)) &
-    (df['TERRITORY_NAME'].isin(selected_territories)) &
-    (df['SALES_YTD'] >= sales_threshold)
-]
+filters = (tuple(selected_regions), tuple(selected_territories), sales_threshold, show_top_only)
 
-if show_top_only:
-    filtered_df = filtered_df[filtered_df['RANK_IN_TERRITORY'] == 1]
+total_salespeople = int(options_df['NUM_SALESPEOPLE'].sum())
+summary = load_summary(filters)
+top_salespeople_df = load_salespeople(filters, 'SALES_YTD', CHART_ROW_LIMIT)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # KPI Metrics Row
@@ -139,26 +304,26 @@ col1, col2, col3, col4 = st.columns(4)
 with col1:
     st.metric(
         label="Total Salespeople",
-        value=len(filtered_df),
-        delta=f"{len(filtered_df) - len(df)} filtered" if len(filtered_df) != len(df) else None
+        value=int(summary['NUM_SALESPEOPLE']),
+        delta=f"{int(summary['NUM_SALESPEOPLE']) - total_salespeople} filtered" if summary['NUM_SALESPEOPLE'] != total_salespeople else None
     )
 
 with col2:
-    total_ytd = filtered_df['SALES_YTD'].sum()
+    total_ytd = summary['TOTAL_SALES_YTD']
     st.metric(
         label="Total Sales YTD",
         value=f"${total_ytd:,.0f}"
     )
 
 with col3:
-    avg_quota = filtered_df['QUOTA_ACHIEVEMENT_PCT'].mean()
+    avg_quota = summary['AVG_QUOTA_ACHIEVEMENT_PCT']
     st.metric(
         label="Avg Quota Achievement",
         value=f"{avg_quota:.1f}%" if pd.notna(avg_quota) else "N/A"
     )
 
 with col4:
-    total_yoy = filtered_df['YOY_CHANGE'].sum()
+    total_yoy = summary['TOTAL_YOY_CHANGE']
     st.metric(
         label="Total YoY Change",
         value=f"${total_yoy:,.0f}",
@@ -175,8 +340,8 @@ tab1, tab2, tab3 = st.tabs(["📊 By Salesperson", "🗺️ By Territory", "📈
 with tab1:
     st.subheader("Sales YTD by Salesperson")
     
-    # Prepare chart data - sorted by sales
-    chart_data = filtered_df[['SALESPERSON_NAME', 'SALES_YTD', 'TERRITORY_NAME']].copy()
+    # Prepare chart data - the top salespeople by sales
+    chart_data = top_salespeople_df[['SALESPERSON_NAME', 'SALES_YTD', 'TERRITORY_NAME']].copy()
     chart_data = chart_data.sort_values('SALES_YTD', ascending=True)
     
     # Horizontal bar chart
@@ -185,16 +350,14 @@ with tab1:
         horizontal=True,
         height=max(400, len(chart_data) * 35)
     )
+    if summary['NUM_SALESPEOPLE'] > len(chart_data):
+        st.caption(f"📌 Showing top {len(chart_data)} of {int(summary['NUM_SALESPEOPLE'])} salespeople by sales YTD")
 
 with tab2:
     st.subheader("Total Sales by Territory")
     
-    # Aggregate by territory
-    territory_data = filtered_df.groupby('TERRITORY_NAME').agg({
-        'SALES_YTD': 'sum',
-        'SALESPERSON_NAME': 'count'
-    }).rename(columns={'SALESPERSON_NAME': 'NUM_SALESPEOPLE'}).reset_index()
-    territory_data = territory_data.sort_values('SALES_YTD', ascending=False)
+    # Aggregated by territory in Snowflake
+    territory_data = load_territory_totals(filters)
     
     col_chart, col_table = st.columns([2, 1])
     
@@ -220,8 +383,7 @@ with tab3:
     st.subheader("Year-over-Year Performance")
     
     # Prepare comparison data
-    comparison_data = filtered_df[['SALESPERSON_NAME', 'SALES_YTD', 'SALES_LAST_YEAR']].copy()
-    comparison_data = comparison_data.sort_values('SALES_YTD', ascending=False).head(10)
+    comparison_data = top_salespeople_df[['SALESPERSON_NAME', 'SALES_YTD', 'SALES_LAST_YEAR']].head(10)
     comparison_data = comparison_data.set_index('SALESPERSON_NAME')
     comparison_data.columns = ['This Year', 'Last Year']
     
@@ -240,7 +402,7 @@ col_display1, col_display2 = st.columns([1, 3])
 with col_display1:
     sort_by = st.selectbox(
         "Sort by",
-        options=['SALES_YTD', 'YOY_CHANGE', 'QUOTA_ACHIEVEMENT_PCT', 'SALESPERSON_NAME'],
+        options=SORT_COLUMNS,
         format_func=lambda x: {
             'SALES_YTD': 'Sales YTD',
             'YOY_CHANGE': 'YoY Change',
@@ -249,8 +411,10 @@ with col_display1:
         }.get(x, x)
     )
 
-# Sort and display
-display_df = filtered_df.sort_values(sort_by, ascending=(sort_by == 'SALESPERSON_NAME'))
+# Sorted and limited in Snowflake
+display_df = load_salespeople(filters, sort_by, TABLE_ROW_LIMIT)
+if summary['NUM_SALESPEOPLE'] > len(display_df):
+    st.caption(f"Showing the first {len(display_df)} of {int(summary['NUM_SALESPEOPLE'])} salespeople")
 
 st.dataframe(
     display_df,
@@ -4,6 +4,7 @@
 #     "streamlit>=1.51.0",
 #     "pyodbc>=5.0.0",
 #     "pandas>=2.0.0",
+#     "pyarrow>=14.0.0",
 # ]
 # ///
 
@@ -15,6 +16,20 @@ import streamlit as st
 import pandas as pd
 import pyodbc
 
+from arrow_fetch import read_sql_arrow
+from connection_pool import DEFAULT_POOL_SIZE
+from connection_pool import DEFAULT_QUERY_TIMEOUT
+from connection_pool import ConnectionPool
+from connection_pool import database_error
+from result_cache import ResultCache
+from queries import SORT_COLUMNS
+from queries import TERRITORY_VERSIONS
+from queries import SalespersonFilters
+from queries import filter_options_sql
+from queries import salespeople_sql
+from queries import summary_sql
+from queries import territory_totals_sql
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Page Configuration
 # ─────────────────────────────────────────────────────────────────────────────
@@ -31,9 +46,12 @@ SQL_SERVER = os.getenv("SQL_SERVER", "127.0.0.1,1433")
 SQL_DATABASE = os.getenv("SQL_DATABASE", "AdventureWorks2017")
 SQL_USER = "sa"
 SQL_PASSWORD = os.getenv("ADMIN_PASS", "")
+# Connections shared by all dashboard sessions, and the per-query timeout (seconds)
+SQL_POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", DEFAULT_POOL_SIZE))
+SQL_QUERY_TIMEOUT = int(os.getenv("SQL_QUERY_TIMEOUT", DEFAULT_QUERY_TIMEOUT))
+SQL_LOGIN_TIMEOUT = 10
 
-@st.cache_resource
-def get_connection():
+def connect():
     """Create a connection to SQL Server running in Docker"""
     conn_str = (
         "DRIVER={ODBC Driver 18 for SQL Server};"
@@ -43,57 +61,53 @@ def get_connection():
         f"PWD={SQL_PASSWORD};"
         "TrustServerCertificate=yes;"
     )
-    return pyodbc.connect(conn_str)
+    return pyodbc.connect(conn_str, timeout=SQL_LOGIN_TIMEOUT)
+
+@st.cache_resource
+def get_connection_pool():
+    """Connection pool shared by every session and rerun (see connection_pool.py)"""
+    return ConnectionPool(connect, size=SQL_POOL_SIZE, query_timeout=SQL_QUERY_TIMEOUT)
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Data Query
+# Data Queries (filters and aggregates run in SQL Server, see queries.py)
 # ─────────────────────────────────────────────────────────────────────────────
-@st.cache_data(ttl=600)
-def load_salesperson_data():
-    """Load salesperson performance data from AdventureWorks"""
-    query = """
-    WITH salesperson_metrics AS (
-        SELECT 
-            sp.BusinessEntityID,
-            CONCAT(per.FirstName, ' ', per.LastName) AS salesperson_name,
-            st.Name AS territory_name,
-            st.[Group] AS region_group,
-            sp.SalesQuota,
-            sp.SalesYTD,
-            sp.SalesLastYear,
-            COALESCE(sp.SalesYTD, 0) - COALESCE(sp.SalesLastYear, 0) AS yoy_change,
-            CASE 
-                WHEN sp.SalesQuota > 0 
-                THEN ROUND((sp.SalesYTD / sp.SalesQuota) * 100, 2)
-                ELSE NULL 
-            END AS quota_achievement_pct
-        FROM Sales.SalesPerson sp
-        INNER JOIN HumanResources.Employee e 
-            ON sp.BusinessEntityID = e.BusinessEntityID
-        INNER JOIN Person.Person per 
-            ON e.BusinessEntityID = per.BusinessEntityID
-        LEFT JOIN Sales.SalesTerritory st 
-            ON sp.TerritoryID = st.TerritoryID
-    )
-    SELECT 
-        territory_name,
-        region_group,
-        salesperson_name,
-        SalesYTD AS sales_ytd,
-        SalesLastYear AS sales_last_year,
-        yoy_change,
-        quota_achievement_pct,
-        RANK() OVER (PARTITION BY territory_name ORDER BY SalesYTD DESC) AS rank_in_territory
-    FROM salesperson_metrics
-    WHERE SalesYTD > 0
-    ORDER BY region_group, territory_name, SalesYTD DESC
-    """
-    conn = get_connection()
-    return pd.read_sql(query, conn)
-
-# Load data
+# Salespeople shown in the charts and in the detail table.
+CHART_ROW_LIMIT = 50
+TABLE_ROW_LIMIT = 1000
+
+def run_query(query, params=()):
+    """Run a parameterized query on a pooled connection (Arrow-backed result, see arrow_fetch.py)"""
+    pool = get_connection_pool()
+    try:
+        with pool.connection() as conn:
+            return read_sql_arrow(query, conn, params)
+    except Exception as e:
+        error = database_error(e)
+        # HYT00: the query timed out, running it again would not help.
+        if not isinstance(error, (pyodbc.OperationalError, pyodbc.InterfaceError)) or error.args[:1] == ('HYT00',):
+            raise
+        # The connection broke during the query (it was discarded): retry once on another.
+        with pool.connection() as conn:
+            return read_sql_arrow(query, conn, params)
+
+def territory_versions():
+    """{territory: version} of the data behind the dashboard (see queries.py)"""
+    versions = run_query(TERRITORY_VERSIONS)
+    return {row[0]: tuple(row[1:]) for row in versions.itertuples(index=False)}
+
+@st.cache_resource
+def get_result_cache():
+    """Results shared by every session, refreshed when their territories change (see result_cache.py)"""
+    return ResultCache(run_query, territory_versions)
+
+def load(query_and_params, territories=None):
+    """Run a (query, params) pair built by queries.py, from the cache when its data is unchanged"""
+    query, params = query_and_params
+    return get_result_cache().get(query, tuple(params), territories)
+
+# Load the filter choices (one row per region and territory)
 try:
-    df = load_salesperson_data()
+    options_df = load(filter_options_sql())
     data_loaded = True
 except Exception as e:
     st.error(f"❌ Failed to connect to SQL Server: {e}")
@@ -103,13 +117,15 @@ except Exception as e:
 - `ADMIN_PASS` - SQL Server password *(required)*
 - `SQL_SERVER` - Server address (default: 127.0.0.1,1433)
 - `SQL_DATABASE` - Database name (default: AdventureWorks2017)
+- `SQL_POOL_SIZE` - Pooled connections shared by all users (default: 5)
+- `SQL_QUERY_TIMEOUT` - Query timeout in seconds (default: 30)
     """)
     st.code("""
 # Source setenv.sh and run
 source ../setenv.sh && streamlit run app.py
     """, language="bash")
     data_loaded = False
-    df = pd.DataFrame()
+    options_df = pd.DataFrame()
 
 # ─────────────────────────────────────────────────────────────────────────────
 # App Header
@@ -119,7 +135,7 @@ st.markdown("**AdventureWorks** | Salesperson Performance by Territory")
 st.caption("🐳 Connected to SQL Server (Docker)")
 st.divider()
 
-if not data_loaded or df.empty:
+if not data_loaded or options_df.empty:
     st.warning("No data available. Please check your SQL Server connection.")
     st.stop()
 
@@ -130,7 +146,7 @@ with st.sidebar:
     st.header("🔍 Filters")
     
     # Region filter
-    all_regions = df['region_group'].dropna().unique().tolist()
+    all_regions = options_df['region_group'].dropna().unique().tolist()
     selected_regions = st.multiselect(
         "Select Region(s)",
         options=all_regions,
@@ -139,7 +155,7 @@ with st.sidebar:
     )
     
     # Territory filter (dependent on region selection)
-    available_territories = df[df['region_group'].isin(selected_regions)]['territory_name'].dropna().unique().tolist()
+    available_territories = options_df[options_df['region_group'].isin(selected_regions)]['territory_name'].dropna().unique().tolist()
     selected_territories = st.multiselect(
         "Select Territory(ies)",
         options=available_territories,
@@ -148,8 +164,8 @@ with st.sidebar:
     )
     
     # Sales threshold slider
-    min_sales = float(df['sales_ytd'].min())
-    max_sales = float(df['sales_ytd'].max())
+    min_sales = float(options_df['min_sales_ytd'].min())
+    max_sales = float(options_df['max_sales_ytd'].max())
     sales_threshold = st.slider(
         "Minimum Sales YTD ($)",
         min_value=min_sales,
@@ -170,16 +186,18 @@ with st.sidebar:
     st.caption("💡 Tip: Use filters to drill down into specific regions or territories")
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Apply Filters
+# Apply Filters (in SQL: only the rows and aggregates of this view are fetched)
 # ─────────────────────────────────────────────────────────────────────────────
-filtered_df = df[
-    (df['region_group'].isin(selected_regions)) &
-    (df['territory_name'].isin(selected_territories)) &
-    (df['sales_ytd'] >= sales_threshold)
-]
+filters = SalespersonFilters(
+    regions=tuple(selected_regions),
+    territories=tuple(selected_territories),
+    min_sales=sales_threshold,
+    top_only=show_top_only
+)
 
-if show_top_only:
-    filtered_df = filtered_df[filtered_df['rank_in_territory'] == 1]
+total_salespeople = int(options_df['num_salespeople'].sum())
+summary = load(summary_sql(filters), filters.territories).iloc[0]
+top_salespeople_df = load(salespeople_sql(filters, 'sales_ytd', CHART_ROW_LIMIT), filters.territories)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # KPI Metrics Row
@@ -189,26 +207,26 @@ col1, col2, col3, col4 = st.columns(4)
 with col1:
     st.metric(
         label="Total Salespeople",
-        value=len(filtered_df),
-        delta=f"{len(filtered_df) - len(df)} filtered" if len(filtered_df) != len(df) else None
+        value=int(summary['num_salespeople']),
+        delta=f"{int(summary['num_salespeople']) - total_salespeople} filtered" if summary['num_salespeople'] != total_salespeople else None
     )
 
 with col2:
-    total_ytd = filtered_df['sales_ytd'].sum()
+    total_ytd = summary['total_sales_ytd']
     st.metric(
         label="Total Sales YTD",
         value=f"${total_ytd:,.0f}"
     )
 
 with col3:
-    avg_quota = filtered_df['quota_achievement_pct'].mean()
+    avg_quota = summary['avg_quota_achievement_pct']
     st.metric(
         label="Avg Quota Achievement",
         value=f"{avg_quota:.1f}%" if pd.notna(avg_quota) else "N/A"
     )
 
 with col4:
-    total_yoy = filtered_df['yoy_change'].sum()
+    total_yoy = summary['total_yoy_change']
     st.metric(
         label="Total YoY Change",
         value=f"${total_yoy:,.0f}",
@@ -225,8 +243,8 @@ tab1, tab2, tab3 = st.tabs(["📊 By Salesperson", "🗺️ By Territory", "📈
 with tab1:
     st.subheader("Sales YTD by Salesperson")
     
-    # Prepare chart data - sorted by sales
-    chart_data = filtered_df[['salesperson_name', 'sales_ytd', 'territory_name']].copy()
+    # Prepare chart data - the top salespeople by sales
+    chart_data = top_salespeople_df[['salesperson_name', 'sales_ytd', 'territory_name']].copy()
     chart_data = chart_data.sort_values('sales_ytd', ascending=True)
     
     # Horizontal bar chart
@@ -235,16 +253,14 @@ with tab1:
         horizontal=True,
         height=max(400, len(chart_data) * 35)
     )
+    if summary['num_salespeople'] > len(chart_data):
+        st.caption(f"📌 Showing top {len(chart_data)} of {int(summary['num_salespeople'])} salespeople by sales YTD")
 
 with tab2:
     st.subheader("Total Sales by Territory")
     
-    # Aggregate by territory
-    territory_data = filtered_df.groupby('territory_name').agg({
-        'sales_ytd': 'sum',
-        'salesperson_name': 'count'
-    }).rename(columns={'salesperson_name': 'num_salespeople'}).reset_index()
-    territory_data = territory_data.sort_values('sales_ytd', ascending=False)
+    # Aggregated by territory in SQL Server
+    territory_data = load(territory_totals_sql(filters), filters.territories)
     
     col_chart, col_table = st.columns([2, 1])
     
@@ -270,8 +286,7 @@ with tab3:
     st.subheader("Year-over-Year Performance")
     
     # Prepare comparison data
-    comparison_data = filtered_df[['salesperson_name', 'sales_ytd', 'sales_last_year']].copy()
-    comparison_data = comparison_data.sort_values('sales_ytd', ascending=False).head(10)
+    comparison_data = top_salespeople_df[['salesperson_name', 'sales_ytd', 'sales_last_year']].head(10)
     comparison_data = comparison_data.set_index('salesperson_name')
     comparison_data.columns = ['This Year', 'Last Year']
     
@@ -290,7 +305,7 @@ col_display1, col_display2 = st.columns([1, 3])
 with col_display1:
     sort_by = st.selectbox(
         "Sort by",
-        options=['sales_ytd', 'yoy_change', 'quota_achievement_pct', 'salesperson_name'],
+        options=SORT_COLUMNS,
         format_func=lambda x: {
             'sales_ytd': 'Sales YTD',
             'yoy_change': 'YoY Change',
@@ -299,8 +314,10 @@ with col_display1:
         }.get(x, x)
     )
 
-# Sort and display
-display_df = filtered_df.sort_values(sort_by, ascending=(sort_by == 'salesperson_name'))
+# Sorted and limited in SQL Server
+display_df = load(salespeople_sql(filters, sort_by, TABLE_ROW_LIMIT), filters.territories)
+if summary['num_salespeople'] > len(display_df):
+    st.caption(f"Showing the first {len(display_df)} of {int(summary['num_salespeople'])} salespeople")
 
 st.dataframe(
     display_df,
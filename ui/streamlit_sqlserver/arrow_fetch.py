@@ -0,0 +1,97 @@
+# Arrow result fetching of the Sales Performance Dashboard (SQL Server).
+#
+# pandas.read_sql builds a list of row tuples, then infers a numpy dtype for
+# every column from those Python objects, boxing strings as objects. Here
+# the rows are fetched in batches of `batch_rows` (cursor.fetchmany) and each
+# batch becomes an Arrow record batch right away, with the column types taken
+# from cursor.description instead of being inferred:
+#
+#   - the DataFrame's columns are Arrow-backed (pd.ArrowDtype), so strings
+#     and nullable numbers are not boxed and Streamlit sends them to the
+#     browser without another conversion;
+#   - at most one batch of Python rows is alive at a time.
+#
+# Like read_sql (coerce_float), decimal and money columns arrive as floats.
+# pyodbc itself has no columnar fetch, so the rows still pass through Python
+# once; the connections stay the pooled pyodbc ones (connection_pool.py).
+
+import datetime
+import decimal
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+DEFAULT_BATCH_ROWS = 10000
+
+# cursor.description type code (a Python type) -> Arrow type. Decimals get
+# their precision and scale from the description, see arrow_type().
+ARROW_TYPES = {
+    bool: pa.bool_(),
+    int: pa.int64(),
+    float: pa.float64(),
+    str: pa.string(),
+    bytes: pa.binary(),
+    bytearray: pa.binary(),
+    datetime.datetime: pa.timestamp('us'),
+    datetime.date: pa.date32(),
+    datetime.time: pa.time64('us'),
+}
+
+
+def arrow_type(column):
+    """Arrow type of a cursor.description entry; other types are read as strings."""
+    _, type_code, _, _, precision, scale, _ = column
+    if type_code is decimal.Decimal:
+        if precision and precision <= 38:
+            return pa.decimal128(precision, scale or 0)
+        return pa.decimal256(min(precision or 76, 76), scale or 0)
+    return ARROW_TYPES.get(type_code, pa.string())
+
+
+def record_batches(cursor, batch_rows=DEFAULT_BATCH_ROWS):
+    """The schema of an executed cursor's result, and a generator of its record batches."""
+    schema = pa.schema([(column[0], arrow_type(column)) for column in cursor.description])
+    converters = [None if column[1] in ARROW_TYPES or column[1] is decimal.Decimal else str
+                  for column in cursor.description]
+
+    def batches():
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                return
+            columns = zip(*rows)
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(values if convert is None else [None if v is None else convert(v) for v in values],
+                          type=field.type)
+                 for values, field, convert in zip(columns, schema, converters)],
+                schema=schema)
+
+    return schema, batches()
+
+
+def read_arrow(conn, query, params=(), batch_rows=DEFAULT_BATCH_ROWS):
+    """Run a parameterized query and return its result as an Arrow table."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, list(params))
+        schema, batches = record_batches(cursor, batch_rows)
+        return pa.Table.from_batches(list(batches), schema=schema)
+    finally:
+        cursor.close()
+
+
+def arrow_frame(table):
+    """DataFrame of an Arrow table with Arrow-backed columns; decimals become int64 or float64."""
+    columns = []
+    for column in table.columns:
+        if pa.types.is_decimal(column.type):
+            column = pc.cast(column, pa.int64() if column.type.scale == 0 else pa.float64(), safe=False)
+        columns.append(column)
+    table = pa.Table.from_arrays(columns, names=table.column_names)
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def read_sql_arrow(query, conn, params=(), batch_rows=DEFAULT_BATCH_ROWS):
+    """pandas.read_sql(query, conn, params=params) through Arrow (see the module comment)."""
+    return arrow_frame(read_arrow(conn, query, params, batch_rows))
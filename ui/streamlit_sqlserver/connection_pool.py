@@ -0,0 +1,132 @@
+# Connection pool of the Sales Performance Dashboard (SQL Server).
+#
+# A pyodbc connection runs one query at a time, and one that was dropped
+# (server restart, network blip, idle timeout) stays broken. The dashboard
+# therefore borrows a connection per query from a bounded pool:
+#
+#   - at most `size` connections are open; a query waits up to
+#     `checkout_timeout` seconds for a free one;
+#   - a borrowed idle connection is validated with a cheap `SELECT 1`, and a
+#     broken one is replaced;
+#   - new connections are opened with exponential backoff between attempts;
+#   - every query runs with a `query_timeout` (pyodbc Connection.timeout);
+#   - a connection that raised a database error is closed, not returned
+#     (pandas.read_sql wraps the pyodbc error, see database_error()).
+
+import threading
+import time
+from contextlib import contextmanager
+
+import pyodbc
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_QUERY_TIMEOUT = 30
+DEFAULT_CHECKOUT_TIMEOUT = 30
+CONNECT_ATTEMPTS = 4
+BACKOFF_SECONDS = 0.5
+
+
+class PoolTimeoutError(Exception):
+    """No connection became free within the checkout timeout."""
+
+
+def database_error(exc):
+    """Return the pyodbc error behind `exc` (pandas re-raises it as its own DatabaseError), or None."""
+    while exc is not None and not isinstance(exc, pyodbc.Error):
+        exc = exc.__cause__
+    return exc
+
+
+class ConnectionPool:
+    """Bounded pool of validated pyodbc connections (see the module comment)."""
+
+    def __init__(self, connect, size=DEFAULT_POOL_SIZE, query_timeout=DEFAULT_QUERY_TIMEOUT,
+                 checkout_timeout=DEFAULT_CHECKOUT_TIMEOUT, attempts=CONNECT_ATTEMPTS, backoff=BACKOFF_SECONDS):
+        self._connect = connect
+        self.size = size
+        self.query_timeout = query_timeout
+        self.checkout_timeout = checkout_timeout
+        self.attempts = attempts
+        self.backoff = backoff
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        # Most recently used first: idle connections at the bottom time out
+        # on the server side and are replaced when next validated.
+        self._idle = []
+
+    def open(self):
+        """Open a new connection, retrying with exponential backoff."""
+        for attempt in range(self.attempts):
+            try:
+                conn = self._connect()
+                conn.timeout = self.query_timeout
+                return conn
+            except pyodbc.Error:
+                if attempt == self.attempts - 1:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    @staticmethod
+    def is_alive(conn):
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('SELECT 1').fetchone()
+            finally:
+                cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    @staticmethod
+    def discard(conn):
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+    def checkout(self):
+        """Return a validated connection; wait for a free slot first."""
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise PoolTimeoutError("All %d SQL Server connections are busy" % self.size)
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self.open()
+                if self.is_alive(conn):
+                    return conn
+                self.discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def checkin(self, conn, broken=False):
+        """Return `conn` to the pool, or close it when it is `broken`."""
+        try:
+            if broken:
+                self.discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of the `with` block."""
+        conn = self.checkout()
+        try:
+            yield conn
+        except BaseException as e:
+            self.checkin(conn, broken=database_error(e) is not None)
+            raise
+        self.checkin(conn)
+
+    def close(self):
+        """Close the idle connections (borrowed ones are closed when returned broken)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self.discard(conn)
@@ -0,0 +1,111 @@
+# Query layer of the Sales Performance Dashboard (SQL Server).
+#
+# The sidebar filters are pushed down into parameterized SQL (pyodbc `?`
+# markers), so every view fetches only what it shows: the filter choices,
+# one row of KPIs, one row per territory and a bounded list of salespeople.
+# Nothing is filtered or aggregated in pandas.
+
+from dataclasses import dataclass
+
+# Every view reads dbo.salesperson_metrics: salespeople with sales this
+# year, with the joins and the rank within their territory materialized by
+# salesperson_metrics.sql, so every view is a single-table scan. The rank is
+# computed before any filter, so "#1 in territory" does not change with the
+# sales threshold.
+
+# Version of the data behind each territory, for result_cache.py: the refresh
+# stamps every row it inserts or changes with refreshed_at, and a row that
+# leaves the territory changes its count.
+TERRITORY_VERSIONS = """
+SELECT
+    territory_name,
+    COUNT(*) AS num_salespeople,
+    MAX(refreshed_at) AS refreshed_at
+FROM dbo.salesperson_metrics
+GROUP BY territory_name
+"""
+
+# Columns the detail table can be sorted by (ORDER BY cannot be a parameter).
+SORT_COLUMNS = ['sales_ytd', 'yoy_change', 'quota_achievement_pct', 'salesperson_name']
+
+
+@dataclass(frozen=True)
+class SalespersonFilters:
+    """The sidebar selection (hashable, so views can be cached per selection)."""
+
+    regions: tuple = ()
+    territories: tuple = ()
+    min_sales: float = 0.0
+    top_only: bool = False
+
+
+def _in_list(column, values):
+    if not values:
+        # Nothing selected: nothing matches.
+        return '1 = 0', []
+    return '%s IN (%s)' % (column, ', '.join(['?'] * len(values))), list(values)
+
+
+def where_sql(filters):
+    """WHERE clause and parameters of `filters` over dbo.salesperson_metrics."""
+    conditions, params = [], []
+    for column, values in [('region_group', filters.regions), ('territory_name', filters.territories)]:
+        condition, values = _in_list(column, values)
+        conditions.append(condition)
+        params.extend(values)
+    conditions.append('sales_ytd >= ?')
+    params.append(filters.min_sales)
+    if filters.top_only:
+        conditions.append('rank_in_territory = 1')
+    return 'WHERE ' + ' AND '.join(conditions), params
+
+
+def filter_options_sql():
+    """One row per region and territory, with its salespeople count and sales range."""
+    return """
+SELECT region_group, territory_name, COUNT(*) AS num_salespeople,
+       MIN(sales_ytd) AS min_sales_ytd, MAX(sales_ytd) AS max_sales_ytd
+FROM dbo.salesperson_metrics
+GROUP BY region_group, territory_name
+ORDER BY region_group, territory_name
+""", []
+
+
+def summary_sql(filters):
+    """One row with the KPIs of the filtered salespeople."""
+    where, params = where_sql(filters)
+    return """
+SELECT COUNT(*) AS num_salespeople,
+       COALESCE(SUM(sales_ytd), 0) AS total_sales_ytd,
+       AVG(quota_achievement_pct) AS avg_quota_achievement_pct,
+       COALESCE(SUM(yoy_change), 0) AS total_yoy_change
+FROM dbo.salesperson_metrics
+%s
+""" % where, params
+
+
+def territory_totals_sql(filters):
+    """Sales and salespeople count per territory of the filtered salespeople."""
+    where, params = where_sql(filters)
+    return """
+SELECT territory_name, SUM(sales_ytd) AS sales_ytd, COUNT(*) AS num_salespeople
+FROM dbo.salesperson_metrics
+%s
+GROUP BY territory_name
+ORDER BY sales_ytd DESC
+""" % where, params
+
+
+def salespeople_sql(filters, sort_by='sales_ytd', limit=1000):
+    """The first `limit` filtered salespeople, sorted by `sort_by` (one of SORT_COLUMNS)."""
+    if sort_by not in SORT_COLUMNS:
+        raise ValueError("Cannot sort by %s" % sort_by)
+    where, params = where_sql(filters)
+    direction = 'ASC' if sort_by == 'salesperson_name' else 'DESC'
+    return """
+SELECT TOP (%d) territory_name, region_group, salesperson_name, sales_ytd, sales_last_year,
+       yoy_change, quota_achievement_pct, rank_in_territory
+FROM dbo.salesperson_metrics
+%s
+ORDER BY %s %s
+""" % (int(limit), where, sort_by, direction), params
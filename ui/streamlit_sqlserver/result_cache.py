@@ -0,0 +1,125 @@
+# Change-aware cache of the dashboard query results.
+#
+# A fixed TTL re-runs every query on expiry whether or not the data changed,
+# and the first user after expiry waits for all of them. Instead, results
+# are kept until the source data changes:
+#
+#   - a cheap version query (per territory: salespeople count and the
+#     latest refreshed_at of dbo.salesperson_metrics) runs at most once
+#     every `poll_seconds`;
+#   - a result remembers the versions of the territories it was computed
+#     from. When one of them changes (or the result is older than
+#     `max_age`, as a backstop),
+#     the stale result is still returned and a background thread re-runs
+#     the query; the next rerun gets the fresh one;
+#   - a change in one territory only refreshes the views that include it.
+#
+# Only the first request of a view waits for the database. A failed
+# background refresh is logged and the stale result kept, but not forever:
+# after `max_failures` failures in a row the entry is dropped, and an entry
+# older than `max_stale` is never served. Either way the next request runs
+# the query itself, so the user sees the error instead of old numbers.
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_POLL_SECONDS = 30
+DEFAULT_MAX_AGE = 3600
+DEFAULT_MAX_STALE = 4 * DEFAULT_MAX_AGE
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_FAILURES = 3
+REFRESH_THREADS = 2
+
+log = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Query results kept until their source version changes (see the module comment)."""
+
+    def __init__(self, run, versions, poll_seconds=DEFAULT_POLL_SECONDS, max_age=DEFAULT_MAX_AGE,
+                 max_stale=DEFAULT_MAX_STALE, max_entries=DEFAULT_MAX_ENTRIES, max_failures=DEFAULT_MAX_FAILURES):
+        # run(query, params) -> DataFrame; versions() -> {dependency: version}
+        self._run = run
+        self._versions = versions
+        self.poll_seconds = poll_seconds
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (query, params) -> (version, fetched_at, result)
+        self._refreshing = set()
+        self._failures = {}             # (query, params) -> failed refreshes in a row
+        self._current = None
+        self._checked_at = 0.0
+        self._pool = ThreadPoolExecutor(max_workers=REFRESH_THREADS, thread_name_prefix='cache-refresh')
+
+    def versions(self):
+        """The source versions, queried at most once every `poll_seconds`."""
+        with self._lock:
+            if self._current is not None and time.monotonic() - self._checked_at < self.poll_seconds:
+                return self._current
+        current = self._versions()
+        with self._lock:
+            self._current, self._checked_at = current, time.monotonic()
+        return current
+
+    @staticmethod
+    def version_of(versions, dependencies):
+        """The part of `versions` a result depends on (all of it when `dependencies` is None)."""
+        if dependencies is None:
+            return tuple(sorted(versions.items(), key=repr))
+        return tuple((dependency, versions.get(dependency)) for dependency in sorted(dependencies, key=repr))
+
+    def _store(self, key, version, result):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), result)
+            self._entries.move_to_end(key)
+            self._failures.pop(key, None)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._failures.pop(evicted, None)
+
+    def _refresh(self, key, version):
+        try:
+            result = self._run(*key)
+        except Exception:
+            with self._lock:
+                failures = self._failures.get(key, 0) + 1
+                self._failures[key] = failures
+                evicted = failures >= self.max_failures
+                if evicted:
+                    self._entries.pop(key, None)
+                    self._failures.pop(key, None)
+            log.warning("Background refresh of a cached result (params %r) failed %d time(s) in a row; %s",
+                        key[1], failures, 'dropped the entry' if evicted else 'serving the stale result',
+                        exc_info=True)
+        else:
+            self._store(key, version, result)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, query, params=(), dependencies=None):
+        """Result of `query`, computed from the sources `dependencies` (None: all of them)."""
+        key = (query, tuple(params))
+        version = self.version_of(self.versions(), dependencies)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                cached_version, fetched_at, result = entry
+                age = time.monotonic() - fetched_at
+                # Too old to serve: its refreshes keep failing, run the query here.
+                if age <= self.max_stale:
+                    stale = cached_version != version or age > self.max_age
+                    if stale and key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._pool.submit(self._refresh, key, version)
+                    return result
+        result = self._run(*key)
+        self._store(key, version, result)
+        return result
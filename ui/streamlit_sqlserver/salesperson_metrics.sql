@@ -0,0 +1,169 @@
+use AdventureWorks2017
+GO
+
+-- Materialized salesperson metrics behind the Sales Performance Dashboard.
+--
+-- The dashboard reads dbo.salesperson_metrics with a single-table scan. The
+-- four-table join and the RANK() over each territory run here, once per data
+-- change, instead of on every page load:
+--
+--   dbo.usp_refresh_salesperson_metrics compares a cheap version of the
+--   sources (salespeople count and latest ModifiedDate of the joined rows)
+--   with the one of the last refresh and returns at once when nothing
+--   changed. Otherwise a MERGE rewrites only the rows that differ (in one
+--   transaction, so readers never see a half-refreshed table) and stamps
+--   them with refreshed_at, which is the dashboard's cache version.
+--
+--   A SQL Server Agent job runs it every minute (the container needs
+--   MSSQL_AGENT_ENABLED=true). After a write that does not touch
+--   ModifiedDate, force a rebuild:
+--
+--   EXEC dbo.usp_refresh_salesperson_metrics @force = 1;
+
+-- Step 1: summary table, one row per salesperson with sales this year
+IF OBJECT_ID('dbo.salesperson_metrics', 'U') IS NULL
+CREATE TABLE dbo.salesperson_metrics (
+    BusinessEntityID int NOT NULL PRIMARY KEY,
+    territory_name nvarchar(50) NULL,
+    region_group nvarchar(50) NULL,
+    salesperson_name nvarchar(101) NOT NULL,
+    sales_ytd money NOT NULL,
+    sales_last_year money NOT NULL,
+    yoy_change money NOT NULL,
+    quota_achievement_pct numeric(19, 2) NULL,
+    rank_in_territory bigint NOT NULL,
+    refreshed_at datetime2(3) NOT NULL
+);
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_salesperson_metrics_territory')
+CREATE INDEX IX_salesperson_metrics_territory
+    ON dbo.salesperson_metrics (territory_name) INCLUDE (refreshed_at);
+GO
+
+-- Step 2: version of the sources at the last refresh (a single row)
+IF OBJECT_ID('dbo.salesperson_metrics_state', 'U') IS NULL
+CREATE TABLE dbo.salesperson_metrics_state (
+    source_version nvarchar(200) NOT NULL,
+    refreshed_at datetime2(3) NOT NULL
+);
+GO
+
+-- Step 3: refresh procedure
+CREATE OR ALTER PROCEDURE dbo.usp_refresh_salesperson_metrics
+    @force bit = 0
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+
+    -- The joins only touch the salespeople's rows, so this stays cheap on large Person tables.
+    DECLARE @version nvarchar(200);
+    SELECT @version = CONCAT(COUNT(*), '|', MAX(sp.ModifiedDate), '|', MAX(e.ModifiedDate), '|',
+                             MAX(per.ModifiedDate), '|', MAX(st.ModifiedDate))
+    FROM Sales.SalesPerson sp
+    INNER JOIN HumanResources.Employee e
+        ON sp.BusinessEntityID = e.BusinessEntityID
+    INNER JOIN Person.Person per
+        ON e.BusinessEntityID = per.BusinessEntityID
+    LEFT JOIN Sales.SalesTerritory st
+        ON sp.TerritoryID = st.TerritoryID;
+
+    IF @force = 0 AND EXISTS (SELECT 1 FROM dbo.salesperson_metrics_state WHERE source_version = @version)
+        RETURN 0;
+
+    DECLARE @now datetime2(3) = SYSUTCDATETIME();
+
+    BEGIN TRANSACTION;
+
+    WITH salesperson AS (
+        SELECT
+            sp.BusinessEntityID,
+            CONCAT(per.FirstName, ' ', per.LastName) AS salesperson_name,
+            st.Name AS territory_name,
+            st.[Group] AS region_group,
+            sp.SalesYTD AS sales_ytd,
+            sp.SalesLastYear AS sales_last_year,
+            COALESCE(sp.SalesYTD, 0) - COALESCE(sp.SalesLastYear, 0) AS yoy_change,
+            CASE
+                WHEN sp.SalesQuota > 0
+                THEN ROUND((sp.SalesYTD / sp.SalesQuota) * 100, 2)
+                ELSE NULL
+            END AS quota_achievement_pct
+        FROM Sales.SalesPerson sp
+        INNER JOIN HumanResources.Employee e
+            ON sp.BusinessEntityID = e.BusinessEntityID
+        INNER JOIN Person.Person per
+            ON e.BusinessEntityID = per.BusinessEntityID
+        LEFT JOIN Sales.SalesTerritory st
+            ON sp.TerritoryID = st.TerritoryID
+        WHERE sp.SalesYTD > 0
+    ),
+    ranked AS (
+        SELECT
+            *,
+            RANK() OVER (PARTITION BY territory_name ORDER BY sales_ytd DESC) AS rank_in_territory
+        FROM salesperson
+    )
+    MERGE dbo.salesperson_metrics WITH (HOLDLOCK) AS t
+    USING ranked AS s
+        ON t.BusinessEntityID = s.BusinessEntityID
+    WHEN MATCHED AND EXISTS (
+        SELECT s.territory_name, s.region_group, s.salesperson_name, s.sales_ytd, s.sales_last_year,
+               s.yoy_change, s.quota_achievement_pct, s.rank_in_territory
+        EXCEPT
+        SELECT t.territory_name, t.region_group, t.salesperson_name, t.sales_ytd, t.sales_last_year,
+               t.yoy_change, t.quota_achievement_pct, t.rank_in_territory
+    ) THEN UPDATE SET
+        territory_name = s.territory_name,
+        region_group = s.region_group,
+        salesperson_name = s.salesperson_name,
+        sales_ytd = s.sales_ytd,
+        sales_last_year = s.sales_last_year,
+        yoy_change = s.yoy_change,
+        quota_achievement_pct = s.quota_achievement_pct,
+        rank_in_territory = s.rank_in_territory,
+        refreshed_at = @now
+    WHEN NOT MATCHED BY TARGET THEN INSERT
+        (BusinessEntityID, territory_name, region_group, salesperson_name, sales_ytd, sales_last_year,
+         yoy_change, quota_achievement_pct, rank_in_territory, refreshed_at)
+        VALUES (s.BusinessEntityID, s.territory_name, s.region_group, s.salesperson_name, s.sales_ytd,
+                s.sales_last_year, s.yoy_change, s.quota_achievement_pct, s.rank_in_territory, @now)
+    WHEN NOT MATCHED BY SOURCE THEN DELETE;
+
+    DELETE FROM dbo.salesperson_metrics_state;
+    INSERT INTO dbo.salesperson_metrics_state (source_version, refreshed_at) VALUES (@version, @now);
+
+    COMMIT TRANSACTION;
+    RETURN 1;
+END
+GO
+
+-- Step 4: first load
+EXEC dbo.usp_refresh_salesperson_metrics @force = 1;
+GO
+
+-- Step 5: refresh every minute with SQL Server Agent
+IF NOT EXISTS (SELECT 1 FROM msdb.dbo.sysjobs WHERE name = 'Refresh salesperson_metrics')
+BEGIN
+    EXEC msdb.dbo.sp_add_job @job_name = 'Refresh salesperson_metrics';
+    EXEC msdb.dbo.sp_add_jobstep
+        @job_name = 'Refresh salesperson_metrics',
+        @step_name = 'Refresh',
+        @subsystem = 'TSQL',
+        @database_name = 'AdventureWorks2017',
+        @command = 'EXEC dbo.usp_refresh_salesperson_metrics;';
+    EXEC msdb.dbo.sp_add_jobschedule
+        @job_name = 'Refresh salesperson_metrics',
+        @name = 'Every minute',
+        @freq_type = 4,
+        @freq_interval = 1,
+        @freq_subday_type = 4,
+        @freq_subday_interval = 1;
+    EXEC msdb.dbo.sp_add_jobserver @job_name = 'Refresh salesperson_metrics';
+END
+GO
+
+-- Step 6: quick verify
+-- select * from dbo.salesperson_metrics order by territory_name, rank_in_territory;
+-- select * from dbo.salesperson_metrics_state;